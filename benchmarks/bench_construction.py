@@ -0,0 +1,53 @@
+"""
+Construction time of the d-propagation matrices against the number of modes.
+
+Compares QuantumHall._d_propagation_matrix with the element-wise
+loops it replaced. Run from the repository root:
+
+    python benchmarks/bench_construction.py
+"""
+import os
+import sys
+import timeit
+
+import numpy as np
+
+sys.path.insert( 0, os.path.join( os.path.dirname( os.path.abspath(__file__) ), '..' ) )
+from src.quantumHall import QuantumHall
+
+
+def loop_construction(qh):
+    # the former generator-based construction, kept as the reference point
+    return np.matrix(
+        [
+            [ qh.chirality_vector[b]/qh.charge_vector[b]*(qh.charge_conduct_matrix[a,b]-
+        np.identity(qh.num_modes)[a,b]*sum(qh.charge_conduct_matrix[a,c] for c in range(qh.num_modes)) )
+                                                     for b in range(qh.num_modes)
+            ]
+                                                  for a in range(qh.num_modes)
+        ]
+                                                   )
+
+
+def main(mode_counts=(1,2,4,6,8,10,16,32), repeat=5):
+    rng = np.random.default_rng(0)
+    print( '{:>6} {:>14} {:>14} {:>9}'.format( 'modes', 'loops (us)', 'arrays (us)', 'speedup' ) )
+    for num_modes in mode_counts:
+        conduct_matrix = rng.uniform( 0, 1, (num_modes,num_modes) )
+        qh = QuantumHall( chirality_vector=rng.choice( [1,-1], num_modes ),
+                          charge_vector=rng.uniform( 0.5, 2, num_modes ),
+                          charge_conduct_matrix=conduct_matrix+conduct_matrix.T,
+                          heat_conduct_matrix=conduct_matrix+conduct_matrix.T )
+
+        assert np.allclose( loop_construction(qh), qh.charge_d_propagation_matrix )
+
+        number = max( 1, 2000//num_modes**2 )
+        # the loop version builds one matrix, the array version both charge and heat
+        loops = 2*min( timeit.repeat( lambda: loop_construction(qh), number=number, repeat=repeat ) )/number
+        arrays = min( timeit.repeat( lambda: ( qh._d_propagation_matrix('charge'), qh._d_propagation_matrix('heat') ),
+                                     number=number, repeat=repeat ) )/number
+        print( '{:>6} {:>14.1f} {:>14.1f} {:>8.1f}x'.format( num_modes, loops*1e6, arrays*1e6, loops/arrays ) )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+"""
+Import time of the core against the full GUI stack, in fresh interpreters.
+
+Guards the lazy imports of the package: importing src and using QuantumHall
+must not load matplotlib, ipywidgets or SciPy. Run from the repository root:
+
+    python benchmarks/bench_import.py
+"""
+import os
+import subprocess
+import sys
+
+root = os.path.join( os.path.dirname( os.path.abspath(__file__) ), '..' )
+
+# modules that the core must not pull in
+heavy_modules = ( 'matplotlib', 'ipywidgets', 'scipy' )
+
+statements = {
+    'core': 'import src; src.QuantumHall( num_terminals=4 ).conductance_tensor()',
+    'network': 'import src; src.EdgeNetwork',
+    'gui': 'import src; src.QuantumHallInteractive; src.DrawQuantumHall',
+}
+
+
+def import_time(statement, repeat):
+    """
+    Best wall time of the statement in a fresh interpreter, and the heavy modules it loaded.
+    """
+    script = ( 'import sys, time\n'
+               'start = time.perf_counter()\n'
+               '{}\n'
+               'elapsed = time.perf_counter()-start\n'
+               'print( elapsed, *[ name for name in {!r} if name in sys.modules ] )\n' ).format( statement, heavy_modules )
+    best, loaded = float('inf'), []
+    for _ in range(repeat):
+        output = subprocess.run( [ sys.executable, '-c', script ], cwd=root, check=True,
+                                 capture_output=True, text=True ).stdout.split()
+        best, loaded = min( best, float(output[0]) ), output[1:]
+    return best, loaded
+
+
+def main(repeat=5):
+    print( '{:>8} {:>12}  {}'.format( 'import', 'time (ms)', 'heavy modules loaded' ) )
+    results = {}
+    for name, statement in statements.items():
+        try:
+            results[name] = import_time( statement, repeat )
+        except subprocess.CalledProcessError:
+            # the extras of this stack are not installed
+            print( '{:>8} {:>12}'.format( name, 'unavailable' ) )
+            continue
+        elapsed, loaded = results[name]
+        print( '{:>8} {:>12.1f}  {}'.format( name, elapsed*1e3, ', '.join(loaded) or '-' ) )
+
+    if results['core'][1]:
+        sys.exit( 'the core import loaded {}'.format( ', '.join( results['core'][1] ) ) )
+
+
+if __name__ == '__main__':
+    main()
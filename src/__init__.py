@@ -0,0 +1,51 @@
+"""
+Conductance of quantum Hall edges in multi-terminal settings.
+
+The core (QuantumHall and the batched solvers) only needs NumPy and is imported here.
+Everything else is imported on first use, so that headless runs never load
+matplotlib, ipywidgets or SciPy:
+- QuantumHallInteractive (ipywidgets), DrawQuantumHall (matplotlib)
+- ConductanceFit, EdgeNetwork, FloatingContactSolver (SciPy)
+- ParameterGrid, DisorderEnsemble, ConductanceTable and the other extras
+"""
+import importlib
+
+from .quantumHall import ( QuantumHall, EigenCache, eig_cache, TransportResult, MultiTerminalResistance,
+                           conductance_tensor_batch, two_terminal_conductance_batch,
+                           four_terminal_conductance_batch, sigma0, kappa0 )
+
+# names loaded on first use and the modules that define them
+_lazy = {
+    'QuantumHallInteractive': 'quantumHall_interactive',
+    'DrawQuantumHall': 'quantumHall_draw',
+    'ParameterGrid': 'quantumHall_sweep',
+    'run_sweep': 'quantumHall_sweep',
+    'stream_sweep': 'quantumHall_sweep',
+    'SweepSink': 'quantumHall_sweep',
+    'Measurement': 'quantumHall_fit',
+    'ConductanceFit': 'quantumHall_fit',
+    'FitResult': 'quantumHall_fit',
+    'RunningStatistics': 'quantumHall_ensemble',
+    'DisorderEnsemble': 'quantumHall_ensemble',
+    'EnsembleResult': 'quantumHall_ensemble',
+    'EdgeNetwork': 'quantumHall_network',
+    'FloatingContactSolver': 'quantumHall_floating',
+    'FloatingResult': 'quantumHall_floating',
+    'ConductanceTable': 'quantumHall_lookup',
+    'preset_axes': 'quantumHall_lookup',
+}
+
+__all__ = [ 'QuantumHall', 'EigenCache', 'eig_cache', 'TransportResult', 'MultiTerminalResistance',
+            'conductance_tensor_batch', 'two_terminal_conductance_batch', 'four_terminal_conductance_batch',
+            'sigma0', 'kappa0' ]+list(_lazy)
+
+def __getattr__(name):
+    if name not in _lazy:
+        raise AttributeError('module {!r} has no attribute {!r}'.format( __name__, name ))
+    value = getattr( importlib.import_module( '.'+_lazy[name], __name__ ), name )
+    # later lookups find it in the module dictionary
+    globals()[name] = value
+    return value
+
+def __dir__():
+    return sorted( set( globals() ) | set(_lazy) )
@@ -1,3 +1,8 @@
+import hashlib
+import math
+import threading
+from collections import OrderedDict
+
 import numpy as np
 import numpy.linalg as la
 
@@ -5,131 +10,1097 @@ import numpy.linalg as la
 sigma0 = 3.87404e-5
 kappa0 = 9.464298e-13
 
+class EigenCache:
+    """
+    LRU cache of eigendecompositions of d-propagation matrices.
+    Entries are keyed by a hash of the matrix bytes and the chirality vector,
+    so repeated evaluations of the same edge skip LAPACK entirely.
+    A maxsize of 0 disables the cache.
+    """
+    def __init__(self, maxsize=256):
+        self.maxsize = int(maxsize)
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(matrix, chirality_vector):
+        digest = hashlib.blake2b( digest_size=16 )
+        digest.update( repr( (matrix.shape, matrix.dtype.str) ).encode() )
+        digest.update( matrix.tobytes() )
+        digest.update( np.ascontiguousarray( chirality_vector, dtype=float ).tobytes() )
+        return digest.digest()
+
+    def eig(self, matrix, chirality_vector):
+        """
+        Returns (eigvals, eigvecs) of matrix like numpy.linalg.eig.
+        The returned arrays are shared between callers and therefore read-only.
+        """
+        matrix = np.ascontiguousarray( matrix, dtype=float )
+        key = self._key( matrix, chirality_vector )
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+            self.misses += 1
+
+        eigvals , eigvecs = la.eig( matrix )
+        eigvals.setflags( write=False )
+        eigvecs.setflags( write=False )
+
+        with self._lock:
+            if self.maxsize > 0:
+                self._entries[key] = (eigvals, eigvecs)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.maxsize:
+                    self._entries.popitem( last=False )
+        return eigvals, eigvecs
+
+    def eig_batch(self, matrices, chirality_vector):
+        """
+        eig for a stack of matrices of shape (batch, modes, modes) sharing one chirality vector.
+        The distinct matrices missing from the cache are diagonalised together in one LAPACK
+        batch, so repeated matrices within the stack are diagonalised only once.
+        """
+        matrices = np.ascontiguousarray( matrices, dtype=float )
+        keys = [ self._key( matrix, chirality_vector ) for matrix in matrices ]
+        results = [None]*len(keys)
+        with self._lock:
+            for index, key in enumerate(keys):
+                if key in self._entries:
+                    self._entries.move_to_end(key)
+                    results[index] = self._entries[key]
+            self.hits += sum( result is not None for result in results )
+            # first index of every distinct matrix that is not cached
+            missing = {}
+            for index, result in enumerate(results):
+                if result is None:
+                    missing.setdefault( keys[index], index )
+            self.misses += len(missing)
+
+        if missing:
+            eigvals , eigvecs = la.eig( matrices[ list( missing.values() ) ] )
+            with self._lock:
+                computed = {}
+                for key, values, vectors in zip( missing, eigvals, eigvecs ):
+                    values.setflags( write=False )
+                    vectors.setflags( write=False )
+                    computed[key] = (values, vectors)
+                    if self.maxsize > 0:
+                        self._entries[key] = computed[key]
+                        self._entries.move_to_end(key)
+                while len(self._entries) > max( self.maxsize, 0 ):
+                    self._entries.popitem( last=False )
+            results = [ computed[key] if result is None else result for key, result in zip( keys, results ) ]
+
+        return np.stack( [ result[0] for result in results ] ), np.stack( [ result[1] for result in results ] )
+
+    def resize(self, maxsize):
+        """Changes the size bound, evicting the least recently used entries if needed."""
+        with self._lock:
+            self.maxsize = int(maxsize)
+            while len(self._entries) > max( self.maxsize, 0 ):
+                self._entries.popitem( last=False )
+
+    def clear(self):
+        """Drops all entries and resets the hit/miss counters."""
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def info(self):
+        with self._lock:
+            return { 'hits':self.hits, 'misses':self.misses,
+                     'size':len(self._entries), 'maxsize':self.maxsize }
+
+    def __len__(self):
+        return len(self._entries)
+
+# shared by all QuantumHall instances
+eig_cache = EigenCache()
+
+def _d_propagation_matrices(chirality_vectors, charge_vectors, conduct_matrices):
+    """
+    Builds a stack of d-propagation matrices
+    - chirality_vectors, charge_vectors: shape (..., modes)
+    - conduct_matrices: shape (..., modes, modes)
+    """
+    chirality_vectors = np.asarray( chirality_vectors )
+    conduct_matrices = np.asarray( conduct_matrices, dtype=float )
+    num_modes = conduct_matrices.shape[-1]
+    # subtract the row sums from the diagonal, then scale the columns by chirality/charge
+    exchange = conduct_matrices - np.identity(num_modes)*conduct_matrices.sum(axis=-1)[...,None]
+    return exchange*( chirality_vectors/np.asarray( charge_vectors, dtype=float ) )[...,None,:]
+
+def _terminal_coefficients(eigvals, eigvecs, chirality_vectors, charge_vectors, lengths):
+    """
+    Returns the currents d_plus and d_minus leaving the left terminal of every
+    segment for a unit potential at its left and right terminal, respectively.
+    - eigvals: shape (batch, modes), eigvecs: shape (batch, modes, modes)
+    - chirality_vectors, charge_vectors: shape (batch, modes)
+    - lengths: shape (batch, terminals), np.inf for a fully equilibrated segment
+    The batch axes are broadcast against each other.
+    """
+    solution_coeffs, decay = _eigen_solution( eigvals, eigvecs, chirality_vectors, charge_vectors, lengths )
+
+    # total current at the left end of the segment
+    eigvecs_sum = eigvecs.sum(axis=1)
+    left_end = decay( np.zeros( (len(eigvecs_sum),1) ) )[...,0,:]
+    d = np.real( np.sum( (eigvecs_sum[:,None,:]*left_end)[...,None]*solution_coeffs, axis=-2 ) )
+    return d[...,0], d[...,1]
+
+def _ac_terminal_coefficients(d_propagation_matrices, chirality_vectors, charge_vectors, lengths):
+    """
+    Complex currents leaving the left terminal and reaching the right terminal of every segment
+    for unit potentials oscillating at the left and the right terminal, from the complex
+    d-propagation matrices M + i omega diag(chi/v) of shape (batch, modes, modes).
+    Charge piles up along the segment, so the two ends carry different currents.
+    Returns (left_plus, left_minus, right_plus, right_minus), each of shape (batch, terminals).
+    """
+    if not np.all( np.isfinite(lengths) ):
+        raise ValueError('The AC response needs finite segment lengths')
+    if d_propagation_matrices.shape[-1] == 2:
+        d = _two_mode_ac_ends( d_propagation_matrices, chirality_vectors, charge_vectors, lengths )
+    else:
+        d = _eigen_ac_ends( d_propagation_matrices, chirality_vectors, charge_vectors, lengths )
+    return d[:,0,:,0], d[:,0,:,1], d[:,1,:,0], d[:,1,:,1]
+
+def _eigen_ac_ends(d_propagation_matrices, chirality_vectors, charge_vectors, lengths, contour_points=16):
+    """
+    Total currents at the left and the right end of every segment, shape (batch, 2, terminals, 2),
+    from the eigendecomposition of the complex d-propagation matrices. Where M is (nearly) defective,
+    e.g. counter-propagating modes with equal charges at omega = 0, the eigenvectors are close to
+    parallel and the currents are instead the mean over a small circle of matrices M + z diag(1..2)
+    around M: they are analytic in z, so the mean converges quickly to their value at M.
+    """
+    eigvals , eigvecs = la.eig( d_propagation_matrices )
+    solution_coeffs, decay = _eigen_solution( eigvals, eigvecs, chirality_vectors, charge_vectors, lengths )
+    ends = decay( np.broadcast_to( np.array( [0.0,1.0] ), (len(eigvecs),2) ) )
+    d = np.einsum( 'ba,btea,btar->betr', eigvecs.sum(axis=1), ends, solution_coeffs )
+
+    defective = la.cond(eigvecs) > 1/np.sqrt( np.finfo(float).eps )
+    if contour_points and np.any(defective):
+        batch, num_modes = len(d_propagation_matrices), d_propagation_matrices.shape[-1]
+        chirality_vectors = np.broadcast_to( chirality_vectors, (batch,num_modes) )[defective]
+        charge_vectors = np.broadcast_to( charge_vectors, (batch,num_modes) )[defective]
+        lengths = np.broadcast_to( lengths, (batch,lengths.shape[-1]) )[defective]
+        matrices = d_propagation_matrices[defective]
+
+        # a Jordan block splits by about sqrt(z |M|), which should stay small over the segment
+        scales = np.max( np.abs(matrices), axis=(-2,-1) )
+        radii = 1e-3*scales/( 1+( scales*np.max( lengths, axis=-1 ) )**2 )
+        circle = np.exp( 2j*np.pi*np.arange(contour_points)/contour_points )
+        shifts = ( circle[:,None]*radii )[...,None,None]*np.diag( np.linspace( 1, 2, num_modes ) )
+        # every point of the circle is one batch entry
+        tile = lambda array: np.tile( array, (contour_points,1) )
+        points = _eigen_ac_ends( ( matrices[None]+shifts ).reshape( (-1,num_modes,num_modes) ),
+                                 tile(chirality_vectors), tile(charge_vectors), tile(lengths), 0 )
+        d[defective] = points.reshape( (contour_points,)+d[defective].shape ).mean(axis=0)
+    return d
+
+def _two_mode_ac_ends(d_propagation_matrices, chirality_vectors, charge_vectors, lengths):
+    """
+    Total currents at the left and the right end of every segment of two modes in closed form,
+    see _eigen_ac_ends for the shape. By Cayley-Hamilton
+        exp(M x) = exp(t x/2) ( cosh(s x) + (M-t/2) sinh(s x)/s ),    t = tr(M), s^2 = t^2/4-det(M)
+    which also holds when M is defective. For counter-propagating modes the boundary conditions
+    are solved with the exponentials taken relative to the eigenvalues t/2 +- s, Re(s) >= 0,
+    so that none exceeds one (as _two_mode_system does for DC), whatever the length.
+    """
+    batch = len(d_propagation_matrices)
+    chirality_vectors = np.broadcast_to( chirality_vectors, (batch,2) )
+    lengths = np.broadcast_to( lengths, (batch,lengths.shape[-1]) )
+    # the positive mode first, the currents summed over the modes do not depend on the order
+    order = np.argsort( -chirality_vectors, axis=-1, kind='stable' )
+    rows = np.arange(batch)[:,None]
+    matrices = d_propagation_matrices[ rows[...,None], order[:,:,None], order[:,None,:] ]
+    emanating_currents = _emanating_currents( chirality_vectors[rows,order],
+                                              np.broadcast_to( charge_vectors, (batch,2) )[rows,order] )
+    chirality_vectors = chirality_vectors[rows,order]
+
+    trace = ( matrices[:,0,0]+matrices[:,1,1] )[:,None]
+    s = np.sqrt( trace**2/4 - ( matrices[:,0,0]*matrices[:,1,1]-matrices[:,0,1]*matrices[:,1,0] )[:,None] + 0j )
+    s = np.where( s.real < 0, -s, s )
+    traceless = ( matrices - trace[...,None]/2*np.identity(2) )[:,None]
+
+    def propagator(x):
+        # exp(M x) of shape (batch, terminals, 2, 2), for the modes of a single chirality
+        with np.errstate( over='ignore', invalid='ignore' ):
+            ratio = np.where( s == 0, x, np.sinh( s*x )/np.where( s == 0, 1, s ) )
+            return np.exp( trace*x/2 )[...,None,None]*( np.cosh( s*x )[...,None,None]*np.identity(2)
+                                                       + traceless*ratio[...,None,None] )
+
+    with np.errstate( over='ignore', invalid='ignore', divide='ignore' ):
+        # exp(-M L) relative to exp(-(t/2+s) L)
+        ratio = np.where( s == 0, lengths, -np.expm1( -2*s*lengths )/np.where( s == 0, 1, 2*s ) )
+        scaled = ( 1+np.exp( -2*s*lengths ) )[...,None,None]/2*np.identity(2) + traceless*ratio[...,None,None]
+        # I_0(0) and I_1(L) are given, see _emanating_currents
+        given_left, given_right = emanating_currents[:,None,0,:], emanating_currents[:,None,1,:]
+        pivot = scaled[...,1,1][...,None]
+        left = given_left + ( np.exp( -(trace/2+s)*lengths )[...,None]*given_right - scaled[...,1,0][...,None]*given_left )/pivot
+        right = given_right + ( np.exp( (trace/2-s)*lengths )[...,None]*given_left + scaled[...,0,1][...,None]*given_right )/pivot
+
+        positive = np.einsum( 'btjk,bkr->btr', propagator(lengths), emanating_currents )
+        negative = np.einsum( 'btjk,bkr->btr', propagator(-lengths), emanating_currents )
+    ends = np.stack( [ np.where( ( chirality_vectors[:,1] > 0 )[:,None,None], emanating_currents.sum(axis=1)[:,None],
+                                 np.where( ( chirality_vectors[:,0] < 0 )[:,None,None], negative, left ) ),
+                       np.where( ( chirality_vectors[:,1] > 0 )[:,None,None], positive,
+                                 np.where( ( chirality_vectors[:,0] < 0 )[:,None,None], emanating_currents.sum(axis=1)[:,None], right ) ) ],
+                     axis=1 )
+    if not np.all( np.isfinite(ends) ):
+        raise la.LinAlgError('Singular matrix')
+    return ends
+
+def _eigen_solution(eigvals, eigvecs, chirality_vectors, charge_vectors, lengths):
+    """
+    Solves the boundary conditions of every segment in the eigenbasis, see _terminal_coefficients
+    for the shapes. Every eigenmode is measured from the end of the segment where it is largest,
+    i.e. I(x) = sum_a c_a eigvecs[:,a] exp( eigval[a]*(x-shift[a]*L) ) with shift = 1
+    for growing modes, so that no exponential exceeds one, whatever the length.
+    Returns
+    - solution_coeffs: c_a for the currents emanating from the left and the right terminal,
+      shape (batch, terminals, modes, 2)
+    - decay: maps positions, as fractions of the segments of shape (batch, P), to the
+      exponentials exp( eigval[a]*(x-shift[a]*L) ) of shape (batch, terminals, P, modes)
+    """
+    eigvals = np.asarray( eigvals )
+    shift = ( eigvals.real > 0 ).astype(float)
+
+    # on an infinite segment only the decaying modes and the conserved ones (the zero mode
+    # M.(q*chi) = 0 and the eigenvalues at rounding level) are kept
+    magnitudes = np.abs(eigvals)
+    conserved = magnitudes <= 64*eigvals.shape[-1]*np.finfo(float).eps*np.max( magnitudes, axis=-1, keepdims=True )
+    conserved[ np.arange( len(eigvals) ), np.argmin( magnitudes, axis=-1 ) ] = True
+    conserved = conserved[:,None,None,:] & np.isinf(lengths)[:,:,None,None]
+
+    # zero if positive and 1 if negative
+    zeroone_vec = (1-chirality_vectors)/2
+
+    def decay(positions):
+        # exp( eigval[a]*(positions-shift[a])*L ) for positions of shape (batch, 1 or modes)
+        offsets = positions[:,None,:,None] - shift[:,None,None,:]
+        with np.errstate( invalid='ignore' ):
+            exponents = eigvals[:,None,None,:]*offsets*lengths[:,:,None,None]
+        return np.exp( np.where( (offsets == 0) | conserved, 0, exponents ) )
+
+    # propagation_matrix[b,t,j,a] = exp( eigval[a]*(zeroone_vec[j]-shift[a])*L[t] )*eigvecs[j,a]
+    propagation_matrix = decay( zeroone_vec )*eigvecs[:,None,:,:]
+
+    # currents emanating from the left (d_plus) and the right (d_minus) terminals
+    emanating_currents = np.broadcast_to( _emanating_currents( chirality_vectors, charge_vectors )[:,None,:,:],
+                                          propagation_matrix.shape[:-1]+(2,) )
+
+    return la.solve( propagation_matrix, emanating_currents ), decay
+
+def _emanating_currents(chirality_vectors, charge_vectors):
+    """
+    Currents injected into the modes by a unit potential at the left (d_plus)
+    and the right (d_minus) terminal of a segment, stacked on the last axis.
+    """
+    return np.stack( [ chirality_vectors*charge_vectors*(1+chirality_vectors)/2,
+                       chirality_vectors*charge_vectors*(1-chirality_vectors)/2 ], axis=-1 )
+
+def _one_mode_coefficients(chirality_vectors, charge_vectors, lengths):
+    """
+    d_plus and d_minus of a single mode: nothing to equilibrate with, so
+    the injected current reaches the other terminal unchanged.
+    """
+    emanating_currents = _emanating_currents( chirality_vectors[:,0], charge_vectors[:,0] )
+    shape = np.broadcast_shapes( emanating_currents.shape[:1]+(1,), lengths.shape )
+    return np.broadcast_to( emanating_currents[:,None,0], shape ), np.broadcast_to( emanating_currents[:,None,1], shape )
+
+def _two_mode_trace(d_propagation_matrices):
+    # tr(M) of shape (batch, 1), zero at rounding level
+    trace = d_propagation_matrices[:,0,0] + d_propagation_matrices[:,1,1]
+    scale = np.max( np.abs(d_propagation_matrices), axis=(-2,-1) )
+    return np.where( np.abs(trace) <= 8*np.finfo(float).eps*scale, 0, trace )[:,None]
+
+def _two_mode_system(d_propagation_matrices, chirality_vectors, charge_vectors, lengths):
+    """
+    Solves the boundary conditions of two modes in closed form.
+    The rows of the conduct part sum up to zero, so M is singular and M^2 = tr(M) M, hence
+        exp(-+M L) = 1 + h M,    h = (exp(-|tr(M)| L)-1)/tr(M)
+    which also holds when M is not diagonalisable (e.g. counter-propagating modes
+    with equal charges). The sign is chosen so that |h| stays bounded: the currents are
+    propagated from the left end if tr(M) <= 0 (forward) and from the right end otherwise.
+    The boundary conditions then form a 2x2 system that is solved by Cramer's rule.
+    Returns
+    - h, forward: shape (batch, terminals)
+    - unknowns: I(0) if forward and I(L) otherwise, shape (batch, terminals, modes, 2)
+      for the currents emanating from the left and the right terminal
+    - sensitivities: derivative of the current at the left end by the emanating currents,
+      shape (batch, terminals, modes)
+    """
+    trace = _two_mode_trace( d_propagation_matrices )
+    with np.errstate( over='ignore', invalid='ignore', divide='ignore' ):
+        h = np.where( trace == 0, lengths, np.expm1( -np.abs(trace)*lengths )/np.where( trace == 0, 1.0, trace ) )
+        # only reached when tr(M) = 0: the rows with h are divided by h
+        large = np.abs(h) > 1
+        identity_weight = np.where( large, 1/h, 1.0 )
+        matrix_weight = np.where( large, 1.0, h )
+    forward = np.broadcast_to( trace <= 0, h.shape )
+
+    # the modes whose boundary condition involves the propagator: the negative ones when
+    # propagating forward, i.e. I_j(L) = [propagator.I(0)]_j, and the positive ones otherwise
+    negative = np.asarray(chirality_vectors)[:,None,:] < 0
+    propagated = negative == forward[...,None]
+    identity_weights = np.where( propagated, identity_weight[...,None], 1.0 )
+    matrix_weights = np.where( propagated, matrix_weight[...,None], 0.0 )
+    rows = identity_weights[...,None]*np.identity(2) + matrix_weights[...,None]*d_propagation_matrices[:,None]
+    emanating_currents = identity_weights[...,None]*_emanating_currents( chirality_vectors, charge_vectors )[:,None]
+
+    determinant = rows[...,0,0]*rows[...,1,1] - rows[...,0,1]*rows[...,1,0]
+    if not np.all( np.isfinite(determinant) & (determinant != 0) ):
+        raise la.LinAlgError('Singular matrix')
+    adjugate = np.stack( [ np.stack( [ rows[...,1,1], -rows[...,0,1] ], axis=-1 ),
+                           np.stack( [ -rows[...,1,0], rows[...,0,0] ], axis=-1 ) ], axis=-2 )
+    unknowns = np.einsum( '...jk,...kr->...jr', adjugate, emanating_currents )/determinant[...,None,None]
+
+    # the total current at the left end is left_end.unknowns
+    with np.errstate( invalid='ignore' ):
+        backward_sum = 1 + h[...,None]*d_propagation_matrices.sum(axis=-2)[:,None,:]
+    left_end = np.where( forward[...,None], 1.0, backward_sum )
+    sensitivities = identity_weights*np.einsum( '...j,...jk->...k', left_end, adjugate )/determinant[...,None]
+    return h, forward, unknowns, sensitivities
+
+def _two_mode_coefficients(d_propagation_matrices, chirality_vectors, charge_vectors, lengths):
+    """
+    d_plus and d_minus of two modes in closed form, see _two_mode_system.
+    """
+    h, forward, unknowns, sensitivities = _two_mode_system( d_propagation_matrices, chirality_vectors,
+                                                            charge_vectors, lengths )
+    d = np.sum( sensitivities[...,None]*_emanating_currents( chirality_vectors, charge_vectors )[:,None], axis=-2 )
+    return d[...,0], d[...,1]
+
+def _segment_coefficients(d_propagation_matrices, chirality_vectors, charge_vectors, lengths, eig=la.eig):
+    """
+    d_plus and d_minus of every segment, see _terminal_coefficients for the shapes.
+    One and two modes are handled in closed form; otherwise the d-propagation
+    matrices are diagonalised with eig, which maps a stack of matrices to (eigvals, eigvecs).
+    """
+    d_propagation_matrices = np.asarray( d_propagation_matrices, dtype=float )
+    chirality_vectors = np.asarray( chirality_vectors )
+    charge_vectors = np.asarray( charge_vectors, dtype=float )
+    lengths = np.asarray( lengths, dtype=float )
+
+    num_modes = d_propagation_matrices.shape[-1]
+    if num_modes == 1:
+        return _one_mode_coefficients( chirality_vectors, charge_vectors, lengths )
+    if num_modes == 2:
+        batch = np.broadcast_shapes( d_propagation_matrices.shape[:1], chirality_vectors.shape[:1],
+                                     charge_vectors.shape[:1] )
+        return _two_mode_coefficients( np.broadcast_to( d_propagation_matrices, batch+(2,2) ),
+                                       np.broadcast_to( chirality_vectors, batch+(2,) ),
+                                       np.broadcast_to( charge_vectors, batch+(2,) ), lengths )
+
+    eigvals , eigvecs = eig( d_propagation_matrices )
+    return _terminal_coefficients( eigvals, eigvecs, chirality_vectors, charge_vectors, lengths )
+
+def _segment_profiles(d_propagation_matrices, chirality_vectors, charge_vectors, lengths, positions, eig=la.eig):
+    """
+    Current of every mode along every segment for a unit potential at its left and right terminal.
+    - positions: shape (P,), fractions of the segments, 0 at the left terminal and 1 at the right one
+    - the other arguments as for _segment_coefficients, with finite lengths
+    Returns an array of shape (batch, terminals, P, modes, 2). The boundary conditions are solved
+    once per segment; the positions only enter through the outer product of the exponents.
+    """
+    d_propagation_matrices = np.asarray( d_propagation_matrices, dtype=float )
+    chirality_vectors = np.asarray( chirality_vectors )
+    charge_vectors = np.asarray( charge_vectors, dtype=float )
+    lengths = np.asarray( lengths, dtype=float )
+    positions = np.asarray( positions, dtype=float )
+    if not np.all( np.isfinite(lengths) ):
+        raise ValueError('Mode profiles need finite segment lengths')
+
+    num_modes = d_propagation_matrices.shape[-1]
+    batch = np.broadcast_shapes( d_propagation_matrices.shape[:1], chirality_vectors.shape[:1], charge_vectors.shape[:1] )
+    d_propagation_matrices = np.broadcast_to( d_propagation_matrices, batch+(num_modes,num_modes) )
+    chirality_vectors = np.broadcast_to( chirality_vectors, batch+(num_modes,) )
+    charge_vectors = np.broadcast_to( charge_vectors, batch+(num_modes,) )
+    shape = batch+lengths.shape[1:]+positions.shape+(num_modes,2)
+
+    if num_modes == 1:
+        return np.broadcast_to( _emanating_currents( chirality_vectors, charge_vectors )[:,None,None], shape )
+
+    if num_modes == 2:
+        # I(x) = (1 + h(y) M) I(start) with y the distance from the end the currents are propagated from
+        h, forward, unknowns, sensitivities = _two_mode_system( d_propagation_matrices, chirality_vectors,
+                                                                charge_vectors, lengths )
+        trace = _two_mode_trace( d_propagation_matrices )[...,None]
+        distances = np.where( forward[...,None], positions, 1-positions )*lengths[...,None]
+        h = np.where( trace == 0, distances, np.expm1( -np.abs(trace)*distances )/np.where( trace == 0, 1.0, trace ) )
+        propagated = np.einsum( 'bjk,btkr->btjr', d_propagation_matrices, unknowns )
+        return unknowns[:,:,None] + h[...,None,None]*propagated[:,:,None]
+
+    eigvals , eigvecs = eig( d_propagation_matrices )
+    solution_coeffs, decay = _eigen_solution( eigvals, eigvecs, chirality_vectors, charge_vectors, lengths )
+    exponentials = decay( np.broadcast_to( positions, batch+positions.shape ) )
+    return np.real( np.einsum( 'bja,btpa,btar->btpjr', eigvecs, exponentials, solution_coeffs ) )
+
+def _exp_remainder(z, order):
+    """
+    (exp(-z)-1+z)/z^2 for order 2 and (z(1+exp(-z))-2(1-exp(-z)))/z^3 for order 3,
+    evaluated from their Taylor series where the closed forms cancel (|z| < 1).
+    """
+    z = np.asarray( z, dtype=float )
+    small = np.abs(z) < 1
+    z_small = np.where( small, z, 0.0 )
+    z_large = np.where( small, 1.0, z )
+    with np.errstate( over='ignore' ):
+        if order == 2:
+            coefficients = [ (-1)**n/math.factorial(n) for n in range(2,22) ]
+            closed_form = ( np.exp(-z_large)-1+z_large )/z_large**2
+        else:
+            coefficients = [ (-1)**n*(2-n)/math.factorial(n) for n in range(3,23) ]
+            closed_form = ( z_large*(1+np.exp(-z_large)) + 2*np.expm1(-z_large) )/z_large**3
+    return np.where( small, np.polyval( coefficients[::-1], z_small ), closed_form )
+
+def _exprel(z):
+    """(exp(z)-1)/z, also for complex z"""
+    z_nonzero = np.where( z == 0, 1.0, z )
+    return np.where( z == 0, 1.0, np.expm1(z_nonzero)/z_nonzero )
+
+def _two_mode_gradients(d_propagation_matrices, chirality_vectors, charge_vectors, lengths):
+    """
+    Derivatives of the segment currents of two modes, see _segment_gradients.
+    With exp(-+M x) = 1 + h(x) M the forward and adjoint currents are linear in h,
+    so the integral of psi.I^T over the segment needs the integrals of h(x) and h(x)h(L-x) only.
+    """
+    h, forward, unknowns, sensitivities = _two_mode_system( d_propagation_matrices, chirality_vectors,
+                                                            charge_vectors, lengths )
+    decay_rate = np.abs( _two_mode_trace( d_propagation_matrices ) )*lengths
+
+    # adjoint currents at the end where the unknowns are given
+    negative = np.asarray(chirality_vectors)[:,None,:] < 0
+    adjoint = np.where( forward[...,None], sensitivities*negative, 1 - sensitivities*~negative )
+
+    matrix_unknowns = np.einsum( 'bjk,btkr->btjr', d_propagation_matrices, unknowns )
+    matrix_adjoint = np.einsum( 'bkj,btk->btj', d_propagation_matrices, adjoint )
+    # integrals of h(x) and h(x)h(L-x) over the segment
+    h_integral = np.where( forward, 1, -1 )*lengths**2*_exp_remainder( decay_rate, 2 )
+    h_product_integral = lengths**3*_exp_remainder( decay_rate, 3 )
+
+    def outer(left, right):
+        return left[...,None,:,None]*np.moveaxis( right, -1, -2 )[...,:,None,:]
+
+    grad_matrix = -( lengths[...,None,None,None]*outer( adjoint, unknowns )
+                     + h_integral[...,None,None,None]*( outer( matrix_adjoint, unknowns ) + outer( adjoint, matrix_unknowns ) )
+                     + h_product_integral[...,None,None,None]*outer( matrix_adjoint, matrix_unknowns ) )
+    grad_length = -np.exp( -decay_rate )[...,None]*np.einsum( 'btj,btjr->btr', adjoint, matrix_unknowns )
+
+    emanating_currents = _emanating_currents( chirality_vectors, charge_vectors )[:,None]
+    d = np.sum( sensitivities[...,None]*emanating_currents, axis=-2 )
+    grad_emanating = np.broadcast_to( sensitivities[...,None,:], d.shape+(2,) )
+    return d, grad_matrix, grad_length, grad_emanating
+
+def _eigen_gradients(eigvals, eigvecs, chirality_vectors, charge_vectors, lengths):
+    """
+    Derivatives of the segment currents from the eigenmodes, see _segment_gradients.
+    The forward currents I(x) = sum_b c_b V[:,b] exp( eigval[b]*(x-shift[b]*L) ) and the adjoint
+    psi(x) = sum_a m_a U[a] exp( eigval[a]*((1-shift[a])*L-x) ), U = V^-1, are both rescaled
+    as in _terminal_coefficients, so that no exponential exceeds one.
+    """
+    shift = ( eigvals.real > 0 ).astype(float)
+    zeroone_vec = (1-chirality_vectors)/2
+    negative = chirality_vectors < 0
+    inverse_eigvecs = la.inv( eigvecs )
+
+    # decay[b,t,j,a] = exp( eigval[a]*(zeroone_vec[j]-shift[a])*L[t] )
+    decay = np.exp( eigvals[:,None,None,:]*( zeroone_vec[:,None,:,None] - shift[:,None,None,:] )
+                    *lengths[:,:,None,None] )
+    # exp( -shift*eigval*L ) and exp( (1-shift)*eigval*L ), i.e. the modes at the left and right end
+    left_end = np.exp( -shift[:,None,:]*eigvals[:,None,:]*lengths[...,None] )
+    right_end = np.exp( (1-shift[:,None,:])*eigvals[:,None,:]*lengths[...,None] )
+
+    emanating_currents = np.broadcast_to( _emanating_currents( chirality_vectors, charge_vectors )[:,None,:,:],
+                                          decay.shape[:-1]+(2,) )
+    coeffs = la.solve( decay*eigvecs[:,None,:,:], emanating_currents )
+    # the adjoint vanishes at the right end of positive modes and is one at the left end of negative ones
+    adjoint_conditions = np.broadcast_to( negative[:,None,:,None].astype(float), decay.shape[:-1]+(1,) )
+    adjoint_coeffs = la.solve( decay*np.swapaxes( inverse_eigvecs, -1, -2 )[:,None,:,:], adjoint_conditions )[...,0]
+
+    d = np.real( np.sum( (eigvecs.sum(axis=1)[:,None,:]*left_end)[...,None]*coeffs, axis=-2 ) )
+
+    # integral of exp( eigval[a]*((1-shift[a])*L-x) + eigval[b]*(x-shift[b]*L) ) over the segment
+    exponent_step = ( eigvals[:,None,None,:] - eigvals[:,None,:,None] )*lengths[...,None,None]
+    integrals = lengths[...,None,None]*np.where( exponent_step.real <= 0,
+                    right_end[...,:,None]*left_end[...,None,:]*_exprel( exponent_step ),
+                    left_end[...,:,None]*right_end[...,None,:]*_exprel( -exponent_step ) )
+    weights = adjoint_coeffs[...,:,None,None]*integrals[...,None]*coeffs[...,None,:,:]
+    grad_matrix = -np.real( np.einsum( 'zaj,ztabr,zkb->ztrjk', inverse_eigvecs, weights, eigvecs ) )
+    grad_length = -np.real( np.sum( ( eigvals[:,None,:]*adjoint_coeffs*left_end*right_end )[...,None]*coeffs,
+                                    axis=-2 ) )
+
+    adjoint_left = np.einsum( 'bta,baj->btj', adjoint_coeffs*right_end, inverse_eigvecs )
+    adjoint_right = np.einsum( 'bta,baj->btj', adjoint_coeffs*left_end, inverse_eigvecs )
+    sensitivities = np.real( np.where( negative[:,None,:], adjoint_right, 1-adjoint_left ) )
+    grad_emanating = np.broadcast_to( sensitivities[...,None,:], d.shape+(eigvals.shape[-1],) )
+    return d, grad_matrix, grad_length, grad_emanating
+
+def _segment_gradients(d_propagation_matrices, chirality_vectors, charge_vectors, lengths, eig=la.eig):
+    """
+    Currents d = (d_plus, d_minus) of every segment and their derivatives by
+    the d-propagation matrix, the length and the emanating currents of the segment.
+    They follow from the adjoint problem psi' = -M^T.psi with psi_j(L) = 0 for the positive
+    and psi_j(0) = 1 for the negative modes:
+        dd/dM = -int_0^L psi(x).I(x)^T dx,    dd/dL = -psi^T.M.I
+    so a gradient costs about one more solve than the currents.
+    Shapes as in _terminal_coefficients; returns arrays of shape (batch, terminals, 2),
+    (batch, terminals, 2, modes, modes), (batch, terminals, 2) and (batch, terminals, 2, modes).
+    """
+    d_propagation_matrices = np.asarray( d_propagation_matrices, dtype=float )
+    chirality_vectors = np.asarray( chirality_vectors )
+    charge_vectors = np.asarray( charge_vectors, dtype=float )
+    lengths = np.asarray( lengths, dtype=float )
+    if not np.all( np.isfinite(lengths) ):
+        raise ValueError('The gradients need finite inter-terminal lengths')
+
+    num_modes = d_propagation_matrices.shape[-1]
+    batch = np.broadcast_shapes( d_propagation_matrices.shape[:1], chirality_vectors.shape[:1],
+                                 charge_vectors.shape[:1], lengths.shape[:1] )
+    d_propagation_matrices = np.broadcast_to( d_propagation_matrices, batch+(num_modes,num_modes) )
+    chirality_vectors = np.broadcast_to( chirality_vectors, batch+(num_modes,) )
+    charge_vectors = np.broadcast_to( charge_vectors, batch+(num_modes,) )
+
+    if num_modes == 1:
+        # nothing to equilibrate with, d is the emanating current
+        emanating_currents = _emanating_currents( chirality_vectors, charge_vectors )[:,None]
+        shape = batch+lengths.shape[1:]+(2,)
+        return ( np.broadcast_to( emanating_currents[...,0,:], shape ), np.zeros( shape+(1,1) ),
+                 np.zeros(shape), np.ones( shape+(1,) ) )
+    if num_modes == 2:
+        return _two_mode_gradients( d_propagation_matrices, chirality_vectors, charge_vectors, lengths )
+
+    eigvals , eigvecs = eig( d_propagation_matrices )
+    return _eigen_gradients( eigvals, eigvecs, chirality_vectors, charge_vectors, lengths )
+
+def _input_gradients(grad_matrix, grad_emanating, d_propagation_matrices, chirality_vectors, charge_vectors):
+    """
+    Chain rule from the derivatives by M and the emanating currents (see _segment_gradients)
+    to the derivatives by the conduct matrix and the charges, with M = (G-diag(rowsum G)).diag(chi/q).
+    """
+    chirality_vectors = np.asarray( chirality_vectors )
+    charge_vectors = np.asarray( charge_vectors, dtype=float )
+    ratio = ( chirality_vectors/charge_vectors )[:,None,None,:]
+
+    grad_diagonal = np.diagonal( grad_matrix, axis1=-2, axis2=-1 )
+    grad_conduct = grad_matrix*ratio[...,None,:] - ( grad_diagonal*ratio )[...,:,None]
+
+    # both M and the emanating currents depend on the charges
+    emanating_factors = np.stack( [ chirality_vectors*(1+chirality_vectors)/2,
+                                    chirality_vectors*(1-chirality_vectors)/2 ], axis=-2 )[:,None]
+    grad_charge = ( -np.sum( grad_matrix*np.asarray( d_propagation_matrices )[:,None,None], axis=-2 )
+                    /charge_vectors[:,None,None,:] + grad_emanating*emanating_factors )
+    return grad_conduct, grad_charge
+
+def _ring_conductance_band(d_plus, d_minus, arriving_plus=None, arriving_minus=None):
+    """
+    Assembles sigma of terminals on a ring in banded form from the segment
+    currents d_plus and d_minus of shape (..., terminals).
+    Returns band of shape (..., 3, terminals) with
+    - band[...,0,t] = sigma[t,t-1]
+    - band[...,1,t] = sigma[t,t]
+    - band[...,2,t] = sigma[t,t+1]
+    where the terminal indices are taken modulo the number of terminals.
+    The currents reaching the right terminals default to those leaving the left ones;
+    they differ only for the AC response.
+    """
+    if arriving_plus is None:
+        arriving_plus, arriving_minus = d_plus, d_minus
+    previous = np.roll( np.arange( d_plus.shape[-1] ), 1 )
+    return np.stack( [ arriving_plus[...,previous], arriving_minus[...,previous] - d_plus, -d_minus ], axis=-2 )
+
+def _band_to_dense(band):
+    num_terminals = band.shape[-1]
+    terminals = np.arange(num_terminals)
+    previous = (terminals-1)%num_terminals
+    following = (terminals+1)%num_terminals
+
+    sigma = np.zeros( band.shape[:-2]+(num_terminals,num_terminals), dtype=band.dtype )
+    sigma[...,terminals,previous] = band[...,0,:]
+    sigma[...,terminals,terminals] = band[...,1,:]
+    # with two terminals the previous and the following terminal coincide
+    sigma[...,terminals,following] += band[...,2,:]
+    return sigma
+
+def _ring_conductance_tensor(d_plus, d_minus):
+    """
+    Assembles sigma of terminals on a ring from the segment currents d_plus
+    and d_minus of shape (..., terminals).
+    """
+    return _band_to_dense( _ring_conductance_band( d_plus, d_minus ) )
+
+def _solve_cyclic_tridiagonal(band, rhs):
+    """
+    Solves A.x = rhs in linear time for a cyclic tridiagonal A given in the
+    banded form of _ring_conductance_band (at least 3 terminals).
+    - band: shape (..., 3, N)
+    - rhs: shape (..., N, K)
+    The corner elements are handled as a rank-one correction (Sherman-Morrison)
+    of a tridiagonal system, which is solved by forward elimination and back substitution.
+    """
+    lower, diag, upper = band[...,0,:], band[...,1,:], band[...,2,:]
+    num = diag.shape[-1]
+
+    # A = T + u.v^T with u = (gamma,0,...,0,alpha) and v = (1,0,...,0,beta/gamma)
+    alpha = upper[...,num-1]
+    beta = lower[...,0]
+    gamma = np.where( diag[...,0] != 0, -diag[...,0], 1.0 )
+    diag = diag.copy()
+    diag[...,0] -= gamma
+    diag[...,num-1] -= alpha*beta/gamma
+
+    u = np.zeros( diag.shape, dtype=diag.dtype )
+    u[...,0] = gamma
+    u[...,num-1] = alpha
+    rhs = np.concatenate( [ np.broadcast_to( rhs, diag.shape[:-1]+rhs.shape[-2:] ), u[...,None] ], axis=-1 )
+
+    # forward elimination for T.[x,z] = [rhs,u], with the system axis moved to the front
+    lower = np.moveaxis( lower, -1, 0 )
+    diag = np.moveaxis( diag, -1, 0 )
+    upper = np.moveaxis( upper, -1, 0 )
+    solution = np.array( np.moveaxis( rhs, -2, 0 ), dtype=np.result_type(diag,rhs) )
+    pivots = np.empty( diag.shape, dtype=solution.dtype )
+    upper_eliminated = np.empty( diag.shape, dtype=solution.dtype )
+    pivots[0] = diag[0]
+    with np.errstate( divide='ignore', invalid='ignore' ):
+        upper_eliminated[0] = upper[0]/diag[0]
+        solution[0] /= diag[0][...,None]
+        for t in range(1,num):
+            pivots[t] = diag[t] - lower[t]*upper_eliminated[t-1]
+            upper_eliminated[t] = upper[t]/pivots[t]
+            solution[t] -= lower[t][...,None]*solution[t-1]
+            solution[t] /= pivots[t][...,None]
+    if not np.all( np.isfinite(pivots) & (pivots != 0) ):
+        raise la.LinAlgError('Singular matrix')
+    # back substitution
+    for t in range(num-2,-1,-1):
+        solution[t] -= upper_eliminated[t][...,None]*solution[t+1]
+    solution = np.moveaxis( solution, 0, -2 )
+
+    x, z = solution[...,:-1], solution[...,-1:]
+    v_x = x[...,0,:] + (beta/gamma)[...,None]*x[...,num-1,:]
+    v_z = z[...,0,:] + (beta/gamma)[...,None]*z[...,num-1,:]
+    return x - z*( v_x/(1+v_z) )[...,None,:]
+
+def _transposed_band(band):
+    """
+    Banded form of sigma^T for sigma in the banded form of _ring_conductance_band.
+    """
+    return np.stack( [ np.roll( band[...,2,:], 1, axis=-1 ), band[...,1,:], np.roll( band[...,0,:], -1, axis=-1 ) ],
+                     axis=-2 )
+
+def _grounded_band(band, terminal):
+    """
+    Adds a term to the diagonal of sigma at the given (0-based) terminal.
+    As the columns of sigma sum up to zero, the solution of the grounded system
+    for currents that sum up to zero has a vanishing potential at that terminal
+    and also solves the original system.
+    """
+    diag = band[...,1,:]
+    scale = np.max( np.abs(diag), axis=-1 )
+    scale = np.where( scale > 0, scale, 1.0 )
+    band = band.copy()
+    band[...,1,terminal] += np.where( diag[...,terminal] > 0, scale, -scale )
+    return band
+
+def conductance_tensor_batch(chirality_vectors, charge_vectors, conduct_matrices,
+                             inter_terminal_length_vectors=None, num_terminals=4):
+    """
+    Batched counterpart of QuantumHall.conductance_tensor for a stack of devices.
+    - chirality_vectors, charge_vectors: shape (batch, modes) or (modes,) shared by the whole batch
+    - conduct_matrices: shape (batch, modes, modes)
+    - inter_terminal_length_vectors: shape (terminals,) shared by the whole batch
+      or (batch, terminals). Defaults to unit lengths for num_terminals terminals.
+    Pass the central charges and the heat conduct matrices to obtain the heat tensors.
+    Returns sigma with shape (batch, terminals, terminals).
+    """
+    conduct_matrices = np.asarray( conduct_matrices, dtype=float )
+    if conduct_matrices.ndim != 3 or conduct_matrices.shape[1] != conduct_matrices.shape[2]:
+        raise ValueError('conduct_matrices should have the shape (batch, modes, modes)')
+    batch, num_modes = conduct_matrices.shape[:2]
+
+    chirality_vectors = np.broadcast_to( np.asarray( chirality_vectors ), (batch,num_modes) )
+    charge_vectors = np.broadcast_to( np.asarray( charge_vectors, dtype=float ), (batch,num_modes) )
+
+    if inter_terminal_length_vectors is None:
+        inter_terminal_length_vectors = np.ones(num_terminals, dtype=float)
+    lengths = np.asarray( inter_terminal_length_vectors, dtype=float )
+    if lengths.ndim == 1:
+        lengths = lengths[None]
+    if lengths.ndim != 2 or lengths.shape[0] not in (1,batch):
+        raise ValueError('inter_terminal_length_vectors should have the shape (terminals,) or (batch, terminals)')
+
+    d_propagation_matrices = _d_propagation_matrices( chirality_vectors, charge_vectors, conduct_matrices )
+    d_plus, d_minus = _segment_coefficients( d_propagation_matrices, chirality_vectors, charge_vectors, lengths )
+    return _ring_conductance_tensor( d_plus, d_minus )
+
+class MultiTerminalResistance:
+    """
+    All two- and four-terminal resistances of a device from one grounded solve.
+    response[:,i] holds the terminal potentials when a unit current enters at
+    terminal i and leaves at terminal 0, so any measurement follows by superposition.
+    The resistance R[i,j,k,l] is the inverse of
+    QuantumHall.four_terminal_conductance((i+1,j+1),(k+1,l+1)); indexing is 0-based.
+    """
+    def __init__(self, response):
+        self.response = response
+        self.num_terminals = response.shape[-1]
+
+    def __getitem__(self, index):
+        """
+        R[i,j,k,l] for integers or broadcastable index arrays.
+        """
+        i, j, k, l = ( np.asarray(terminal) for terminal in index )
+        z = self.response
+        return -( z[k,i] - z[k,j] - z[l,i] + z[l,j] )
+
+    def dense(self):
+        """
+        Returns all resistances as an array of shape (N, N, N, N).
+        """
+        z = self.response
+        potentials = z[:,:,None] - z[:,None,:]
+        return -( potentials[None,:,:,:] - potentials[:,None,:,:] ).transpose(2,3,1,0)
+
+    def two_terminal(self):
+        """
+        Returns R[i,j,i,j] as an array of shape (N, N).
+        """
+        terminals = np.arange( self.num_terminals )
+        return self[ terminals[:,None], terminals[None,:], terminals[:,None], terminals[None,:] ]
+
+    def four_terminal(self, current_terminals, potential_terminals):
+        """
+        Same (1-based) arguments as QuantumHall.four_terminal_conductance.
+        """
+        return self[ current_terminals[0]-1, current_terminals[1]-1,
+                     potential_terminals[0]-1, potential_terminals[1]-1 ]
+
+def four_terminal_conductance_batch(sigma, current_terminals, potential_terminals):
+    """
+    QuantumHall.four_terminal_conductance for a stack of sigma of shape (batch, T, T).
+    Returns an array of shape (batch,), with NaN where the conductance cannot be determined.
+    """
+    sigma = np.asarray( sigma, dtype=float )
+    num_terminals = sigma.shape[-1]
+    if num_terminals <3:
+        raise ValueError('Number of terminals shoud be at least 3')
+    source, drain = current_terminals[0]-1, current_terminals[1]-1
+    probe_1, probe_2 = potential_terminals[0]-1, potential_terminals[1]-1
+
+    currents = np.zeros( (num_terminals,1), dtype=float )
+    currents[source] += 1
+    currents[drain] -= 1
+
+    # ground the second potential terminal, see _grounded_band
+    grounded = sigma.copy()
+    diag = grounded[:,probe_2,probe_2]
+    scale = np.max( np.abs( np.diagonal( sigma, axis1=-2, axis2=-1 ) ), axis=-1 )
+    grounded[:,probe_2,probe_2] += np.where( diag > 0, 1.0, -1.0 )*np.where( scale > 0, scale, 1.0 )
+
+    try:
+        potentials = la.solve( grounded, np.broadcast_to( currents, sigma.shape[:-1]+(1,) ) )[...,0]
+    except la.LinAlgError:
+        # solve point by point so that only the singular ones are lost
+        potentials = np.full( sigma.shape[:-1], np.nan )
+        for index, matrix in enumerate(grounded):
+            try:
+                potentials[index] = la.solve( matrix, currents )[:,0]
+            except la.LinAlgError:
+                pass
+
+    potential_difference = potentials[:,probe_1]-potentials[:,probe_2]
+    # a vanishing potential difference leaves the conductance undetermined, see _conductance_from_potentials
+    undetermined = ~( np.abs(potential_difference) >
+                      num_terminals*np.finfo(float).eps*np.max( np.abs(potentials), axis=-1 ) )
+    with np.errstate( divide='ignore', invalid='ignore' ):
+        return np.where( undetermined, np.nan, -1/potential_difference )
+
+def two_terminal_conductance_batch(sigma, voltage_terminals):
+    """
+    QuantumHall.two_terminal_conductance for a stack of sigma of shape (batch, T, T).
+    """
+    sigma = np.asarray( sigma, dtype=float )
+    if sigma.shape[-1]>2:
+        return four_terminal_conductance_batch( sigma, voltage_terminals, voltage_terminals )
+    return -sigma[:,0,0]
+
+class TransportResult:
+    """
+    Charge and heat transport of a device, as returned by QuantumHall.solve_all.
+    Every attribute is a dictionary keyed by 'charge' and 'heat':
+    - conductance_tensors: sigma
+    - currents: currents at all terminals in quantized units
+    - currents_SI: currents at all terminals in amperes and watts
+    - two_terminal_conductances, four_terminal_conductances: None if not requested
+    - errors: empty string, or the message of the LinAlgError that stopped the calculation
+    """
+    def __init__(self):
+        self.conductance_tensors = {}
+        self.currents = {}
+        self.currents_SI = {}
+        self.two_terminal_conductances = {}
+        self.four_terminal_conductances = {}
+        self.errors = {}
+
+def _drives(biases, quantity):
+    # the currents are sigma.V for 'charge' and sigma.T^2/2 for 'heat'
+    biases = np.asarray( biases, dtype=float )
+    return biases if quantity=='charge' else biases**2/2
+
+def _measurement_error(current_terminals, potential_terminals):
+    return la.LinAlgError( 'Error: The current between the terminals {} and {} cannot be determined from the potentials at'\
+                  ' the terminals {} and {}'.format( current_terminals[0],current_terminals[1],potential_terminals[0],potential_terminals[1] ) )
+
+def _conductance_from_potentials(potentials, probe_1, probe_2):
+    """
+    -I/(V_1-V_2) for the potentials of shape (..., terminals) due to a unit current I.
+    """
+    potential_difference = potentials[...,probe_1]-potentials[...,probe_2]
+    # a vanishing potential difference leaves the conductance undetermined
+    if np.any( np.abs(potential_difference) <=
+               potentials.shape[-1]*np.finfo(float).eps*np.max( np.abs(potentials), axis=-1 ) ):
+        raise la.LinAlgError('Singular matrix')
+    return -1/potential_difference
+
+def _input_property(name, convert, check=None):
+    """
+    Property for an input of QuantumHall. Assigning a new value invalidates
+    every observable that depends on it. The stored array is read-only, so the
+    inputs should be reassigned rather than modified in place.
+    - check: optional callable (instance, value) raising ValueError for an invalid value
+    """
+    attribute = '_'+name
+
+    def getter(self):
+        return getattr(self, attribute)
+
+    def setter(self, value):
+        value = convert(value)
+        if check is not None:
+            check(self, value)
+        if value is not None:
+            value.setflags( write=False )
+        setattr(self, attribute, value)
+        self._invalidate(name)
+
+    return property(getter, setter)
+
+def _vector(value):
+    return np.array(value, dtype=float)
+
+# inputs with one entry per terminal, they fix num_terminals together
+_terminal_inputs = ( 'voltages', 'temperatures', 'inter_terminal_length_vector' )
+
+def _terminal_check(name):
+    """
+    Check for _input_property: the input should have as many entries as the other
+    per-terminal inputs that are already set.
+    """
+    def check(quantum_hall, value):
+        for other in _terminal_inputs:
+            current = getattr( quantum_hall, '_'+other, None )
+            if other != name and current is not None and value.shape != current.shape:
+                raise ValueError('{} should hold one value per terminal, {} values for {} terminals'.format(
+                                 name, value.size, len(current) ))
+    return check
+
+def _conduct_matrix(value):
+    return np.matrix(value, dtype=float)
+
+def _is_segment_input(name):
+    # inputs with one entry per segment, on the first axis
+    return name.startswith('segment_') or name=='inter_terminal_length_vector'
+
+def _segment_input(value):
+    # None when all the segments share the input of the device
+    return None if value is None else np.array(value, dtype=float)
+
 class QuantumHall:
+    # inputs of the model
+    chirality_vector = _input_property( 'chirality_vector', np.array )
+    charge_vector = _input_property( 'charge_vector', _vector )
+    charge_conduct_matrix = _input_property( 'charge_conduct_matrix', _conduct_matrix )
+    central_charge_vector = _input_property( 'central_charge_vector', _vector )
+    heat_conduct_matrix = _input_property( 'heat_conduct_matrix', _conduct_matrix )
+    inter_terminal_length_vector = _input_property( 'inter_terminal_length_vector', _vector,
+                                                    _terminal_check('inter_terminal_length_vector') )
+    voltages = _input_property( 'voltages', _vector, _terminal_check('voltages') )
+    temperatures = _input_property( 'temperatures', _vector, _terminal_check('temperatures') )
+    # optional inputs of every segment, overriding those of the device
+    segment_charge_conduct_matrices = _input_property( 'segment_charge_conduct_matrices', _segment_input )
+    segment_charge_vectors = _input_property( 'segment_charge_vectors', _segment_input )
+    segment_heat_conduct_matrices = _input_property( 'segment_heat_conduct_matrices', _segment_input )
+    segment_central_charge_vectors = _input_property( 'segment_central_charge_vectors', _segment_input )
+
+    # observables and the inputs or observables they are computed from
+    _dependencies = {
+        'charge_d_propagation_matrix': ('chirality_vector','charge_vector','charge_conduct_matrix'),
+        'heat_d_propagation_matrix': ('chirality_vector','central_charge_vector','heat_conduct_matrix'),
+        'charge_conductance_band': ('charge_d_propagation_matrix','chirality_vector','charge_vector',
+                                    'inter_terminal_length_vector','segment_charge_conduct_matrices',
+                                    'segment_charge_vectors'),
+        'heat_conductance_band': ('heat_d_propagation_matrix','chirality_vector','central_charge_vector',
+                                  'inter_terminal_length_vector','segment_heat_conduct_matrices',
+                                  'segment_central_charge_vectors'),
+        'charge_currents': ('charge_conductance_band','voltages'),
+        'heat_currents': ('heat_conductance_band','temperatures'),
+        'charge_grounded_response': ('charge_conductance_band',),
+        'heat_grounded_response': ('heat_conductance_band',),
+    }
+
     def __init__(self, chirality_vector=None,
                  charge_vector=None, charge_conduct_matrix=None,
                  central_charge_vector=None, heat_conduct_matrix=None,
                  num_terminals=None, inter_terminal_length_vector=None ,
-                 voltages=None, temperatures = None
+                 voltages=None, temperatures = None,
+                 segment_charge_conduct_matrices=None, segment_charge_vectors=None,
+                 segment_heat_conduct_matrices=None, segment_central_charge_vectors=None
                  ):
-        # size check
-
+        """
+        The segment_* arguments give each segment between neighbouring terminals its own
+        conduct matrix or charges, with shapes (num_terminals, modes, modes) and
+        (num_terminals, modes); segment t joins the terminals t and t+1. Segments with
+        identical inputs share one eigendecomposition.
+        """
         # initializing
+        self._observables = {}
 
         # Default: all modes going downstream
         if chirality_vector is None:
-            self.num_modes = 1
-            self.chirality_vector = np.ones(self.num_modes, dtype=int)
+            self.chirality_vector = np.ones(1, dtype=int)
         else:
-            self.num_modes = len(chirality_vector)
             self.chirality_vector = chirality_vector
 
         # Default: all modes have charage 1
         if charge_vector is None:
             self.charge_vector = np.ones(self.num_modes, dtype=float)
         else:
-            self.charge_vector = np.array(charge_vector,dtype=float)
+            self.charge_vector = charge_vector
 
         if charge_conduct_matrix is None:
             self.charge_conduct_matrix = np.zeros( (self.num_modes,self.num_modes),dtype=float )
         else:
-            self.charge_conduct_matrix = np.matrix(charge_conduct_matrix,dtype=float)
+            self.charge_conduct_matrix = charge_conduct_matrix
 
         if central_charge_vector is None:
             self.central_charge_vector = np.ones(self.num_modes, dtype=float)
         else:
-            self.central_charge_vector = np.array(central_charge_vector,dtype=float)
+            self.central_charge_vector = central_charge_vector
 
         if heat_conduct_matrix is None:
             self.heat_conduct_matrix = np.zeros( (self.num_modes,self.num_modes),dtype=float )
         else:
-            self.heat_conduct_matrix = np.matrix(heat_conduct_matrix,dtype=float)
+            self.heat_conduct_matrix = heat_conduct_matrix
 
         if voltages is None and temperatures is None:
             if num_terminals is None:
-                self.num_terminals = 4
-            else:
-                self.num_terminals =int( num_terminals )
-            self.voltages = np.zeros(self.num_terminals, dtype=float)
-            self.temperatures = np.zeros(self.num_terminals, dtype=float)
+                num_terminals = 4
+            self.voltages = np.zeros(int( num_terminals ), dtype=float)
+            self.temperatures = np.zeros(int( num_terminals ), dtype=float)
         elif voltages is None:
-            self.num_terminals = len( temperatures )
-            self.voltages = np.zeros(self.num_terminals, dtype=float)
-            self.temperatures = np.array(temperatures)
+            self.voltages = np.zeros(len( temperatures ), dtype=float)
+            self.temperatures = temperatures
         elif temperatures is None:
-            self.num_terminals = len( voltages )
-            self.voltages = np.array(voltages)
-            self.temperatures = np.zeros(self.num_terminals, dtype=float)
+            self.voltages = voltages
+            self.temperatures = np.zeros(len( voltages ), dtype=float)
         else:
-            self.num_terminals = len( voltages )
-            self.voltages = np.array(voltages)
-            self.temperatures = np.array(temperatures)
+            self.voltages = voltages
+            self.temperatures = temperatures
 
         if inter_terminal_length_vector is None:
             self.inter_terminal_length_vector = np.ones(self.num_terminals, dtype=float)
         else:
-            self.inter_terminal_length_vector = np.array(inter_terminal_length_vector,dtype=float)
-
-        self._construct_d_propagation_matrix()
+            self.inter_terminal_length_vector = inter_terminal_length_vector
 
-        self._conductance_tensor_calc_flag = { 'charge':False, 'heat':False  }
+        self.segment_charge_conduct_matrices = segment_charge_conduct_matrices
+        self.segment_charge_vectors = segment_charge_vectors
+        self.segment_heat_conduct_matrices = segment_heat_conduct_matrices
+        self.segment_central_charge_vectors = segment_central_charge_vectors
 
-    def _construct_d_propagation_matrix(self):
-        self.charge_d_propagation_matrix = np.matrix(
-            [
-                [ self.chirality_vector[b]/self.charge_vector[b]*(self.charge_conduct_matrix[a,b]-
-            np.identity(self.num_modes)[a,b]*sum(self.charge_conduct_matrix[a,c]  for c in range(self.num_modes))  )
-                                                         for b in range(self.num_modes)
-                ]
-                                                      for a in range(self.num_modes)
-            ]
-                                                       )
+    @property
+    def num_modes(self):
+        return len(self.chirality_vector)
 
-        self.heat_d_propagation_matrix = np.matrix(
-            [
-                [ self.chirality_vector[b]/self.central_charge_vector[b]*(self.heat_conduct_matrix[a,b]-
-            np.identity(self.num_modes)[a,b]*sum(self.heat_conduct_matrix[a,c]  for c in range(self.num_modes))  )
-                                                         for b in range(self.num_modes)
-                ]
-                                                      for a in range(self.num_modes)
-            ]
-                                                       )
+    @property
+    def num_terminals(self):
+        return len(self.voltages)
 
-
-    def _current_segment(self, d_propagation_matrix, potential_L,potential_R ,L):
+    def _observable(self, name, compute):
         """
-        Returns the two current (electrical or thermal):
-        - that travels from the left terminal to the right one
-        - that travels from the right terminal to the left one
+        Returns the cached observable, computing it first if one of its inputs changed.
         """
+        if name not in self._observables:
+            value = compute()
+            value.setflags( write=False )
+            self._observables[name] = value
+        return self._observables[name]
 
-        eigvals , eigvecs = la.eig( np.matrix( d_propagation_matrix,dtype= np.float ) )
+    def _invalidate(self, name):
+        for observable, dependencies in self._dependencies.items():
+            if name in dependencies:
+                self._observables.pop(observable, None)
+                self._invalidate(observable)
 
-        # zero if positive and 1 if negative
-        zeroone_vec = [ (1-c)/2 for c in self.chirality_vector  ]
+    @property
+    def charge_d_propagation_matrix(self):
+        return self._observable( 'charge_d_propagation_matrix', lambda: self._d_propagation_matrix('charge') )
 
-        propagation_matrix = np.matrix( [ [np.exp( zeroone_vec[j]*L*eigvals[i]  )*eigvecs[j,i] for i in range(self.num_modes)]
-                                          for j in range(self.num_modes)   ] ,dtype=np.double)
+    @property
+    def heat_d_propagation_matrix(self):
+        return self._observable( 'heat_d_propagation_matrix', lambda: self._d_propagation_matrix('heat') )
 
-        emanating_currents =  np.array( [ (potential_L*(1+self.chirality_vector[i])/2 +
-                                           potential_R*(-1+self.chirality_vector[i])/2 )*self.charge_vector[i] for i in range(self.num_modes) ] ,
-                                            dtype=np.double)
+    @property
+    def charge_conductance_tensor(self):
+        return self.conductance_tensor('charge')
 
-        solution_coeffs = la.solve(propagation_matrix, emanating_currents)
+    @property
+    def heat_conductance_tensor(self):
+        return self.conductance_tensor('heat')
 
-        JLtoR = sum( sum( solution_coeffs[i]*eigvecs[j,i] for i in range(self.num_modes) ) for j in range(self.num_modes) )
+    def _d_propagation_matrix(self, quantity):
+        if quantity=='charge':
+            return np.matrix( _d_propagation_matrices( self.chirality_vector, self.charge_vector,
+                                                       self.charge_conduct_matrix ) )
+        else:
+            return np.matrix( _d_propagation_matrices( self.chirality_vector, self.central_charge_vector,
+                                                       self.heat_conduct_matrix ) )
 
-        return JLtoR
+    def _eig(self, d_propagation_matrices):
+        return eig_cache.eig_batch( d_propagation_matrices, self.chirality_vector )
 
+    def _current_segment(self, d_propagation_matrix, potential_L,potential_R ,L, charge_vector=None):
+        """
+        Returns the two current (electrical or thermal):
+        - that travels from the left terminal to the right one
+        - that travels from the right terminal to the left one
+        """
+        if charge_vector is None:
+            charge_vector = self.charge_vector
 
+        d_plus, d_minus = _segment_coefficients( np.asarray( d_propagation_matrix )[None],
+                                                 np.asarray( self.chirality_vector )[None],
+                                                 np.asarray( charge_vector )[None],
+                                                 np.array( [[L]], dtype=float ), self._eig )
+
+        JLtoR = potential_L*d_plus[0,0] + potential_R*d_minus[0,0]
+
+        return JLtoR
 
     def _electrical_current_all_terminals(self):
         current_outtoR = np.zeros(self.num_terminals)
         current_infromL = np.zeros(self.num_terminals)
+        d_propagation_matrices, charge_vectors = self._segment_arrays('charge')
         for segment in range(self.num_terminals):
-            current = self.current_segment( self.charge_d_propagation_matrix, self.voltages[segment],
+            segment_type = segment if len(d_propagation_matrices)>1 else 0
+            current = self._current_segment( d_propagation_matrices[segment_type], self.voltages[segment],
                                                                 self.voltages[(segment+1)%self.num_terminals],
-                                                                 self.inter_terminal_length_vector[segment] )
+                                                                 self.inter_terminal_length_vector[segment],
+                                                                 charge_vectors[segment_type] )
             current_outtoR[segment] = current
             current_infromL[ (segment+1)%self.num_terminals ] = current
 
@@ -144,143 +1115,567 @@ class QuantumHall:
         current_tot = self._electrical_current_all_terminals()
         return current_tot[terminal_1]-current_tot[terminal_2]
 
+    def _quantity_arrays(self, quantity):
+        if quantity=='charge':
+            return self.charge_d_propagation_matrix, self.charge_vector
+        elif quantity=='heat':
+            return self.heat_d_propagation_matrix, self.central_charge_vector
+        else:
+            raise NotImplementedError("The argument quantity should be either 'charge' or 'heat' ")
+
+    def _segment_arrays(self, quantity):
+        """
+        d-propagation matrices and charge vectors of the segments, with shapes (S, modes, modes)
+        and (S, modes). S is 1 when all the segments share the inputs of the device
+        and num_terminals when segment inputs are given.
+        """
+        d_propagation_matrix, quant_charge_vector = self._quantity_arrays(quantity)
+        if quantity=='charge':
+            conduct_matrix, conduct_name = self.charge_conduct_matrix, 'segment_charge_conduct_matrices'
+            charge_name = 'segment_charge_vectors'
+        else:
+            conduct_matrix, conduct_name = self.heat_conduct_matrix, 'segment_heat_conduct_matrices'
+            charge_name = 'segment_central_charge_vectors'
+        segment_conduct_matrices, segment_charge_vectors = getattr( self, conduct_name ), getattr( self, charge_name )
+
+        if segment_conduct_matrices is None and segment_charge_vectors is None:
+            return np.asarray( d_propagation_matrix )[None], np.asarray( quant_charge_vector )[None]
+
+        num_modes, num_terminals = self.num_modes, self.num_terminals
+        if segment_conduct_matrices is None:
+            segment_conduct_matrices = np.broadcast_to( np.asarray( conduct_matrix ), (num_terminals,num_modes,num_modes) )
+        elif segment_conduct_matrices.shape != (num_terminals,num_modes,num_modes):
+            raise ValueError('{} should have the shape (num_terminals, modes, modes)'.format( conduct_name ))
+        if segment_charge_vectors is None:
+            segment_charge_vectors = np.broadcast_to( np.asarray( quant_charge_vector ), (num_terminals,num_modes) )
+        elif segment_charge_vectors.shape != (num_terminals,num_modes):
+            raise ValueError('{} should have the shape (num_terminals, modes)'.format( charge_name ))
+
+        return ( _d_propagation_matrices( self.chirality_vector, segment_charge_vectors, segment_conduct_matrices ),
+                 np.asarray( segment_charge_vectors ) )
+
+    def _segment_lengths(self, num_segment_types):
+        # the lengths go on the terminal axis when the segments share one edge model,
+        # and on the batch axis when every segment has its own
+        if num_segment_types == 1:
+            return self.inter_terminal_length_vector[None]
+        return self.inter_terminal_length_vector[:,None]
+
     def conductance_tensor(self,quantity='charge'):
         """
         calculates sigma in
         - I = sigma.V for 'charge'
         - J = sigma.T^2/2 for 'heat'
         """
-        if quantity=='charge':
-            d_propagation_matrix = self.charge_d_propagation_matrix
-            quant_charge_vector = self.charge_vector
-        elif quantity=='heat':
-            d_propagation_matrix = self.heat_d_propagation_matrix
-            quant_charge_vector = self.central_charge_vector
+        return _band_to_dense( self.conductance_band(quantity) )
+
+    def conductance_band(self, quantity='charge'):
+        """
+        sigma in banded form, see _ring_conductance_band.
+        Each terminal only couples to its two neighbours on the ring, so sigma is
+        stored as three diagonals. The band is cached (read-only) until one of its inputs changes.
+        """
+        self._quantity_arrays(quantity)
+        return self._observable( quantity+'_conductance_band', lambda: self._conductance_band(quantity) )
+
+    def _conductance_band(self, quantity):
+        d_propagation_matrices, quant_charge_vectors = self._segment_arrays(quantity)
+
+        d_plus, d_minus = _segment_coefficients( d_propagation_matrices,
+                                                 np.asarray( self.chirality_vector )[None],
+                                                 quant_charge_vectors,
+                                                 self._segment_lengths( len(d_propagation_matrices) ), self._eig )
+
+        return _ring_conductance_band( d_plus.reshape(-1), d_minus.reshape(-1) )
+
+    def sweep_lengths(self, lengths, quantity='charge', chunk_size=4096):
+        """
+        calculates sigma for many inter-terminal lengths from a single eigendecomposition
+        - lengths of shape (K,) give every segment the same length
+        - lengths of shape (K, num_terminals) set each segment separately
+        Lengths may be np.inf (fully equilibrated segments).
+        Returns sigma with shape (K, num_terminals, num_terminals).
+        The lengths are processed in chunks of chunk_size to bound the memory use.
+        """
+        d_propagation_matrices, quant_charge_vectors = self._segment_arrays(quantity)
+        per_segment = len(d_propagation_matrices) > 1
+
+        lengths = np.asarray( lengths, dtype=float )
+        if lengths.ndim == 1:
+            # the segments only differ by their lengths, so one column is enough
+            segment_lengths = lengths[:,None]
+        elif lengths.ndim == 2 and lengths.shape[1] == self.num_terminals:
+            segment_lengths = lengths
         else:
-            raise NotImplementedError("The argument quantity should be either 'charge' or 'heat' ")
+            raise ValueError('lengths should have the shape (K,) or (K, num_terminals)')
 
-        # zero if positive and 1 if negative
-        zeroone_vec = [ (1-c)/2 for c in self.chirality_vector  ]
+        chirality_vector = np.asarray( self.chirality_vector )[None]
+        if per_segment:
+            segment_lengths = np.broadcast_to( segment_lengths, (len(lengths),self.num_terminals) )
 
-        d_plus = np.zeros( self.num_terminals, dtype=float )
-        d_minus = np.zeros( self.num_terminals, dtype=float )
+        d_plus = np.empty( segment_lengths.shape, dtype=float )
+        d_minus = np.empty( segment_lengths.shape, dtype=float )
+        for start in range(0, len(segment_lengths), chunk_size):
+            chunk = slice( start, start+chunk_size )
+            if per_segment:
+                # the segments are the batch, the lengths of the chunk the terminal axis
+                d_plus_chunk, d_minus_chunk = _segment_coefficients( d_propagation_matrices, chirality_vector,
+                                                                     quant_charge_vectors, segment_lengths[chunk].T,
+                                                                     self._eig )
+                d_plus[chunk], d_minus[chunk] = d_plus_chunk.T, d_minus_chunk.T
+            else:
+                d_plus[chunk], d_minus[chunk] = _segment_coefficients( d_propagation_matrices, chirality_vector,
+                                                                       quant_charge_vectors, segment_lengths[chunk],
+                                                                       self._eig )
 
-        eigvals , eigvecs = la.eig( np.matrix( d_propagation_matrix,dtype= np.float ) )
-        
-        for terminal in range(self.num_terminals):
-            propagation_matrix = np.matrix( [ [np.exp( zeroone_vec[j]*self.inter_terminal_length_vector[terminal]*eigvals[a]  )
-                                               *eigvecs[j,a] for a in range(self.num_modes)] 
-                                             for j in range(self.num_modes)   ] ,dtype=np.float)
-            
-            Ieig_Pinv = np.real( np.matmul( eigvecs,la.inv(propagation_matrix) ) )
-            #Ieig_Pinv =  np.matmul( eigvecs,la.inv(propagation_matrix) ) 
-            
-            d_plus[terminal] = sum( sum( Ieig_Pinv[j,i]*self.chirality_vector[i]*quant_charge_vector[i]*
-                                        (1+self.chirality_vector[i] )/2 
-                                        for j in range(self.num_modes)  )
-                        for i in range(self.num_modes)  )
-            d_minus[terminal] = sum( sum( Ieig_Pinv[j,i]*self.chirality_vector[i]*quant_charge_vector[i]*
-                                         (1-self.chirality_vector[i] )/2 
-                                         for j in range(self.num_modes)  )
-                        for i in range(self.num_modes)  )
-        
-        sigma = np.zeros( (self.num_terminals, self.num_terminals), dtype=float   )
-        for terminal in range(self.num_terminals):
-            sigma[terminal,(terminal-1 )%self.num_terminals ] = d_plus[ (terminal-1)%self.num_terminals ]
-            sigma[terminal,terminal] = d_minus[ (terminal-1)%self.num_terminals ] - d_plus[terminal]
-            sigma[terminal,(terminal+1 )%self.num_terminals ] += -d_minus[ terminal ]
+        shape = ( len(lengths), self.num_terminals )
+        return _ring_conductance_tensor( np.broadcast_to( d_plus, shape ), np.broadcast_to( d_minus, shape ) )
 
-        self._conductance_tensor_calc_flag[quantity]=True
+    def equilibrated_conductance_tensor(self, quantity='charge'):
+        """
+        sigma in the limit of infinitely long segments, where the modes have fully
+        equilibrated between the terminals. Same as an inter_terminal_length_vector of np.inf.
+        """
+        return self.sweep_lengths( [np.inf], quantity )[0]
+
+    def ac_conductance_tensor(self, frequencies, velocity_vector, quantity='charge', chunk_size=1024):
+        """
+        sigma(omega) of the AC response, shape (len(frequencies), terminals, terminals), complex.
+        - frequencies: angular frequencies omega, in the units of the velocities over the lengths
+        - velocity_vector: speed of every mode, shape (modes,)
+        The d-propagation problem gains the term i omega diag(chi/v); the complex problems of
+        all frequencies are diagonalised and solved in stacked batches of chunk_size frequencies.
+        sigma(0) is the DC conductance_tensor when the conduct matrices are symmetric, i.e. when
+        the total current is conserved along the segments. Otherwise the DC model takes the
+        current leaving a segment as the one reaching its right terminal, and the two differ.
+        Charge piling up along the segments couples to the gates, so the rows and columns of
+        sigma(omega) no longer sum up to zero.
+        """
+        frequencies = np.atleast_1d( np.asarray( frequencies, dtype=float ) )
+        velocity_vector = np.asarray( velocity_vector, dtype=float )
+        if velocity_vector.shape != (self.num_modes,) or np.any( velocity_vector <= 0 ):
+            raise ValueError('velocity_vector should hold a positive speed for every mode')
+        if frequencies.ndim != 1:
+            raise ValueError('frequencies should be a sequence of angular frequencies')
+
+        d_propagation_matrices, quant_charge_vectors = self._segment_arrays(quantity)
+        num_segment_types = len(d_propagation_matrices)
+        lengths = self._segment_lengths(num_segment_types)
+        dynamics = 1j*np.diag( np.asarray( self.chirality_vector )/velocity_vector )
+
+        sigma = np.empty( (len(frequencies),self.num_terminals,self.num_terminals), dtype=complex )
+        for start in range(0, len(frequencies), chunk_size):
+            chunk = frequencies[start:start+chunk_size]
+            # every segment type at every frequency of the chunk is one batch entry
+            matrices = d_propagation_matrices[None] + chunk[:,None,None,None]*dynamics
+            coefficients = _ac_terminal_coefficients( matrices.reshape( (-1,)+matrices.shape[2:] ),
+                                                      np.asarray( self.chirality_vector )[None],
+                                                      np.tile( quant_charge_vectors, (len(chunk),1) ),
+                                                      np.tile( lengths, (len(chunk),1) ) if num_segment_types > 1 else lengths )
+            coefficients = [ coefficient.reshape( (len(chunk),self.num_terminals) ) for coefficient in coefficients ]
+            sigma[start:start+len(chunk)] = _band_to_dense( _ring_conductance_band( *coefficients ) )
         return sigma
 
-    def _calc_conductance_tensors(self):
-        self.charge_conductance_tensor = self.conductance_tensor('charge')
-        self.heat_conductance_tensor = self.conductance_tensor('heat')
+    def mode_profiles(self, positions, quantity='charge', biases=None):
+        """
+        Current and potential (voltage or temperature) of every mode along every segment.
+        - positions: fractions of the segments where the modes are evaluated, 0 at terminal t
+          and 1 at terminal t+1 for the segment t
+        - biases: voltages ('charge') or temperatures ('heat') of the terminals,
+          defaults to the instance voltages or temperatures
+        Returns the currents and the potentials, both of shape (num_terminals, len(positions), modes):
+        V_j = I_j/(chi_j q_j) for 'charge' and T_j with T_j^2/2 = J_j/(chi_j c_j) for 'heat', as the
+        currents of current_all_terminals. A mode without charge has no potential (NaN).
+        Every segment is solved once, whatever the number of positions.
+        """
+        self._check_quantity_unit( quantity, 'quantized' )
+        positions = np.atleast_1d( np.asarray( positions, dtype=float ) )
+        if positions.ndim != 1:
+            raise ValueError('positions should be a sequence of fractions of the segments')
+        if biases is None:
+            biases = self.voltages if quantity=='charge' else self.temperatures
+        biases = np.asarray( biases, dtype=float )
+        if biases.shape != (self.num_terminals,):
+            raise ValueError('biases should have the shape (num_terminals,)')
 
-    def _temperature_to_heatcurrent(self, temperatures):
-        return np.array( [ kappa0*temperatures[i]**2/2 for i in range( len(temperatures) ) ] )
+        d_propagation_matrices, quant_charge_vectors = self._segment_arrays(quantity)
+        profiles = _segment_profiles( d_propagation_matrices, np.asarray( self.chirality_vector )[None],
+                                      quant_charge_vectors, self._segment_lengths( len(d_propagation_matrices) ),
+                                      positions, self._eig )
+        profiles = profiles.reshape( (self.num_terminals,)+profiles.shape[2:] )
 
-    def current_all_terminals(self,quantity='charge',unit='quantized'):
+        # the segment t joins the terminals t and t+1
+        drives = _drives( biases, quantity )
+        currents = np.einsum( 'tpjr,tr->tpj', profiles, np.stack( [ drives, np.roll( drives, -1 ) ], axis=-1 ) )
+        mode_charges = np.asarray( self.chirality_vector )*quant_charge_vectors
+        with np.errstate( divide='ignore', invalid='ignore' ):
+            potentials = np.where( mode_charges[:,None,:] != 0, currents/mode_charges[:,None,:], np.nan )
+        if quantity=='heat':
+            # rounding may leave T^2 slightly negative
+            potentials = np.sqrt( 2*np.maximum( potentials, 0 ) )
+        return currents, potentials
+
+    def _input_names(self, quantity):
+        """
+        Names of the conduct matrix and the charges that sigma of the quantity depends on,
+        the segment inputs when they are given.
+        """
+        if quantity=='charge':
+            names = [ 'charge_conduct_matrix', 'charge_vector' ]
+        elif quantity=='heat':
+            names = [ 'heat_conduct_matrix', 'central_charge_vector' ]
+        else:
+            raise ValueError("The argument quantity should be either 'charge' or 'heat' ")
+        segment_names = [ 'segment_'+names[0].replace('_matrix','_matrices'), 'segment_'+names[1]+'s' ]
+        return tuple( segment_name if getattr( self, segment_name ) is not None else name
+                      for name, segment_name in zip( names, segment_names ) )
+
+    def _segment_input_gradients(self, quantity):
+        """
+        Derivatives of d_plus (index 0) and d_minus (index 1) of every segment by
+        the conduct matrix, shape (terminals, 2, modes, modes), the charges,
+        shape (terminals, 2, modes), and the length of the segment, shape (terminals, 2).
+        With segment inputs, these are the derivatives by the inputs of the segment itself.
+        """
+        d_propagation_matrices, quant_charge_vectors = self._segment_arrays(quantity)
+        chirality_vector = np.asarray( self.chirality_vector )[None]
+
+        d, grad_matrix, grad_length, grad_emanating = _segment_gradients( d_propagation_matrices, chirality_vector,
+                                                                          quant_charge_vectors,
+                                                                          self._segment_lengths( len(d_propagation_matrices) ),
+                                                                          self._eig )
+        grad_conduct, grad_charge = _input_gradients( grad_matrix, grad_emanating, d_propagation_matrices,
+                                                      chirality_vector, quant_charge_vectors )
+        num_terminals = self.num_terminals
+        return ( grad_conduct.reshape( (num_terminals,)+grad_conduct.shape[2:] ),
+                 grad_charge.reshape( (num_terminals,)+grad_charge.shape[2:] ),
+                 grad_length.reshape( (num_terminals,)+grad_length.shape[2:] ) )
+
+    def conductance_tensor_gradient(self, quantity='charge'):
+        """
+        Derivatives of conductance_tensor(quantity) by the inputs, as a dictionary from
+        'charge_conduct_matrix' (or 'heat_conduct_matrix'), 'charge_vector' (or
+        'central_charge_vector') and 'inter_terminal_length_vector' to arrays with the shape
+        of that input followed by (terminals, terminals), e.g.
+        gradient['charge_conduct_matrix'][j,k] = d sigma / d charge_conduct_matrix[j,k]
+        When segment inputs are given, they replace the inputs of the device in the dictionary.
+        """
+        gradients = {}
+        for name, gradient in zip( self._input_names(quantity)+('inter_terminal_length_vector',),
+                                   self._segment_input_gradients(quantity) ):
+            # sigma is linear in d_plus and d_minus, the segment axis goes last
+            gradient = np.moveaxis( gradient, 0, -1 )
+            if _is_segment_input(name):
+                # only the segment itself depends on its own inputs
+                gradient = gradient[:,None]*np.identity( self.num_terminals ).reshape(
+                    (self.num_terminals,)+(1,)*(gradient.ndim-2)+(self.num_terminals,) )
+            gradients[name] = _ring_conductance_tensor( gradient[0], gradient[1] )
+        return gradients
+
+    def _calc_conductance_tensors(self):
+        self.conductance_tensor('charge')
+        self.conductance_tensor('heat')
+
+    def _currents_in_unit(self, currents, quantity, unit):
         if unit=='quantized':
-            unit_coeff = 1
-        elif unit=='SI':
-            unit_coeff = sigma0
+            return currents.copy()
+        elif quantity=='charge':
+            # The unit of output electrical current will be in amperes
+            return currents*sigma0
         else:
+            # The unit of output heat current will be in Watts
+            return currents*kappa0
+
+    def _check_quantity_unit(self, quantity, unit):
+        if unit not in ('quantized','SI'):
             raise ValueError("The unit should be either 'quantized' or 'SI'")
+        if quantity not in ('charge','heat'):
+            raise ValueError("The argument quantity should be either 'charge' or 'heat' ")
+
+    def current_all_terminals(self,quantity='charge',unit='quantized'):
+        """
+        sigma.V for 'charge' and sigma.T^2/2 for 'heat', see conductance_tensor.
+        Only the currents are recomputed when the voltages or temperatures change,
+        the conductance tensor is reused.
+        """
+        self._check_quantity_unit( quantity, unit )
 
-        #self.calc_conductance_tensors()
         if quantity=='charge':
-            self.charge_conductance_tensor = self.conductance_tensor('charge')
-            # The unit of output electrical current will be in amperes
-            return np.matmul( self.charge_conductance_tensor, self.voltages)*unit_coeff
-        elif quantity=='heat':
-            self.heat_conductance_tensor = self.conductance_tensor('heat')
-            if unit=='quantized':
-                return np.matmul( self.self.heat_conductance_tensor, self.temperatures)
-            elif unit=='SI':
-                # The unit of output electrical current will be in Watts
-                return self._temperature_to_heatcurrent( np.matmul( self.heat_conductance_tensor, self.temperatures) )
+            currents = self._observable( 'charge_currents',
+                                         lambda: np.matmul( self.conductance_tensor('charge'), self.voltages) )
         else:
-            raise ValueError("The argument quantity should be either 'charge' or 'heat' ")
+            currents = self._observable( 'heat_currents',
+                                         lambda: np.matmul( self.conductance_tensor('heat'), _drives( self.temperatures, 'heat' ) ) )
+        return self._currents_in_unit( currents, quantity, unit )
+
+    def current_all_terminals_batch(self, biases, quantity='charge', unit='quantized'):
+        """
+        Currents at all terminals for many bias configurations at once.
+        - biases: voltages ('charge') or temperatures ('heat') of shape (num_terminals, K)
+        Returns the currents with shape (num_terminals, K) from a single matmul;
+        the instance voltages and temperatures are left untouched.
+        """
+        self._check_quantity_unit( quantity, unit )
+
+        biases = np.asarray( biases, dtype=float )
+        if biases.ndim != 2 or biases.shape[0] != self.num_terminals:
+            raise ValueError('biases should have the shape (num_terminals, K)')
+
+        return self._currents_in_unit( np.matmul( self.conductance_tensor(quantity), _drives( biases, quantity ) ), quantity, unit )
 
     def four_terminal_conductance( self ,current_terminals, potential_terminals ,quantity='charge'):
+        """
+        The current I enters at current_terminals[0] and leaves at current_terminals[1],
+        no current flows through the other terminals. Returns -I/(V_1-V_2) where
+        V_1 and V_2 are the potentials at potential_terminals.
+        Solved in linear time in the number of terminals using the banded sigma.
+        """
         if self.num_terminals <3:
             raise ValueError('Number of terminals shoud be at least 3')
+        if quantity not in ('charge','heat'):
+            raise ValueError("The argument quantity should be either 'charge' or 'heat' ")
 
-        current_order = [ current_terminals[0]-1,current_terminals[1]-1 ]
-        for terminal in range(self.num_terminals):
-            if not(terminal+1 in current_terminals):
-                current_order += [terminal]
+        source, drain = current_terminals[0]-1, current_terminals[1]-1
+        probe_1, probe_2 = potential_terminals[0]-1, potential_terminals[1]-1
 
-        potential_order = [ potential_terminals[0]-1,potential_terminals[1]-1 ]
-        for terminal in range(self.num_terminals):
-            if not(terminal+1 in potential_terminals):
-                potential_order += [terminal]
-
-        if self._conductance_tensor_calc_flag[quantity]==False:
-            if quantity=='charge':
-                self.charge_conductance_tensor = self.conductance_tensor('charge')
-            elif quantity=='heat':
-                self.heat_conductance_tensor = self.conductance_tensor('heat')
-            else:
-                raise ValueError("The argument quantity should be either 'charge' or 'heat' ")
+        currents = np.zeros( (self.num_terminals,1), dtype=float )
+        currents[source] += 1
+        currents[drain] -= 1
 
+        try:
+            potentials = _solve_cyclic_tridiagonal( _grounded_band( self.conductance_band(quantity), probe_2 ),
+                                                    currents )[:,0]
+            return _conductance_from_potentials( potentials, probe_1, probe_2 )
+        except la.LinAlgError:
+            raise _measurement_error( current_terminals, potential_terminals )
 
-        if quantity=='charge':
-            sigma_shuffled = self.charge_conductance_tensor[ current_order ].transpose()[potential_order].transpose()
-        elif quantity=='heat':
-            sigma_shuffled = self.heat_conductance_tensor[ current_order ].transpose()[potential_order].transpose()
-        else:
-            raise ValueError("The argument quantity should be either 'charge' or 'heat' ")
+    def four_terminal_conductance_gradient(self, current_terminals, potential_terminals, quantity='charge'):
+        """
+        Returns four_terminal_conductance and its derivatives by the inputs, as a dictionary
+        like conductance_tensor_gradient with arrays of the shape of each input.
+        With the potentials V from sigma.V = I and the adjoint potentials W from
+        sigma^T.W = e_1-e_2, the derivative of V_1-V_2 is -W^T.(d sigma).V, which costs
+        one more banded solve.
+        """
+        if self.num_terminals <3:
+            raise ValueError('Number of terminals shoud be at least 3')
+        self._input_names(quantity)
+
+        source, drain = current_terminals[0]-1, current_terminals[1]-1
+        probe_1, probe_2 = potential_terminals[0]-1, potential_terminals[1]-1
+
+        currents = np.zeros( (self.num_terminals,2), dtype=float )
+        currents[source,0] += 1
+        currents[drain,0] -= 1
+        currents[probe_1,1] += 1
+        currents[probe_2,1] -= 1
 
-        sigma_SS = sigma_shuffled[:2,:2].copy()
-        sigma_ST = sigma_shuffled[:2,2:self.num_terminals].copy()
-        sigma_TS = sigma_shuffled[2:self.num_terminals,:2].copy()
-        sigma_TT = sigma_shuffled[2:self.num_terminals,2:self.num_terminals].copy()
-        #return self.charge_conductance_tensor, sigma_shuffled
+        band = _grounded_band( self.conductance_band(quantity), probe_2 )
         try:
-            four_terminal_sigma = sigma_SS-np.matmul( sigma_ST, np.matmul( la.inv(sigma_TT ), sigma_TS) )
-            return -four_terminal_sigma[0,0]
+            potentials = _solve_cyclic_tridiagonal( band, currents[:,:1] )[:,0]
+            conductance = _conductance_from_potentials( potentials, probe_1, probe_2 )
+            adjoint = _solve_cyclic_tridiagonal( _transposed_band(band), currents[:,1:] )[:,0]
         except la.LinAlgError:
-            raise la.LinAlgError( 'Error: The current between the terminals {} and {} cannot be determined from the potentials at'\
-                  ' the terminals {} and {}'.format( current_terminals[0],current_terminals[1],potential_terminals[0],potential_terminals[1] ) )
+            raise _measurement_error( current_terminals, potential_terminals )
+
+        gradients = self._gradients_from_potentials( potentials[None], adjoint[None], np.array([conductance]), quantity )
+        return conductance, { name: gradient[0] for name, gradient in gradients.items() }
+
+    def _gradients_from_potentials(self, potentials, adjoints, conductances, quantity):
+        """
+        Derivatives of K conductances -1/(V_1-V_2) from their potentials and adjoint
+        potentials, both of shape (K, terminals), see four_terminal_conductance_gradient.
+        """
+        # the segment t carries d_plus[t]*V[t] + d_minus[t]*V[t+1] from terminal t to t+1
+        adjoint_steps = np.roll( adjoints, -1, axis=-1 ) - adjoints
+        weights = np.stack( [ adjoint_steps*potentials, adjoint_steps*np.roll( potentials, -1, axis=-1 ) ], axis=-1 )
+        # -1/(V_1-V_2) changes by conductance^2 times the change of V_1-V_2
+        weights *= -( conductances**2 )[:,None,None]
+
+        gradients = {}
+        for name, gradient in zip( self._input_names(quantity)+('inter_terminal_length_vector',),
+                                   self._segment_input_gradients(quantity) ):
+            weighted = weights.reshape( weights.shape+(1,)*(gradient.ndim-2) )*gradient[None]
+            # the inputs of the device enter every segment, those of a segment only that segment
+            gradients[name] = weighted.sum(axis=2) if _is_segment_input(name) else weighted.sum(axis=(1,2))
+        return gradients
+
+    def conductance_gradients(self, measurements, quantity='charge'):
+        """
+        Conductances of several measurements and their derivatives by the inputs in one pass.
+        - measurements: sequence of (current_terminals, potential_terminals), a two-terminal
+          conductance has equal current and potential terminals
+        Returns the conductances, shape (K,), and a dictionary like conductance_tensor_gradient
+        with arrays of shape (K,)+(shape of the input). All the potentials come from one banded
+        solve grounded at the first terminal and all the adjoint potentials from one more.
+        """
+        measurements = [ ( tuple(current_terminals), tuple(potential_terminals) )
+                         for current_terminals, potential_terminals in measurements ]
+        if self.num_terminals <3:
+            # only the two-terminal conductance exists
+            conductance, gradients = self.two_terminal_conductance_gradient( (1,2), quantity )
+            return ( np.full( len(measurements), conductance ),
+                     { name: np.repeat( gradient[None], len(measurements), axis=0 )
+                       for name, gradient in gradients.items() } )
+
+        currents = np.zeros( (self.num_terminals,2*len(measurements)), dtype=float )
+        for column, (current_terminals, potential_terminals) in enumerate(measurements):
+            currents[current_terminals[0]-1,column] += 1
+            currents[current_terminals[1]-1,column] -= 1
+            currents[potential_terminals[0]-1,len(measurements)+column] += 1
+            currents[potential_terminals[1]-1,len(measurements)+column] -= 1
+
+        band = _grounded_band( self.conductance_band(quantity), 0 )
+        try:
+            potentials = _solve_cyclic_tridiagonal( band, currents[:,:len(measurements)] ).T
+            adjoints = _solve_cyclic_tridiagonal( _transposed_band(band), currents[:,len(measurements):] ).T
+        except la.LinAlgError:
+            raise _measurement_error( *measurements[0] )
+
+        conductances = np.empty( len(measurements) )
+        for column, (current_terminals, potential_terminals) in enumerate(measurements):
+            try:
+                conductances[column] = _conductance_from_potentials( potentials[column], potential_terminals[0]-1,
+                                                                     potential_terminals[1]-1 )
+            except la.LinAlgError:
+                raise _measurement_error( current_terminals, potential_terminals )
+        return conductances, self._gradients_from_potentials( potentials, adjoints, conductances, quantity )
+
+    def solve_all(self, two_terminals=(1,2), four_terminals=None):
+        """
+        Charge and heat transport in one pass, returned as a TransportResult.
+        - two_terminals: terminals of the two-terminal conductance, or None
+        - four_terminals: (current_terminals, potential_terminals) of the
+          four-terminal conductance, or None
+        Both d-propagation problems are diagonalised in one batch and solved together,
+        and all the requested conductances come from one banded solve per quantity.
+        """
+        quantities = ('charge','heat')
+        try:
+            self._fused_conductance_bands(quantities)
+        except la.LinAlgError:
+            # solved again one quantity at a time below to find the failing one
+            pass
+
+        measurements = []
+        if two_terminals is not None:
+            measurements.append( ( 'two', tuple(two_terminals), tuple(two_terminals) ) )
+        if four_terminals is not None:
+            if self.num_terminals <3:
+                raise ValueError('Number of terminals shoud be at least 3')
+            measurements.append( ( 'four', tuple(four_terminals[0]), tuple(four_terminals[1]) ) )
+
+        result = TransportResult()
+        for quantity in quantities:
+            result.two_terminal_conductances[quantity] = None
+            result.four_terminal_conductances[quantity] = None
+            try:
+                sigma = self.conductance_tensor(quantity)
+                currents = self._observable( quantity+'_currents',
+                                             lambda: np.matmul( sigma, self.voltages if quantity=='charge'
+                                                                       else _drives( self.temperatures, 'heat' ) ) )
+                conductances = self._measure_conductances( quantity, sigma, measurements )
+            except la.LinAlgError as error:
+                result.errors[quantity] = str(error)
+                continue
+
+            result.conductance_tensors[quantity] = sigma
+            result.currents[quantity] = currents.copy()
+            result.currents_SI[quantity] = self._currents_in_unit( currents, quantity, 'SI' )
+            for (kind, current_terminals, potential_terminals), conductance in zip( measurements, conductances ):
+                getattr( result, kind+'_terminal_conductances' )[quantity] = conductance
+            result.errors[quantity] = ''
+        return result
+
+    def _fused_conductance_bands(self, quantities):
+        missing = [ quantity for quantity in quantities if quantity+'_conductance_band' not in self._observables ]
+        if not missing:
+            return
+
+        segment_arrays = [ self._segment_arrays(quantity) for quantity in missing ]
+        num_segment_types = max( len(d_propagation_matrices) for d_propagation_matrices, _ in segment_arrays )
+        if num_segment_types > 1:
+            # every segment of every quantity is one batch entry
+            segment_arrays = [ ( np.broadcast_to( d_propagation_matrices, (self.num_terminals,)+d_propagation_matrices.shape[1:] ),
+                                 np.broadcast_to( quant_charge_vectors, (self.num_terminals,)+quant_charge_vectors.shape[1:] ) )
+                               for d_propagation_matrices, quant_charge_vectors in segment_arrays ]
+        d_propagation_matrices = np.concatenate( [ d_propagation_matrices for d_propagation_matrices, _ in segment_arrays ] )
+        quant_charge_vectors = np.concatenate( [ quant_charge_vectors for _, quant_charge_vectors in segment_arrays ] )
+
+        d_plus, d_minus = _segment_coefficients( d_propagation_matrices, np.asarray( self.chirality_vector )[None],
+                                                 quant_charge_vectors,
+                                                 np.tile( self._segment_lengths(num_segment_types), (len(missing),1) ),
+                                                 self._eig )
+        bands = _ring_conductance_band( d_plus.reshape( len(missing), -1 ), d_minus.reshape( len(missing), -1 ) )
 
+        for quantity, band in zip( missing, bands ):
+            self._observable( quantity+'_conductance_band', lambda: band )
+
+    def _measure_conductances(self, quantity, sigma, measurements):
+        if not measurements:
+            return []
+        if self.num_terminals <3:
+            # only the two-terminal conductance exists
+            return [ -sigma[0,0] ]
+
+        # unit currents of all measurements from a single solve grounded at the first terminal
+        currents = np.zeros( (self.num_terminals,len(measurements)), dtype=float )
+        for column, (kind, current_terminals, potential_terminals) in enumerate(measurements):
+            currents[current_terminals[0]-1,column] += 1
+            currents[current_terminals[1]-1,column] -= 1
+        try:
+            potentials = _solve_cyclic_tridiagonal( _grounded_band( self.conductance_band(quantity), 0 ), currents )
+        except la.LinAlgError:
+            raise _measurement_error( *measurements[0][1:] )
+
+        conductances = []
+        for column, (kind, current_terminals, potential_terminals) in enumerate(measurements):
+            try:
+                conductances.append( _conductance_from_potentials( potentials[:,column],
+                                                                   potential_terminals[0]-1, potential_terminals[1]-1 ) )
+            except la.LinAlgError:
+                raise _measurement_error( current_terminals, potential_terminals )
+        return conductances
+
+    def resistance_matrix(self, quantity='charge'):
+        """
+        Returns a MultiTerminalResistance with every two- and four-terminal resistance.
+        sigma is grounded at the first terminal and solved once for the currents
+        entering at each terminal, which costs about one inversion in total.
+        """
+        self._quantity_arrays(quantity)
+        return MultiTerminalResistance( self._observable( quantity+'_grounded_response',
+                                                          lambda: self._grounded_response(quantity) ) )
+
+    def _grounded_response(self, quantity):
+        # columns: unit current entering at each terminal and leaving at the first one
+        currents = np.identity(self.num_terminals)
+        currents[0] -= 1
+        if self.num_terminals >= 3:
+            return _solve_cyclic_tridiagonal( _grounded_band( self.conductance_band(quantity), 0 ), currents )
+        sigma = self.conductance_tensor(quantity)
+        sigma[0,0] += np.where( sigma[0,0] > 0, 1.0, -1.0 )*max( np.max( np.abs(sigma) ), 1.0 )
+        return la.solve( sigma, currents )
 
     def two_terminal_conductance(self, voltage_terminals , quantity='charge'):
         if self.num_terminals>2:
             return self.four_terminal_conductance(voltage_terminals,voltage_terminals,quantity )
 
-        if self._conductance_tensor_calc_flag[quantity]==False:
-            if quantity=='charge':
-                self.charge_conductance_tensor = self.conductance_tensor('charge')
-            elif quantity=='heat':
-                self.heat_conductance_tensor = self.conductance_tensor('heat')
-            else:
-                raise ValueError("The argument quantity should be either 'charge' or 'heat' ")
-
         if quantity=='charge':
             return -self.charge_conductance_tensor[0,0]
         elif quantity=='heat':
             return -self.heat_conductance_tensor[0,0]
         else:
             raise ValueError("The argument quantity should be either 'charge' or 'heat' ")
+
+    def two_terminal_conductance_gradient(self, voltage_terminals, quantity='charge'):
+        """
+        Returns two_terminal_conductance and its derivatives by the inputs,
+        see four_terminal_conductance_gradient.
+        """
+        if self.num_terminals>2:
+            return self.four_terminal_conductance_gradient( voltage_terminals, voltage_terminals, quantity )
+
+        conductance = self.two_terminal_conductance( voltage_terminals, quantity )
+        gradients = self.conductance_tensor_gradient(quantity)
+        return conductance, { name: -gradient[...,0,0] for name, gradient in gradients.items() }
@@ -1,5 +1,4 @@
 import numpy as np
-import matplotlib as mpl
 import matplotlib.patches as mpat
 import matplotlib.pyplot as plt
 
@@ -30,10 +29,22 @@ class DrawQuantumHall():
         self.init_plot_objects()
 
     def init_plot_objects(self):
+        """
+        The figure and its artists are created once by draw_bar and kept; later changes
+        only move, recolour or hide them.
+        """
+        self.figure = None
+        self.ax = None
         self.mode_object_list = None
-
-
-    def draw_one_mode(self, plt_obj ,margin ,color,chirality):
+        self.terminal_object_list = None
+        self.filling_text = None
+        self._background = None
+
+    def mode_geometry(self, margin):
+        """
+        The four lines of a mode at the given margin from the bar, each with the
+        position and the direction of its arrow for a positive chirality.
+        """
         bottom_y = -self.Ly + margin
         top_y = self.Ly-margin
         left_x = -self.Lx+margin
@@ -41,57 +52,164 @@ class DrawQuantumHall():
 
         middle_x = 0
         middle_y = 0
+        return [ ( (left_x,right_x),(top_y,top_y), (middle_x,top_y), (1,0) ),
+                 ( (right_x,right_x),(top_y,bottom_y), (right_x,middle_y), (0,-1) ),
+                 ( (right_x,left_x),(bottom_y,bottom_y), (middle_x,bottom_y), (-1,0) ),
+                 ( (left_x,left_x),(bottom_y,top_y), (left_x,middle_y), (0,1) ) ]
+
+    def draw_one_mode(self, plt_obj ,margin ,color,chirality):
         #color=color
         arrow_size = 0.4
         linestyle = '-'
 
         mode_obj = []
-        # top line
-        mode_obj.append( plt_obj.plot( (left_x,right_x),(top_y,top_y), color=color,ls=linestyle ) )
-        mode_obj.append( plt_obj.arrow( middle_x,top_y,arrow_size*chirality,0 ,shape='full',
-                      length_includes_head=True,head_width=arrow_size,overhang=0.5,color=color) )
-
-        mode_obj.append(plt_obj.plot( (right_x,right_x),(top_y,bottom_y), color=color,ls=linestyle ) )
-        mode_obj.append(plt_obj.arrow( right_x,middle_y,0,-arrow_size*chirality ,shape='full',
-                      length_includes_head=True,head_width=arrow_size,overhang=0.5,color=color) )
-
-        mode_obj.append(plt_obj.plot( (right_x,left_x),(bottom_y,bottom_y), color=color,ls=linestyle ) )
-        mode_obj.append(plt_obj.arrow( middle_x,bottom_y,-arrow_size*chirality,0 ,shape='full',
-                      length_includes_head=True,head_width=arrow_size,overhang=0.5,color=color))
-
-        mode_obj.append(plt_obj.plot( (left_x,left_x),(bottom_y,top_y), color=color,ls=linestyle ) )
-        mode_obj.append(plt_obj.arrow( left_x,middle_y,0,arrow_size*chirality ,shape='full',
-                      length_includes_head=True,head_width=arrow_size,overhang=0.5,color=color))
-        
+        for xs, ys, (x,y), (dx,dy) in self.mode_geometry(margin):
+            mode_obj.append( plt_obj.plot( xs, ys, color=color,ls=linestyle )[0] )
+            mode_obj.append( plt_obj.arrow( x,y,arrow_size*chirality*dx,arrow_size*chirality*dy ,shape='full',
+                          length_includes_head=True,head_width=arrow_size,overhang=0.5,color=color) )
         return mode_obj
 
-
     def draw_modes(self ):
-        if self.mode_object_list is not None:
-            del self.mode_object_list
-        plt_obj = self.plt_obj
+        """
+        Creates the artists of max_num_modes modes at least, those beyond num_modes are hidden.
+        """
+        plt_obj = self.ax
         mode_margin = 0.5
         mode_distance = 0.5
-        cmap = mpl.cm.get_cmap('viridis')
+        cmap = plt.get_cmap('viridis')
         max_num_modes = 10
-        mode_object_list = [] 
-        for mode in range( self.num_modes ):
+        mode_object_list = []
+        for mode in range( max( self.num_modes, max_num_modes ) ):
             color = cmap(mode/max_num_modes)
-            mode_object_list.append( self.draw_one_mode(plt_obj,mode_margin+mode*mode_distance,color, self.chirality_vector[mode] ) )
-            
+            chirality = self.chirality_vector[mode] if mode < self.num_modes else 1
+            mode_object_list.append( self.draw_one_mode(plt_obj,mode_margin+mode*mode_distance,color, chirality ) )
+
         self.mode_object_list = mode_object_list
 
     def update_mode(self):
-        pass
-    
+        """
+        Flips the arrows to the chiralities and shows the first num_modes modes.
+        Returns whether anything changed.
+        """
+        if self.num_modes > len(self.mode_object_list):
+            for mode_obj in self.mode_object_list:
+                for artist in mode_obj:
+                    artist.remove()
+            self.draw_modes()
+
+        arrow_size = 0.4
+        changed = False
+        for mode, mode_obj in enumerate(self.mode_object_list):
+            visible = mode < self.num_modes
+            chirality = self.chirality_vector[mode] if visible else 1
+            for (xs, ys, (x,y), (dx,dy)), line, arrow in zip( self.mode_geometry( 0.5+0.5*mode ),
+                                                              mode_obj[0::2], mode_obj[1::2] ):
+                if line.get_visible() != visible:
+                    line.set_visible(visible)
+                    arrow.set_visible(visible)
+                    changed = True
+                direction = ( arrow_size*chirality*dx, arrow_size*chirality*dy )
+                if visible and getattr( arrow, '_direction', None ) != direction:
+                    arrow.set_data( x=x, y=y, dx=direction[0], dy=direction[1] )
+                    arrow._direction = direction
+                    changed = True
+
+        filling_fraction = abs( np.dot(self.chirality_vector, self.charge_vector  ) )
+        text = 'Quantum Hall bar at filling fraction '+'{:.2f}'.format( filling_fraction )
+        if self.filling_text.get_text() != text:
+            self.filling_text.set_text(text)
+            changed = True
+        return changed
+
     def update_value(self, var , value ):
         if isinstance(var,str):
-            exec( 'self.'+var+'='+ str(value) )
+            setattr( self, var, value )
         else:
             print('Warning: var should be a string. No value has been changed.')
-    
-    def draw_terminals(self  ):
-        plt_obj = self.plt_obj
+
+    def update(self, num_terminals=None, num_modes=None, chirality_vector=None, charge_vector=None):
+        """
+        Changes the bar and redraws only what changed: the modes and the filling fraction
+        are redrawn on the cached background, the terminals need a full draw.
+        """
+        if num_modes is not None:
+            self.num_modes = num_modes
+        if chirality_vector is not None:
+            self.chirality_vector = np.array(chirality_vector)
+        if charge_vector is not None:
+            self.charge_vector = np.array(charge_vector)
+        if len(self.chirality_vector)!= self.num_modes:
+            raise TypeError('The length of the chirality vector does not match the number of modes')
+        if len(self.charge_vector)!= self.num_modes:
+            raise TypeError('The length of the charge vector does not match the number of modes')
+
+        terminals_changed = num_terminals is not None and num_terminals != self.num_terminals
+        if terminals_changed:
+            self.num_terminals = num_terminals
+        if self.figure is None:
+            return
+
+        if terminals_changed:
+            self.draw_terminals()
+        modes_changed = self.update_mode()
+        if not self.is_live():
+            # the output is a static image, see show
+            return
+        if terminals_changed:
+            self.redraw( full=True )
+        elif modes_changed:
+            self.redraw()
+
+    def is_live(self):
+        """
+        Whether the figure is still open, i.e. blitting reaches what is shown. Backends that
+        render a static image (e.g. inline) close the figure once it has been displayed.
+        """
+        return self.figure is not None and plt.fignum_exists( self.figure.number )
+
+    def show(self):
+        """
+        Displays the figure again if it is no longer live, so that the static image follows the changes.
+        """
+        if self.figure is not None and not self.is_live():
+            from IPython.display import display
+            display( self.figure )
+
+    def _dynamic_artists(self):
+        return [ artist for mode_obj in self.mode_object_list for artist in mode_obj ]+[ self.filling_text ]
+
+    def redraw(self, full=False):
+        """
+        Blits the modes on the cached background of the static artists when the canvas
+        supports it, and asks for a full draw otherwise.
+        """
+        canvas = self.figure.canvas
+        if not canvas.supports_blit:
+            canvas.draw_idle()
+            return
+
+        if full or self._background is None:
+            dynamic_artists = self._dynamic_artists()
+            visibility = [ artist.get_visible() for artist in dynamic_artists ]
+            for artist in dynamic_artists:
+                artist.set_visible(False)
+            canvas.draw()
+            self._background = canvas.copy_from_bbox( self.ax.bbox )
+            for artist, visible in zip( dynamic_artists, visibility ):
+                artist.set_visible(visible)
+        else:
+            canvas.restore_region( self._background )
+        for artist in self._dynamic_artists():
+            self.ax.draw_artist(artist)
+        canvas.blit( self.ax.bbox )
+        canvas.flush_events()
+
+    def terminal_geometry(self):
+        """
+        Rectangle (bottom-left corner, width, height) and label (position, rotation) of every
+        terminal, in the order of the terminals. They are dealt out to the left, right, top
+        and bottom sides in turn.
+        """
         sides = 4
         num_terms_side = [0,0,0,0]
         side=0
@@ -99,14 +217,9 @@ class DrawQuantumHall():
             num_terms_side[side] += 1
             side = (side+1)%sides
 
-
         terminals_quota = 0.5
-        terminal_color = (0.5,0.5,0.9,0.8)
         terminal_height = self.Ly/4
-
-        ax = plt_obj.gca()
-
-        terminal_count = 1
+        geometry = []
 
         # Left side
         side = 0
@@ -114,17 +227,8 @@ class DrawQuantumHall():
             terminal_width_y = 2*self.Ly/num_terms_side[side]*terminals_quota
             inter_terminal_distance = 2*self.Ly*(1-terminals_quota)/(1+num_terms_side[side]  )
             for terminal in range( num_terms_side[side] ):
-                bottom_left_corner = (-self.Lx-terminal_height,-self.Ly+inter_terminal_distance+terminal*(terminal_width_y+inter_terminal_distance)  )
-                rect = mpat.Rectangle( bottom_left_corner ,
-                                      terminal_height,terminal_width_y,
-                                       facecolor=terminal_color, edgecolor='black' )
-                ax.add_patch(rect)
-
-                x,y = bottom_left_corner
-                x += terminal_height/2
-                y += terminal_width_y/2
-                plt_obj.text( x,y, 'Terminal #'+str(terminal_count),rotation='vertical',ha='center', va='center' )
-                terminal_count += 1
+                x,y = (-self.Lx-terminal_height,-self.Ly+inter_terminal_distance+terminal*(terminal_width_y+inter_terminal_distance)  )
+                geometry.append( ( (x,y), terminal_height,terminal_width_y, (x+terminal_height/2,y+terminal_width_y/2), 'vertical' ) )
 
         # Top side
         side = 2
@@ -132,18 +236,8 @@ class DrawQuantumHall():
             terminal_width_x = 2*self.Lx/num_terms_side[side]*terminals_quota
             inter_terminal_distance = 2*self.Lx*(1-terminals_quota)/(1+num_terms_side[side]  )
             for terminal in range( num_terms_side[side] ):
-                bottom_left_corner = (-self.Lx+inter_terminal_distance+terminal*(terminal_width_x+inter_terminal_distance) , self.Ly )
-                rect = mpat.Rectangle( bottom_left_corner ,
-                                       terminal_width_x,terminal_height,
-                                       facecolor=terminal_color, edgecolor='black'  )
-                ax.add_patch(rect)
-
-                x,y = bottom_left_corner
-                y += terminal_height/2
-                x += terminal_width_x/2
-                plt_obj.text( x,y, 'Terminal #'+str(terminal_count),ha='center', va='center' )
-                terminal_count += 1
-
+                x,y = (-self.Lx+inter_terminal_distance+terminal*(terminal_width_x+inter_terminal_distance) , self.Ly )
+                geometry.append( ( (x,y), terminal_width_x,terminal_height, (x+terminal_width_x/2,y+terminal_height/2), 0 ) )
 
         # Right side
         side = 1
@@ -151,18 +245,8 @@ class DrawQuantumHall():
             terminal_width_y = 2*self.Ly/num_terms_side[side]*terminals_quota
             inter_terminal_distance = 2*self.Ly*(1-terminals_quota)/(1+num_terms_side[side]  )
             for terminal in range( num_terms_side[side]-1,-1,-1 ):
-                bottom_left_corner = (self.Lx,-self.Ly+inter_terminal_distance+terminal*(terminal_width_y+inter_terminal_distance)  )
-                rect = mpat.Rectangle( bottom_left_corner ,
-                                      terminal_height,terminal_width_y,
-                                      facecolor=terminal_color, edgecolor='black' )
-                ax.add_patch(rect)
-
-                x,y = bottom_left_corner
-                x += terminal_height/2
-                y += terminal_width_y/2
-                plt_obj.text( x,y, 'Terminal #'+str(terminal_count),rotation=-90,ha='center', va='center' )
-                terminal_count += 1
-
+                x,y = (self.Lx,-self.Ly+inter_terminal_distance+terminal*(terminal_width_y+inter_terminal_distance)  )
+                geometry.append( ( (x,y), terminal_height,terminal_width_y, (x+terminal_height/2,y+terminal_width_y/2), -90 ) )
 
         # Bottom side
         side = 3
@@ -170,25 +254,56 @@ class DrawQuantumHall():
             terminal_width_x = 2*self.Lx/num_terms_side[side]*terminals_quota
             inter_terminal_distance = 2*self.Lx*(1-terminals_quota)/(1+num_terms_side[side]  )
             for terminal in range( num_terms_side[side]-1, -1, -1):
-                bottom_left_corner = (-self.Lx+inter_terminal_distance+terminal*(terminal_width_x+inter_terminal_distance) , -self.Ly-terminal_height )
-                rect = mpat.Rectangle( bottom_left_corner ,
-                                      terminal_width_x, terminal_height,
-                                      facecolor=terminal_color, edgecolor='black' )
-                ax.add_patch(rect)
+                x,y = (-self.Lx+inter_terminal_distance+terminal*(terminal_width_x+inter_terminal_distance) , -self.Ly-terminal_height )
+                geometry.append( ( (x,y), terminal_width_x, terminal_height, (x+terminal_width_x/2,y+terminal_height/2), 0 ) )
 
-                x,y = bottom_left_corner
-                y += terminal_height/2
-                x += terminal_width_x/2
-                plt_obj.text( x,y, 'Terminal #'+str(terminal_count),ha='center', va='center' )
-                terminal_count += 1
+        return geometry
 
+    def draw_terminals(self  ):
+        """
+        Moves the kept terminal rectangles and labels to the current layout,
+        creating only those that are missing and hiding the unused ones.
+        """
+        ax = self.ax
+        terminal_color = (0.5,0.5,0.9,0.8)
+        if self.terminal_object_list is None:
+            self.terminal_object_list = []
+
+        geometry = self.terminal_geometry()
+        while len(self.terminal_object_list) < len(geometry):
+            rect = mpat.Rectangle( (0,0), 1,1, facecolor=terminal_color, edgecolor='black' )
+            ax.add_patch(rect)
+            text = ax.text( 0,0, 'Terminal #'+str(len(self.terminal_object_list)+1),ha='center', va='center' )
+            self.terminal_object_list.append( (rect, text) )
+
+        for terminal, (rect, text) in enumerate(self.terminal_object_list):
+            visible = terminal < len(geometry)
+            rect.set_visible(visible)
+            text.set_visible(visible)
+            if visible:
+                bottom_left_corner, width, height, center, rotation = geometry[terminal]
+                rect.set_bounds( *bottom_left_corner, width, height )
+                text.set_position(center)
+                text.set_rotation(rotation)
 
     def draw_bar(self ):
+        """
+        Draws the bar on first use; afterwards the kept figure is brought up to date
+        and shown again if its window or output has been closed.
+        """
+        if self.figure is not None:
+            self.draw_terminals()
+            self.update_mode()
+            if self.is_live():
+                self.redraw( full=True )
+            self.show()
+            return
+
         outer_margin = 4
 
-        plt.figure( figsize=(15,10) )
+        self.figure = plt.figure( figsize=(15,10) )
         self.plt_obj = plt
-        ax = plt.gca()
+        ax = self.ax = self.figure.gca()
         ax.set_xlim(-self.Lx-outer_margin,self.Lx+outer_margin)
         ax.set_ylim(-self.Ly-outer_margin,self.Ly+outer_margin)
 
@@ -197,9 +312,16 @@ class DrawQuantumHall():
 
         rect = mpat.Rectangle( (-self.Lx,-self.Ly), 2*self.Lx,2*self.Ly,color=(0.8,0.8,0.9,0.5) )
         ax.add_patch(rect)
-        filling_fraction = abs( np.dot(self.chirality_vector, self.charge_vector  ) )
-        plt.text( 0,0, 'Quantum Hall bar at filling fraction '+'{:.2f}'.format( filling_fraction ),
+        self.filling_text = ax.text( 0,0, '',
                   fontfamily='sans-serif',fontsize='xx-large',ha='center', va='center' )
 
         self.draw_terminals()
-        plt.axis('off')
+        self.update_mode()
+        ax.axis('off')
+
+        if 'inline' in plt.get_backend():
+            # shown in the current output rather than once the cell finishes, and closed as
+            # the inline backend would; later changes are shown again by show
+            from IPython.display import display
+            display( self.figure )
+            plt.close( self.figure )
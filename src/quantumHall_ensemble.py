@@ -0,0 +1,216 @@
+from statistics import NormalDist
+
+import numpy as np
+import numpy.linalg as la
+
+from .quantumHall import ( QuantumHall, conductance_tensor_batch,
+                           two_terminal_conductance_batch, four_terminal_conductance_batch )
+
+class RunningStatistics:
+    """
+    Online mean and variance of a stream of arrays, without storing the samples.
+    Every batch is reduced with two passes and merged into the running moments
+    with the pairwise update of Chan et al., the batched form of Welford's algorithm.
+    NaN samples (undetermined conductances) are skipped element-wise.
+    """
+    def __init__(self, shape=()):
+        self.count = np.zeros(shape)
+        self.mean = np.zeros(shape)
+        self.m2 = np.zeros(shape)
+
+    def update(self, samples):
+        """
+        Adds samples of shape (batch,)+shape.
+        """
+        samples = np.asarray( samples, dtype=float )
+        valid = ~np.isnan(samples)
+        count = valid.sum(axis=0)
+        mean = np.where( valid, samples, 0 ).sum(axis=0)/np.maximum( count, 1 )
+        m2 = ( np.where( valid, samples-mean, 0 )**2 ).sum(axis=0)
+
+        total = self.count + count
+        delta = mean - self.mean
+        weight = count/np.maximum( total, 1 )
+        self.mean = self.mean + delta*weight
+        self.m2 = self.m2 + m2 + delta**2*self.count*weight
+        self.count = total
+
+    @property
+    def variance(self):
+        # sample variance, NaN with less than two samples
+        with np.errstate( divide='ignore', invalid='ignore' ):
+            return np.where( self.count > 1, self.m2/np.maximum( self.count-1, 1 ), np.nan )
+
+    @property
+    def std(self):
+        return np.sqrt( self.variance )
+
+    @property
+    def standard_error(self):
+        with np.errstate( divide='ignore', invalid='ignore' ):
+            return np.sqrt( self.variance/self.count )
+
+    def confidence_interval(self, level=0.95):
+        """
+        Half-width of the normal confidence interval of the mean at the given level.
+        """
+        return NormalDist().inv_cdf( 0.5+level/2 )*self.standard_error
+
+class EnsembleResult:
+    """
+    Outcome of DisorderEnsemble.run:
+    - statistics: dictionary keyed by 'charge' and 'heat' of dictionaries from the observables
+      'sigma', 'two_terminal' and 'four_terminal' to their RunningStatistics
+    - num_samples: number of devices drawn
+    - converged: whether the confidence intervals reached the tolerance
+    - seed: entropy of the random streams, reproduces the ensemble with the same batch_size
+    """
+    def __init__(self, statistics, num_samples, converged, seed):
+        self.statistics = statistics
+        self.num_samples = num_samples
+        self.converged = converged
+        self.seed = seed
+
+class DisorderEnsemble:
+    """
+    Random devices around a base configuration.
+    - base: keyword arguments of QuantumHall
+    - conduct_spread: the entries of the charge and heat conduct matrices are multiplied
+      by independent factors uniform in [1-conduct_spread, 1+conduct_spread]
+    - length_spread: same for the inter-terminal lengths
+    - symmetric: draw the same factor for the entries [j,k] and [k,j]
+    - sampler: optional callable sampler(rng, parameters) for other distributions, which
+      modifies in place the dictionary of the batched QuantumHall arguments
+      (see ParameterGrid.parameters) after the factors are applied
+    - seed: seed of the random streams
+    Batch k draws from its own stream, the k-th child of numpy.random.SeedSequence(seed),
+    so the streams are independent and a run is reproducible from its seed and batch size.
+    """
+    def __init__(self, base=None, conduct_spread=0.2, length_spread=0.0, symmetric=True,
+                 sampler=None, seed=None):
+        self.base = QuantumHall( **(base or {}) )
+        self.num_modes = self.base.num_modes
+        self.num_terminals = self.base.num_terminals
+        self.conduct_spread = float(conduct_spread)
+        self.length_spread = float(length_spread)
+        self.symmetric = symmetric
+        self.sampler = sampler
+        self.seed = np.random.SeedSequence( seed ).entropy
+
+    def rng(self, batch):
+        # the stream of a batch, same as SeedSequence(seed).spawn(batch+1)[batch]
+        return np.random.default_rng( np.random.SeedSequence( self.seed, spawn_key=(batch,) ) )
+
+    def _factors(self, rng, spread, shape):
+        return rng.uniform( 1-spread, 1+spread, shape )
+
+    def parameters(self, rng, size):
+        """
+        Draws the arrays of the QuantumHall arguments for size devices,
+        each with a leading axis of length size.
+        """
+        names = ( 'chirality_vector', 'charge_vector', 'charge_conduct_matrix', 'central_charge_vector',
+                  'heat_conduct_matrix', 'inter_terminal_length_vector' )
+        parameters = { name: np.array( np.broadcast_to( np.asarray( getattr( self.base, name ), dtype=float ),
+                                                        (size,)+np.shape( getattr( self.base, name ) ) ) )
+                       for name in names }
+
+        for name in ('charge_conduct_matrix', 'heat_conduct_matrix'):
+            factors = self._factors( rng, self.conduct_spread, (size,self.num_modes,self.num_modes) )
+            if self.symmetric:
+                factors = np.triu(factors) + np.swapaxes( np.triu(factors,1), -1, -2 )
+            parameters[name] *= factors
+        parameters['inter_terminal_length_vector'] *= self._factors( rng, self.length_spread,
+                                                                     (size,self.num_terminals) )
+        if self.sampler is not None:
+            self.sampler( rng, parameters )
+        return parameters
+
+    def _conductance_tensors(self, parameters, quantity):
+        if quantity=='charge':
+            charges, conduct_matrices = parameters['charge_vector'], parameters['charge_conduct_matrix']
+        else:
+            charges, conduct_matrices = parameters['central_charge_vector'], parameters['heat_conduct_matrix']
+        try:
+            return conductance_tensor_batch( parameters['chirality_vector'], charges, conduct_matrices,
+                                             parameters['inter_terminal_length_vector'] )
+        except la.LinAlgError:
+            # one device cannot be solved, the others are kept
+            sigma = np.full( (len(conduct_matrices),self.num_terminals,self.num_terminals), np.nan )
+            for sample in range(len(conduct_matrices)):
+                try:
+                    sigma[sample] = conductance_tensor_batch( parameters['chirality_vector'][sample:sample+1],
+                                                              charges[sample:sample+1],
+                                                              conduct_matrices[sample:sample+1],
+                                                              parameters['inter_terminal_length_vector'][sample:sample+1] )[0]
+                except la.LinAlgError:
+                    pass
+            return sigma
+
+    def evaluate(self, parameters, quantity='charge', two_terminals=(1,2), four_terminals=None):
+        """
+        Observables of a batch of devices in one vectorized pass: a dictionary with 'sigma'
+        and, if requested, the 'two_terminal' and 'four_terminal' conductances (NaN if undetermined).
+        """
+        if quantity not in ('charge','heat'):
+            raise ValueError("The argument quantity should be either 'charge' or 'heat' ")
+        sigma = self._conductance_tensors( parameters, quantity )
+        observables = { 'sigma': sigma }
+        if two_terminals is not None:
+            observables['two_terminal'] = two_terminal_conductance_batch( sigma, two_terminals )
+        if four_terminals is not None:
+            observables['four_terminal'] = four_terminal_conductance_batch( sigma, *four_terminals )
+        return observables
+
+    def run(self, tolerance, level=0.95, quantities=('charge',), two_terminals=(1,2), four_terminals=None,
+            batch_size=256, max_samples=100000, min_samples=None, relative=False, observables=None):
+        """
+        Draws batches of devices until the confidence intervals of the means are within tolerance.
+        - tolerance: largest accepted half-width of the confidence intervals at the given level,
+          relative to |mean| if relative
+        - observables: names of the observables that are tested, defaults to the scalar
+          conductances when requested and to 'sigma' otherwise
+        - min_samples: samples drawn before testing, defaults to two batches
+        - max_samples: the run stops there even if the tolerance is not reached
+        Returns an EnsembleResult; only the running moments are kept, never the samples.
+        """
+        if min_samples is None:
+            min_samples = 2*batch_size
+        if observables is None:
+            observables = [ name for name, terminals in ( ('two_terminal',two_terminals), ('four_terminal',four_terminals) )
+                            if terminals is not None ] or ['sigma']
+
+        statistics = {}
+        for quantity in quantities:
+            statistics[quantity] = { 'sigma': RunningStatistics( (self.num_terminals,self.num_terminals) ) }
+            if two_terminals is not None:
+                statistics[quantity]['two_terminal'] = RunningStatistics()
+            if four_terminals is not None:
+                statistics[quantity]['four_terminal'] = RunningStatistics()
+
+        num_samples = 0
+        batch = 0
+        converged = False
+        while num_samples < max_samples and not converged:
+            size = min( batch_size, max_samples-num_samples )
+            parameters = self.parameters( self.rng(batch), size )
+            for quantity in quantities:
+                for name, values in self.evaluate( parameters, quantity, two_terminals, four_terminals ).items():
+                    statistics[quantity][name].update( values )
+            num_samples += size
+            batch += 1
+
+            if num_samples >= min_samples:
+                converged = all( self._within_tolerance( statistics[quantity][name], tolerance, level, relative )
+                                 for quantity in quantities for name in observables )
+
+        return EnsembleResult( statistics, num_samples, converged, self.seed )
+
+    @staticmethod
+    def _within_tolerance(statistics, tolerance, level, relative):
+        half_width = statistics.confidence_interval(level)
+        if relative:
+            half_width = half_width/np.abs( statistics.mean )
+        # entries that are exactly fixed (e.g. by the conservation laws) have no spread
+        half_width = np.where( statistics.variance == 0, 0, half_width )
+        return bool( np.all( half_width <= tolerance ) )
@@ -0,0 +1,203 @@
+import numpy as np
+import numpy.linalg as la
+from scipy.optimize import least_squares
+
+from .quantumHall import QuantumHall, sigma0, kappa0, _drives
+
+# QuantumHall arguments that may be fitted
+_fittable = ( 'charge_vector', 'charge_conduct_matrix', 'central_charge_vector',
+              'heat_conduct_matrix', 'inter_terminal_length_vector',
+              'segment_charge_conduct_matrices', 'segment_charge_vectors',
+              'segment_heat_conduct_matrices', 'segment_central_charge_vectors' )
+
+class Measurement:
+    """
+    A measured observable of the device.
+    - kind: 'two_terminal', 'four_terminal' or 'current'
+    - terminals: the voltage terminals for 'two_terminal', (current_terminals, potential_terminals)
+      for 'four_terminal' and the terminal whose current is measured for 'current' (1-based)
+    - value: the measured value, error: its standard deviation
+    - quantity: 'charge' or 'heat'
+    - biases: voltages or temperatures of all terminals, only for 'current'
+    - unit: 'quantized' or 'SI', only for 'current'
+    """
+    def __init__(self, kind, terminals, value, error=1.0, quantity='charge', biases=None, unit='quantized'):
+        if kind not in ('two_terminal','four_terminal','current'):
+            raise ValueError("The kind should be 'two_terminal', 'four_terminal' or 'current'")
+        if quantity not in ('charge','heat'):
+            raise ValueError("The argument quantity should be either 'charge' or 'heat' ")
+        if unit not in ('quantized','SI'):
+            raise ValueError("The unit should be either 'quantized' or 'SI'")
+        if kind=='current' and biases is None:
+            raise ValueError('A current measurement needs the biases of all terminals')
+
+        self.kind = kind
+        self.terminals = terminals
+        self.value = float(value)
+        self.error = float(error)
+        self.quantity = quantity
+        self.biases = None if biases is None else np.asarray( biases, dtype=float )
+        self.unit = unit
+
+    def conductance_terminals(self):
+        if self.kind=='two_terminal':
+            return tuple(self.terminals), tuple(self.terminals)
+        return tuple(self.terminals[0]), tuple(self.terminals[1])
+
+class FitResult:
+    """
+    Outcome of ConductanceFit.fit:
+    - values: fitted values of the parameters, in the order they were given
+    - standard_errors: from the covariance inv(J^T.J) of the weighted residuals
+    - model: QuantumHall at the fitted values
+    - residuals: (model-data)/error of every measurement, cost: half their sum of squares
+    - success, message, nfev: as reported by scipy.optimize.least_squares
+    """
+    def __init__(self, values, covariance, model, residuals, success, message, nfev):
+        self.values = values
+        self.covariance = covariance
+        self.standard_errors = np.sqrt( np.abs( np.diag(covariance) ) )
+        self.model = model
+        self.residuals = residuals
+        self.cost = 0.5*np.sum( residuals**2 )
+        self.success = success
+        self.message = message
+        self.nfev = nfev
+
+class ConductanceFit:
+    """
+    Least-squares fit of QuantumHall inputs to measured conductances and currents.
+    - base: keyword arguments of QuantumHall for the device, also the starting point of the fit
+    - parameters: sequence of fitted parameters. A parameter is either the name of a
+      QuantumHall argument, all of whose entries take its value, or a pair (name, index)
+      setting the entries arr[index], e.g. ('charge_conduct_matrix', ((0,1),(1,0))) for a
+      symmetric off-diagonal entry or ('inter_terminal_length_vector', 2) for one segment
+    - measurements: sequence of Measurement
+    The model values and the Jacobian of all measurements come from one evaluation of the
+    analytic gradients per quantity, so a step of the fit costs a few solves whatever the
+    number of parameters, instead of one solve per parameter with finite differences.
+    """
+    def __init__(self, base, parameters, measurements):
+        self.model = QuantumHall( **base )
+
+        self.parameters = []
+        for parameter in parameters:
+            if isinstance(parameter, str):
+                name, index = parameter, None
+            else:
+                name, index = parameter
+            if name not in _fittable:
+                raise ValueError('Cannot fit {}, the parameter should be one of {}'.format( name, _fittable ))
+            self.parameters.append( ( name, index ) )
+
+        self.measurements = list(measurements)
+        if not self.measurements:
+            raise ValueError('At least one measurement is needed')
+        self.data = np.array( [ measurement.value for measurement in self.measurements ] )
+        self.errors = np.array( [ measurement.error for measurement in self.measurements ] )
+
+        self._evaluated_values = None
+        self._evaluation = None
+
+    @staticmethod
+    def _target(index):
+        if index is None:
+            return Ellipsis
+        return index if isinstance(index, tuple) else (index,)
+
+    def initial_values(self):
+        """
+        The parameters of the base configuration (the first entry of each parameter).
+        """
+        return np.array( [ np.asarray( getattr( self.model, name ), dtype=float )[ self._target(index) ].flat[0]
+                           for name, index in self.parameters ] )
+
+    def set_values(self, values):
+        """
+        Writes the parameter values into the model, only the inputs that change are reassigned.
+        """
+        for name in dict.fromkeys( name for name, index in self.parameters ):
+            current = np.asarray( getattr( self.model, name ), dtype=float )
+            updated = current.copy()
+            for (parameter_name, index), value in zip( self.parameters, values ):
+                if parameter_name == name:
+                    updated[ self._target(index) ] = value
+            if not np.array_equal( updated, current ):
+                setattr( self.model, name, updated )
+
+    def _parameter_jacobian(self, gradients, num_rows):
+        # derivative by every parameter: the sum over the entries it sets
+        jacobian = np.zeros( (num_rows,len(self.parameters)) )
+        for column, (name, index) in enumerate( self.parameters ):
+            if name in gradients:
+                entries = gradients[name][ (slice(None),)+( (Ellipsis,) if index is None else self._target(index) ) ]
+                jacobian[:,column] = np.reshape( entries, (num_rows,-1) ).sum(axis=-1)
+        return jacobian
+
+    def _current_values(self, rows, quantity):
+        measurements = [ self.measurements[row] for row in rows ]
+        terminals = np.array( [ measurement.terminals-1 for measurement in measurements ] )
+        biases = np.stack( [ measurement.biases for measurement in measurements ] )
+
+        # same currents and conversion as QuantumHall.current_all_terminals
+        drives = _drives( biases, quantity )
+        sigma = self.model.conductance_tensor(quantity)
+        currents = np.einsum( 'kt,kt->k', sigma[terminals], drives )
+        gradients = { name: np.einsum( '...kt,kt->k...', gradient[...,terminals,:], drives )
+                      for name, gradient in self.model.conductance_tensor_gradient(quantity).items() }
+        jacobian = self._parameter_jacobian( gradients, len(rows) )
+
+        SI = np.array( [ measurement.unit=='SI' for measurement in measurements ] )
+        scale = np.where( SI, sigma0 if quantity=='charge' else kappa0, 1.0 )
+        return currents*scale, jacobian*scale[:,None]
+
+    def evaluate(self, values):
+        """
+        Model values of all measurements, shape (K,), and their Jacobian by the parameters,
+        shape (K, P). The last evaluation is kept, so residuals and jacobian share it.
+        """
+        values = np.asarray( values, dtype=float )
+        if self._evaluated_values is not None and np.array_equal( values, self._evaluated_values ):
+            return self._evaluation
+
+        self.set_values(values)
+        model_values = np.empty( len(self.measurements) )
+        jacobian = np.empty( (len(self.measurements),len(self.parameters)) )
+        for quantity in ('charge','heat'):
+            rows = [ row for row, measurement in enumerate(self.measurements)
+                     if measurement.quantity==quantity and measurement.kind!='current' ]
+            if rows:
+                conductances, gradients = self.model.conductance_gradients(
+                    [ self.measurements[row].conductance_terminals() for row in rows ], quantity )
+                model_values[rows] = conductances
+                jacobian[rows] = self._parameter_jacobian( gradients, len(rows) )
+
+            rows = [ row for row, measurement in enumerate(self.measurements)
+                     if measurement.quantity==quantity and measurement.kind=='current' ]
+            if rows:
+                model_values[rows], jacobian[rows] = self._current_values( rows, quantity )
+
+        self._evaluated_values = values.copy()
+        self._evaluation = (model_values, jacobian)
+        return self._evaluation
+
+    def residuals(self, values):
+        return ( self.evaluate(values)[0]-self.data )/self.errors
+
+    def jacobian(self, values):
+        return self.evaluate(values)[1]/self.errors[:,None]
+
+    def fit(self, initial=None, bounds=(-np.inf,np.inf), **options):
+        """
+        Runs scipy.optimize.least_squares from initial (defaults to initial_values())
+        within bounds; options are passed on to least_squares. Returns a FitResult
+        and leaves the model at the fitted values.
+        """
+        if initial is None:
+            initial = self.initial_values()
+        solution = least_squares( self.residuals, initial, jac=self.jacobian, bounds=bounds, **options )
+
+        self.set_values( solution.x )
+        covariance = la.pinv( np.matmul( solution.jac.T, solution.jac ) )
+        return FitResult( solution.x, covariance, self.model, solution.fun, solution.success,
+                          solution.message, solution.nfev )
@@ -0,0 +1,175 @@
+import numpy as np
+import numpy.linalg as la
+from scipy.linalg import lu_factor, lu_solve
+
+from .quantumHall import _d_propagation_matrices, _segment_coefficients, _ring_conductance_tensor
+
+class FloatingResult:
+    """
+    Outcome of FloatingContactSolver.solve for K bias points:
+    - potentials: voltages or temperatures of all terminals, shape (num_terminals, K)
+    - currents: currents of all terminals, sigma.V for 'charge' and sigma.T^2/2 (in units
+      of kappa0) for 'heat' as in QuantumHall.current_all_terminals, zero at the floating
+      terminals, shape (num_terminals, K)
+    - currents_SI: the currents in amperes or watts
+    - iterations: Newton iterations, zero for a linear problem
+    - converged: whether every bias point reached the tolerance, shape (K,)
+    """
+    def __init__(self, potentials, currents, currents_SI, iterations, converged):
+        self.potentials = potentials
+        self.currents = currents
+        self.currents_SI = currents_SI
+        self.iterations = iterations
+        self.converged = converged
+
+class FloatingContactSolver:
+    """
+    Potentials of floating ohmic contacts, which take no net charge or heat current,
+    for the biases of the other terminals of a QuantumHall.
+    - quantum_hall: the device
+    - floating_terminals: the floating terminals, numbered from 1
+    - heat_conduct_function: optional callable mapping the temperatures of the segments,
+      shape (K, num_terminals), to their heat conduct matrices, shape (K, num_terminals, modes, modes).
+      A segment takes the mean temperature of its two terminals.
+    Heat flows as sigma.T^2/2, so the floating temperatures solve a linear problem in T^2
+    unless the conduct matrices depend on the temperature; then a chord Newton iteration
+    reuses the inverse of the floating block of sigma, refreshed only when the residual
+    stops shrinking. Every bias point is iterated at once.
+    """
+    def __init__(self, quantum_hall, floating_terminals, heat_conduct_function=None):
+        self.quantum_hall = quantum_hall
+        num_terminals = quantum_hall.num_terminals
+        floating = sorted( terminal-1 for terminal in floating_terminals )
+        if len(set(floating)) != len(floating) or not all( 0 <= terminal < num_terminals for terminal in floating ):
+            raise ValueError('The floating terminals should be distinct terminals between 1 and {}'.format( num_terminals ))
+        self.floating = np.array( floating, dtype=int )
+        self.biased = np.setdiff1d( np.arange(num_terminals), self.floating )
+        if len(self.biased) == 0:
+            raise ValueError('At least one terminal should be biased')
+        self.heat_conduct_function = heat_conduct_function
+        self._factorizations = {}
+
+    def _factorization(self, quantity):
+        # LU of the floating block of sigma, kept while sigma does not change
+        sigma = self.quantum_hall.conductance_tensor(quantity)
+        cached = self._factorizations.get(quantity)
+        if cached is None or not np.array_equal( cached[0], sigma ):
+            cached = ( sigma, lu_factor( sigma[ np.ix_( self.floating, self.floating ) ] ) )
+            self._factorizations[quantity] = cached
+        return cached
+
+    def _heat_conductance_tensors(self, temperatures):
+        """
+        sigma for 'heat' at the temperatures of the terminals, shape (num_terminals, K),
+        with the conduct matrices of heat_conduct_function. Returns shape (K, terminals, terminals).
+        """
+        quantum_hall = self.quantum_hall
+        num_terminals, num_modes = quantum_hall.num_terminals, quantum_hall.num_modes
+        segment_temperatures = ( ( temperatures + np.roll( temperatures, -1, axis=0 ) )/2 ).T
+        conduct_matrices = np.asarray( self.heat_conduct_function( segment_temperatures ), dtype=float )
+        if conduct_matrices.shape != segment_temperatures.shape+(num_modes,num_modes):
+            raise ValueError('heat_conduct_function should return the shape (K, num_terminals, modes, modes)')
+
+        batch = len(segment_temperatures)
+        chirality_vector = np.asarray( quantum_hall.chirality_vector )
+        central_charge_vectors = np.broadcast_to( quantum_hall._segment_arrays('heat')[1], (num_terminals,num_modes) )
+        central_charge_vectors = np.tile( central_charge_vectors, (batch,1) )
+        d_propagation_matrices = _d_propagation_matrices( chirality_vector, central_charge_vectors,
+                                                          conduct_matrices.reshape( (-1,num_modes,num_modes) ) )
+        # every segment of every bias point is one batch entry
+        d_plus, d_minus = _segment_coefficients( d_propagation_matrices, chirality_vector[None], central_charge_vectors,
+                                                 np.tile( quantum_hall.inter_terminal_length_vector, batch )[:,None] )
+        return _ring_conductance_tensor( d_plus.reshape( (batch,num_terminals) ), d_minus.reshape( (batch,num_terminals) ) )
+
+    def solve(self, biases, quantity='charge', tolerance=1e-12, max_iterations=50):
+        """
+        - biases: voltages ('charge') or temperatures ('heat') of the biased terminals in increasing
+          order, shape (num_biased,) or (num_biased, K) for K bias points
+        - tolerance: accepted residual current at the floating terminals, relative to the
+          currents flowing in from the biased terminals
+        Returns a FloatingResult.
+        """
+        if quantity not in ('charge','heat'):
+            raise ValueError("The argument quantity should be either 'charge' or 'heat' ")
+        biases = np.asarray( biases, dtype=float )
+        single = biases.ndim == 1
+        biases = biases.reshape( (len(biases),-1) )
+        if len(biases) != len(self.biased):
+            raise ValueError('biases should have one row per biased terminal')
+        if quantity=='heat' and np.any( biases < 0 ):
+            raise ValueError('The temperatures should be non-negative')
+
+        # the heat currents are linear in T^2
+        squared = quantity=='heat'
+        drives = biases**2 if squared else biases
+        unknowns = np.zeros( (len(self.floating),biases.shape[1]) )
+        iterations = 0
+        converged = np.ones( biases.shape[1], dtype=bool )
+
+        if len(self.floating) and ( quantity=='charge' or self.heat_conduct_function is None ):
+            sigma, factorization = self._factorization(quantity)
+            unknowns = lu_solve( factorization, -sigma[ np.ix_( self.floating, self.biased ) ] @ drives )
+        elif len(self.floating):
+            unknowns, iterations, converged = self._chord_newton( biases, drives, tolerance, max_iterations )
+
+        potentials = np.empty( (self.quantum_hall.num_terminals,biases.shape[1]) )
+        potentials[self.biased] = biases
+        # rounding may leave T^2 slightly negative
+        potentials[self.floating] = np.sqrt( np.maximum( unknowns, 0 ) ) if squared else unknowns
+
+        if quantity=='charge':
+            currents = self.quantum_hall.conductance_tensor('charge') @ potentials
+        else:
+            if self.heat_conduct_function is None:
+                currents = self.quantum_hall.conductance_tensor('heat') @ potentials**2/2
+            else:
+                currents = np.einsum( 'kjl,lk->jk', self._heat_conductance_tensors(potentials), potentials**2 )/2
+        currents_SI = self.quantum_hall._currents_in_unit( currents, quantity, 'SI' )
+
+        if single:
+            potentials, currents, currents_SI = potentials[:,0], currents[:,0], currents_SI[:,0]
+        return FloatingResult( potentials, currents, currents_SI, iterations, converged )
+
+    def _chord_newton(self, temperatures, drives, tolerance, max_iterations):
+        """
+        Solves [sigma(T).T^2]_floating = 0 for T^2 of the floating terminals, all bias points at once.
+        The Jacobian is approximated by the floating block of sigma, whose inverse is kept
+        across iterations and refreshed when the residual decreases by less than half.
+        """
+        floating, biased = self.floating, self.biased
+        num_points = drives.shape[1]
+        potentials = np.empty( (self.quantum_hall.num_terminals,num_points) )
+        potentials[biased] = temperatures
+        # start from the mean temperature of the biased terminals
+        potentials[floating] = np.mean( temperatures, axis=0 )
+
+        def residual(unknowns):
+            potentials[floating] = np.sqrt( np.maximum( unknowns, 0 ) ).T
+            sigma = self._heat_conductance_tensors(potentials)
+            inflow = np.einsum( 'kfb,bk->kf', sigma[:,floating][:,:,biased], drives )
+            return sigma, np.einsum( 'kfg,kg->kf', sigma[:,floating][:,:,floating], unknowns ) + inflow, inflow
+
+        sigma = self._heat_conductance_tensors(potentials)
+        inverse = la.inv( sigma[:,floating][:,:,floating] )
+        unknowns = -np.einsum( 'kfg,kgb,bk->kf', inverse, sigma[:,floating][:,:,biased], drives )
+
+        previous = np.full( num_points, np.inf )
+        for iteration in range(1, max_iterations+1):
+            sigma, residuals, inflow = residual(unknowns)
+            norms = np.max( np.abs(residuals), axis=-1 )
+            scales = np.maximum( np.max( np.abs(inflow), axis=-1 ), np.finfo(float).tiny )
+            converged = norms <= tolerance*scales
+            if np.all(converged):
+                return unknowns.T, iteration-1, converged
+
+            stalled = ~converged & ( norms > previous/2 )
+            if np.any(stalled):
+                inverse[stalled] = la.inv( sigma[stalled][:,floating][:,:,floating] )
+            previous = norms
+            # converged bias points are left as they are
+            unknowns = unknowns - np.where( converged[:,None], 0, np.einsum( 'kfg,kg->kf', inverse, residuals ) )
+
+        sigma, residuals, inflow = residual(unknowns)
+        norms = np.max( np.abs(residuals), axis=-1 )
+        converged = norms <= tolerance*np.maximum( np.max( np.abs(inflow), axis=-1 ), np.finfo(float).tiny )
+        return unknowns.T, max_iterations, converged
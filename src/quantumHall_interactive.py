@@ -1,13 +1,32 @@
+import logging
+import threading
+import time
+
 import ipywidgets as widgets
 from ipywidgets import interactive_output, Layout, HBox, VBox, Box, Label
-from .quantumHall_draw import DrawQuantumHall
+from IPython.display import clear_output
 from .quantumHall import QuantumHall
-import numpy.linalg as la
+
+logger = logging.getLogger(__name__)
 
 class QuantumHallInteractive():
-    def __init__(self,num_modes=2,num_terminals=2):
+    """
+    Edits of the widgets are recomputed on a background worker: a recomputation starts
+    once the inputs have been left unchanged for debounce seconds, and the results of
+    stale inputs are dropped, so only the newest result reaches the widgets.
+    lookup_tables: optional ConductanceTable (see quantumHall_lookup) that answer the
+    inputs they cover without solving the edges.
+    """
+    def __init__(self,num_modes=2,num_terminals=2,debounce=0.2,lookup_tables=()):
         self.num_modes = num_modes
         self.num_terminals = num_terminals
+        self.debounce = debounce
+        self.lookup_tables = list(lookup_tables)
+
+        self._condition = threading.Condition()
+        self._generation = 0
+        self._pending = None
+        self._worker = None
 
     def init_bar_widgets(self):
         # Widgets for chiralities
@@ -82,8 +101,9 @@ class QuantumHallInteractive():
                                          disabled=True)
             self.heat_current_wdgts.append( v )
 
-        
-        self.chirality_charge_change_flag_wdgt = widgets.BoundedIntText( value=0,  min=0, max=1, step=1 )
+
+        # the Hall bar is drawn here, so that it can be shown again outside display_widgets_bar
+        self.bar_output = widgets.Output()
 
     def take_widget_values(self):
         # Taking the chiralities
@@ -106,46 +126,73 @@ class QuantumHallInteractive():
                                   for row in range(2,self.num_modes+2)  ]
                                 for column in range(1,self.num_modes+1)  ]
 
-    def calculate_transport(self):
-        qh = QuantumHall( chirality_vector=self.chirality_vector, 
-                         charge_vector=self.charge_vector, 
-                         charge_conduct_matrix = self.charge_conduct_matrix,
-                        central_charge_vector=self.cent_charge_vector,
-                         heat_conduct_matrix=self.heat_conduct_matrix,
-                     voltages=self.voltages, temperatures = self.temperatures )
-
-        try:
+    def transport_inputs(self):
+        """
+        Snapshot of the values taken from the widgets, so that they can be solved off the kernel thread.
+        """
+        return { 'chirality_vector': self.chirality_vector, 'charge_vector': self.charge_vector,
+                 'charge_conduct_matrix': self.charge_conduct_matrix, 'cent_charge_vector': self.cent_charge_vector,
+                 'heat_conduct_matrix': self.heat_conduct_matrix, 'voltages': self.voltages,
+                 'temperatures': self.temperatures, 'num_terminals': self.num_terminals }
+
+    @staticmethod
+    def transport_results(inputs, lookup_tables=()):
+        """
+        Solves the transport of a snapshot of the inputs and returns the results
+        as a dictionary of the attributes that calculate_transport sets.
+        sigma is taken from the lookup tables that cover the inputs.
+        """
+        qh = QuantumHall( chirality_vector=inputs['chirality_vector'],
+                         charge_vector=inputs['charge_vector'],
+                         charge_conduct_matrix = inputs['charge_conduct_matrix'],
+                        central_charge_vector=inputs['cent_charge_vector'],
+                         heat_conduct_matrix=inputs['heat_conduct_matrix'],
+                     voltages=inputs['voltages'], temperatures = inputs['temperatures'] )
+        for table in lookup_tables:
+            table.seed(qh)
+
+        if inputs['num_terminals']>3:
+            four_terminals = ((1,3),(2,4))
+        else:
+            four_terminals = None
+
+        # charge and heat transport in one fused calculation
+        result = qh.solve_all( two_terminals=(1,2), four_terminals=four_terminals )
+
+        results = {}
+        if len(result.errors['charge'])==0:
             # unit of electrical current will be picoAmpere
-            self.charge_currents = qh.current_all_terminals('charge','SI')*1e6
-    
-            if self.num_terminals>3:
-                self.four_terminal_electrical_conductance = qh.four_terminal_conductance((1,3),(2,4), 'charge' )
+            results['charge_currents'] = result.currents_SI['charge']*1e6
+            if four_terminals is None:
+                results['four_terminal_electrical_conductance'] = 0
             else:
-                self.four_terminal_electrical_conductance = 0
+                results['four_terminal_electrical_conductance'] = result.four_terminal_conductances['charge']
+            results['two_terminal_electrical_conductance'] = result.two_terminal_conductances['charge']
+            results['charge_error_message'] = ''
+        else:
+            results['charge_error_message'] = 'Error: Charge tranport cannot be determined from the input data'
 
-            self.two_terminal_electrical_conductance = qh.two_terminal_conductance((1,2),'charge')
-            
-            self.charge_error_message = ''
-        except la.LinAlgError:
-            self.charge_error_message = 'Error: Charge tranport cannot be determined from the input data'
-            #print('charge la error ')
-            
-        try:
+        if len(result.errors['heat'])==0:
             # unit of thermla current will be femtoWatts
-            self.heat_currents = qh.current_all_terminals('heat','SI')*1e9
-
-            if self.num_terminals>3:
-                self.four_terminal_thermal_conductance = qh.four_terminal_conductance((1,3),(2,4), 'heat')
+            results['heat_currents'] = result.currents_SI['heat']*1e9
+            if four_terminals is None:
+                results['four_terminal_thermal_conductance'] = 0
             else:
-                self.four_terminal_thermal_conductance = 0
+                results['four_terminal_thermal_conductance'] = result.four_terminal_conductances['heat']
+            results['two_terminal_thermal_conductance'] = result.two_terminal_conductances['heat']
+            results['heat_error_message'] = ''
+        else:
+            results['heat_error_message'] = 'Error: Heat tranport cannot be determined from the input data'
+        return results
+
+    def calculate_transport(self):
+        # the synchronous result supersedes any request still queued or being solved
+        with self._condition:
+            self._generation += 1
+            self._pending = None
+        for name, value in self.transport_results( self.transport_inputs(), self.lookup_tables ).items():
+            setattr( self, name, value )
 
-            self.two_terminal_thermal_conductance = qh.two_terminal_conductance((1,2),'heat')
-            
-            self.heat_error_message = ''
-        except la.LinAlgError:
-            self.heat_error_message = 'Error: Heat tranport cannot be determined from the input data'
-            #print('heat la error ')
-        
     def update_transport(self):
         pass
         
@@ -266,7 +313,7 @@ class QuantumHallInteractive():
                             widgets.Label(value= '{:.2f}'.format(self.four_terminal_thermal_conductance),
                                   layout=Layout(width=entry_width ),
                                        style={'description_width': 'initial'} ) ]
-        error_message_wdgt =  widgets.Label(value=self.charge_error_message+'\n'+self.heat_error_message, 
+        error_message_wdgt = self.error_message_wdgt = widgets.Label(value=self.charge_error_message+'\n'+self.heat_error_message, 
                                             layout=Layout(width='auto'),
                                        style={'description_width': 'initial'} )  
         
@@ -278,7 +325,11 @@ class QuantumHallInteractive():
                                               width='400px' )  )
         return results_box_wdgt
     
-    def display_widgets_bar(self,num_terminals,num_modes,chirality_charge_change_flag):
+    def display_widgets_bar(self,num_terminals,num_modes):
+        """
+        Rebuilds the widget boxes for a number of terminals or modes. Edits of the
+        chiralities and charges only redraw the bar, see update_conductance_bar.
+        """
         self.num_modes = num_modes
         self.num_terminals = num_terminals
         
@@ -295,7 +346,12 @@ class QuantumHallInteractive():
                         HBox(self.temperature_wdgts[:self.num_terminals+1]) ] , layout=vert_layout )  )
 
         self.take_widget_values()
-        self.calculate_transport()
+        if getattr( self, 'charge_error_message', None ) is None:
+            # the first display needs results to build the boxes with
+            self.calculate_transport()
+        else:
+            # the boxes show the last results until the worker pushes those of the new inputs
+            self.request_update( self.transport_inputs() )
         
         # Display the conduction matrices
         display( HBox( [self.conduct_matrix_tabs(), self.conductance_results_box() ] )  )
@@ -305,14 +361,21 @@ class QuantumHallInteractive():
                         HBox(self.heat_current_wdgts[:self.num_terminals+1]) ], layout=vert_layout )  )
 
         
-        # Plot the Hall Bar
-        self.qhbar = DrawQuantumHall( num_terminals = self.num_terminals, num_modes = self.num_modes,
-                                chirality_vector = self.chirality_vector, charge_vector = self.charge_vector )
-        self.qhbar.draw_bar()
+        # Plot the Hall Bar, the figure and its artists are kept between the updates
+        display( self.bar_output )
+        with self.bar_output:
+            clear_output( wait=True )
+            if getattr( self, 'qhbar', None ) is None:
+                # matplotlib is only loaded once a bar is drawn
+                from .quantumHall_draw import DrawQuantumHall
+                self.qhbar = DrawQuantumHall( num_terminals = self.num_terminals, num_modes = self.num_modes,
+                                        chirality_vector = self.chirality_vector, charge_vector = self.charge_vector )
+            else:
+                self.qhbar.update( num_terminals = self.num_terminals, num_modes = self.num_modes,
+                                   chirality_vector = self.chirality_vector, charge_vector = self.charge_vector )
+            self.qhbar.draw_bar()
 
         self.num_terminals_old, self.num_modes_old = self.num_terminals, self.num_modes
-        
-        self.chirality_charge_change_flag_wdgt.value = 0
     
     def observe_widget_values(self):
         # observe quantum Hall quantities
@@ -334,9 +397,62 @@ class QuantumHallInteractive():
             self.temperature_wdgts[terminal].observe( self.update_conductance_box, names='value' )
                 
     def update_conductance_box(self,change):
+        # the widgets are read here, on the kernel thread, and solved on the worker
         self.take_widget_values()
-        self.calculate_transport()
-        
+        self.request_update( self.transport_inputs() )
+
+    def request_update(self, inputs):
+        """
+        Queues a recomputation of the inputs, replacing any request that has not started yet.
+        """
+        with self._condition:
+            self._generation += 1
+            self._pending = ( self._generation, inputs, time.monotonic()+self.debounce )
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread( target=self._work, daemon=True )
+                self._worker.start()
+            self._condition.notify()
+
+    def _work(self):
+        while True:
+            with self._condition:
+                while self._pending is None:
+                    self._condition.wait()
+                # debounce: wait until the newest request is debounce seconds old
+                while True:
+                    generation, inputs, deadline = self._pending
+                    remaining = deadline-time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._condition.wait( remaining )
+                self._pending = None
+
+            try:
+                results = self.transport_results( inputs, self.lookup_tables )
+            except Exception as error:
+                logger.exception('Transport could not be calculated')
+                message = 'Error: {}'.format(error)
+                results = { 'charge_error_message': message, 'heat_error_message': message }
+
+            with self._condition:
+                if generation != self._generation:
+                    # newer inputs arrived while solving, their result will be pushed instead
+                    continue
+            if inputs['num_terminals'] != self.num_terminals:
+                # the terminals changed while solving, the result no longer fits the widgets
+                continue
+            try:
+                self.push_results(results)
+            except Exception:
+                # the worker must survive, the next request is pushed normally
+                logger.exception('Transport results could not be shown')
+
+    def push_results(self, results):
+        for name, value in results.items():
+            setattr( self, name, value )
+        if getattr( self, 'error_message_wdgt', None ) is not None:
+            self.error_message_wdgt.value = self.charge_error_message+'\n'+self.heat_error_message
+
         if len(self.charge_error_message)==0:
             self.two_terminal_row[1].value = '{:.2f}'.format(self.two_terminal_electrical_conductance)
             self.four_terminal_row[1].value = '{:.2f}'.format(self.four_terminal_electrical_conductance)
@@ -350,13 +466,17 @@ class QuantumHallInteractive():
 
 
     def update_conductance_bar(self,change):
-        #self.qhbar.update_value('chirality_vector',self.chirality_vector)
-        #print( self.qhbar.chirality_vector )
-        #self.qhbar.draw_bar()
-        self.chirality_charge_change_flag_wdgt.value = 1
-        #self.display_widgets_bar(self,num_terminals,num_modes)
-
-        self.update_conductance_box(change)
+        # only the modes of the kept figure change: they are blitted, and a static
+        # image (e.g. inline) is replaced in its output, without rebuilding the widgets
+        self.take_widget_values()
+        if getattr( self, 'qhbar', None ) is not None:
+            self.qhbar.update( chirality_vector = self.chirality_vector, charge_vector = self.charge_vector )
+            if not self.qhbar.is_live():
+                with self.bar_output:
+                    clear_output( wait=True )
+                    self.qhbar.show()
+
+        self.request_update( self.transport_inputs() )
         
     def display_all(self):
         #self.num_terminals_old, self.num_modes_old = 2,1
@@ -376,10 +496,7 @@ class QuantumHallInteractive():
         self.init_both_conduct_matrix_wdgt()
 
         out = interactive_output( self.display_widgets_bar,
-                                { 'num_terminals' : num_terminals_wdgt , 'num_modes' : num_modes_wdgt,
-                                'chirality_charge_change_flag' : self.chirality_charge_change_flag_wdgt
-                                }
-                                )
+                                { 'num_terminals' : num_terminals_wdgt , 'num_modes' : num_modes_wdgt } )
         display( HBox( [num_modes_wdgt,num_terminals_wdgt])  , out)
         
         self.observe_widget_values()
@@ -0,0 +1,200 @@
+import itertools
+import os
+import threading
+
+import numpy as np
+
+from .quantumHall import QuantumHall
+from .quantumHall_sweep import ParameterGrid, SweepSink, stream_sweep
+
+def preset_axes(num_modes, quantity='charge', charge_step=0.1, conduct_step=0.25):
+    """
+    Axes of a ParameterGrid over the ranges of the widgets of QuantumHallInteractive for
+    one or two modes: the charges (or central charges) from charge_step to 5 and, for two
+    modes, the symmetric conduct coefficient from 0 to 50. The charges start at charge_step
+    because a mode without charge has no d-propagation matrix.
+    """
+    if quantity=='charge':
+        charge_name, conduct_name = 'charge_vector', 'charge_conduct_matrix'
+    elif quantity=='heat':
+        charge_name, conduct_name = 'central_charge_vector', 'heat_conduct_matrix'
+    else:
+        raise ValueError("The argument quantity should be either 'charge' or 'heat' ")
+    if num_modes not in (1,2):
+        raise ValueError('Presets exist for one and two modes')
+
+    charges = np.round( np.arange( 1, int( round( 5/charge_step ) )+1 )*charge_step, 10 )
+    axes = { (charge_name, mode): charges for mode in range(num_modes) }
+    if num_modes == 2:
+        axes[ (conduct_name, ((0,1),(1,0))) ] = np.round( np.arange( 0, int( round( 50/conduct_step ) )+1 )*conduct_step, 10 )
+    return axes
+
+def _dense_to_band(sigma):
+    # inverse of _band_to_dense; with two terminals the neighbours coincide and band[2] is zero
+    num_terminals = sigma.shape[-1]
+    terminals = np.arange(num_terminals)
+    band = np.zeros( (3,num_terminals) )
+    band[0] = sigma[terminals,(terminals-1)%num_terminals]
+    band[1] = sigma[terminals,terminals]
+    if num_terminals > 2:
+        band[2] = sigma[terminals,(terminals+1)%num_terminals]
+    return band
+
+class ConductanceTable:
+    """
+    sigma and the derived conductances tabulated on disk over a ParameterGrid, answering
+    queries by lookup and multilinear interpolation.
+    - base, axes: as for ParameterGrid; the values of every axis should be increasing
+    - directory, quantity, chunk_size, two_terminals, four_terminals: as for stream_sweep
+    The table is a SweepSink, so it is filled chunk by chunk, survives restarts and is
+    memory-mapped rather than loaded. Queries only use grid points that are already
+    computed; everything else returns None so that the caller solves instead.
+    """
+    def __init__(self, base, axes, directory, quantity='charge', chunk_size=1024,
+                 two_terminals=(1,2), four_terminals=None):
+        self.grid = ParameterGrid( base, axes )
+        for name, index, values in self.grid.axes:
+            if len(values) > 1 and np.any( np.diff(values) <= 0 ):
+                raise ValueError('The values of the axis {} should be increasing'.format( (name, index) ))
+        self.directory = directory
+        self.quantity = quantity
+        self.chunk_size = chunk_size
+        self.two_terminals = two_terminals
+        self.four_terminals = four_terminals
+        self.sink = SweepSink( directory, self.grid, quantity, chunk_size, two_terminals, four_terminals )
+        self._arrays = {}
+        self._thread = None
+
+    def build(self, background=True, max_workers=None, progress=None):
+        """
+        Computes the missing chunks with stream_sweep, in a background thread by default.
+        Queries can be made while it runs and use the chunks completed so far.
+        """
+        def run():
+            stream_sweep( self.grid, self.directory, self.quantity, self.chunk_size, self.two_terminals,
+                          self.four_terminals, max_workers, progress )
+            self.sink = SweepSink( self.directory, self.grid, self.quantity, self.chunk_size,
+                                   self.two_terminals, self.four_terminals )
+
+        if not background:
+            run()
+            return None
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread( target=run, daemon=True )
+            self._thread.start()
+        return self._thread
+
+    def is_complete(self):
+        return self.sink.is_complete()
+
+    def _array(self, name):
+        if name not in self._arrays:
+            path = os.path.join( self.directory, name+'.npy' )
+            self._arrays[name] = np.load( path, mmap_mode='r' )
+        return self._arrays[name]
+
+    def axis_values(self, inputs):
+        """
+        The values of the axes in a dictionary of QuantumHall arguments, or None if the
+        arguments that are not swept differ from the base of the table.
+        """
+        swept = {}
+        values = []
+        for name, index, axis_values in self.grid.axes:
+            entries = np.asarray( inputs.get( name, getattr( self.grid.base, name ) ), dtype=float )
+            target = Ellipsis if index is None else ( index if isinstance(index, tuple) else (index,) )
+            entries = np.ravel( entries[target] )
+            if not np.all( entries == entries[0] ):
+                return None
+            values.append( entries[0] )
+            swept.setdefault( name, [] ).append( target )
+
+        for name in ( 'chirality_vector', 'charge_vector', 'charge_conduct_matrix', 'central_charge_vector',
+                      'heat_conduct_matrix', 'inter_terminal_length_vector' ):
+            base = np.array( getattr( self.grid.base, name ), dtype=float )
+            given = np.array( inputs.get( name, base ), dtype=float )
+            if given.shape != base.shape:
+                return None
+            for target in swept.get( name, [] ):
+                given[target] = base[target]
+            if not np.array_equal( given, base ):
+                return None
+        return values
+
+    def lookup(self, values):
+        """
+        Interpolated 'sigma', 'two_terminal' and 'four_terminal' (those that are tabulated)
+        at the values of the axes, or None when a value lies outside its axis or the
+        surrounding grid points are not computed yet. Values on the grid are returned exactly.
+        """
+        indices = []
+        weights = []
+        for value, (name, index, axis_values) in zip( values, self.grid.axes ):
+            position = np.searchsorted( axis_values, value )
+            if position < len(axis_values) and np.isclose( axis_values[position], value, rtol=1e-12, atol=1e-12 ):
+                indices.append( (position,) )
+                weights.append( (1.0,) )
+            elif 0 < position < len(axis_values):
+                fraction = ( value-axis_values[position-1] )/( axis_values[position]-axis_values[position-1] )
+                indices.append( (position-1, position) )
+                weights.append( (1-fraction, fraction) )
+            else:
+                return None
+
+        corners = list( itertools.product( *[ list( zip( axis_indices, axis_weights ) )
+                                              for axis_indices, axis_weights in zip( indices, weights ) ] ) )
+        flat = [ int( np.ravel_multi_index( tuple( position for position, weight in corner ), self.grid.shape ) )
+                 if corner else 0 for corner in corners ]
+        corner_weights = np.array( [ np.prod( [ weight for position, weight in corner ] ) for corner in corners ] )
+
+        result = {}
+        for name in self.sink._arrays():
+            samples = np.asarray( self._array(name)[flat] )
+            # grid points that are not computed yet are NaN
+            if name=='sigma' and np.any( np.isnan(samples) ):
+                return None
+            result[name] = np.tensordot( corner_weights, samples, axes=1 )
+        return result
+
+    def seed(self, quantum_hall):
+        """
+        Hands the tabulated sigma of the inputs of quantum_hall to it, so that its
+        conductances and currents skip the edge solve. Returns whether the table had them.
+        """
+        inputs = { name: getattr( quantum_hall, name ) for name in ( 'chirality_vector', 'charge_vector',
+                   'charge_conduct_matrix', 'central_charge_vector', 'heat_conduct_matrix',
+                   'inter_terminal_length_vector' ) }
+        if quantum_hall.num_terminals != self.grid.num_terminals:
+            return False
+        values = self.axis_values(inputs)
+        result = None if values is None else self.lookup(values)
+        if result is None:
+            return False
+        band = _dense_to_band( result['sigma'] )
+        quantum_hall._observable( self.quantity+'_conductance_band', lambda: band )
+        return True
+
+    def evaluate(self, values):
+        """
+        lookup, falling back to solving the point when the table cannot answer.
+        """
+        result = self.lookup(values)
+        if result is not None:
+            return result
+
+        parameters = { name: np.array( getattr( self.grid.base, name ), dtype=float ) for name in
+                       ( 'chirality_vector', 'charge_vector', 'charge_conduct_matrix', 'central_charge_vector',
+                         'heat_conduct_matrix', 'inter_terminal_length_vector' ) }
+        for value, (name, index, axis_values) in zip( values, self.grid.axes ):
+            if index is None:
+                parameters[name] = np.broadcast_to( value, parameters[name].shape ).copy()
+            else:
+                parameters[name][ index if isinstance(index, tuple) else (index,) ] = value
+        quantum_hall = QuantumHall( num_terminals=self.grid.num_terminals, **parameters )
+
+        result = { 'sigma': quantum_hall.conductance_tensor(self.quantity) }
+        if self.two_terminals is not None:
+            result['two_terminal'] = quantum_hall.two_terminal_conductance( self.two_terminals, self.quantity )
+        if self.four_terminals is not None:
+            result['four_terminal'] = quantum_hall.four_terminal_conductance( *self.four_terminals, quantity=self.quantity )
+        return result
@@ -0,0 +1,229 @@
+import numpy as np
+import numpy.linalg as la
+import scipy.sparse as sparse
+from scipy.sparse.linalg import splu
+
+from .quantumHall import ( QuantumHall, eig_cache, _d_propagation_matrices, _segment_coefficients,
+                           _measurement_error, _conductance_from_potentials )
+
+# inputs of the edge model that a segment may override
+_segment_inputs = { 'charge': ('charge_conduct_matrix', 'charge_vector'),
+                    'heat': ('heat_conduct_matrix', 'central_charge_vector') }
+
+class EdgeNetwork:
+    """
+    Device described as a graph: the ohmic contacts are the nodes and the edge segments
+    the links between them, e.g. inner edges, antidots or several Hall bars sharing contacts.
+    - num_contacts: number of contacts, numbered from 1 as the terminals of QuantumHall
+    - edge: keyword arguments of QuantumHall for the edge model shared by the segments
+      (the chirality, charges and conduct matrices, the terminals are ignored)
+    A segment carries its positive modes from its start contact to its end contact.
+    sigma is assembled as a scipy.sparse matrix with four entries per segment, and the
+    potentials come from a sparse LU factorization that is kept until the network changes.
+    """
+    def __init__(self, num_contacts, edge=None):
+        self.num_contacts = int(num_contacts)
+        self.edge = QuantumHall( **(edge or {}) )
+        self.num_modes = self.edge.num_modes
+        self.starts = []
+        self.ends = []
+        self.lengths = []
+        self.overrides = []
+        self._cache = {}
+
+    @classmethod
+    def from_quantum_hall(cls, quantum_hall):
+        """
+        The ring of terminals of a QuantumHall: segment t joins the terminals t and t+1.
+        """
+        edge = { name: getattr( quantum_hall, name ) for name in ( 'chirality_vector', 'charge_vector',
+                 'charge_conduct_matrix', 'central_charge_vector', 'heat_conduct_matrix' ) }
+        network = cls( quantum_hall.num_terminals, edge )
+        segment_inputs = { 'charge_conduct_matrix': quantum_hall.segment_charge_conduct_matrices,
+                           'charge_vector': quantum_hall.segment_charge_vectors,
+                           'heat_conduct_matrix': quantum_hall.segment_heat_conduct_matrices,
+                           'central_charge_vector': quantum_hall.segment_central_charge_vectors }
+        for terminal, length in enumerate( quantum_hall.inter_terminal_length_vector ):
+            network.add_segment( terminal+1, (terminal+1)%quantum_hall.num_terminals+1, length,
+                                 **{ name: values[terminal] for name, values in segment_inputs.items()
+                                     if values is not None } )
+        return network
+
+    @property
+    def num_segments(self):
+        return len(self.starts)
+
+    def add_segment(self, start, end, length=1.0, **inputs):
+        """
+        Adds a segment from the contact start to the contact end and returns its index.
+        - inputs: charge_conduct_matrix, charge_vector, heat_conduct_matrix or
+          central_charge_vector of this segment, overriding those of the edge model
+        start and end may be the same contact, e.g. for the edge around an antidot.
+        """
+        for contact in (start, end):
+            if not 1 <= contact <= self.num_contacts:
+                raise ValueError('The contacts should be between 1 and {}'.format( self.num_contacts ))
+        length = float(length)
+        if not length >= 0:
+            raise ValueError('The length of a segment should be non-negative')
+
+        overrides = {}
+        for name, value in inputs.items():
+            if name not in _segment_inputs['charge']+_segment_inputs['heat']:
+                raise ValueError('Unknown segment input {}'.format( name ))
+            value = np.array( value, dtype=float )
+            if value.shape != np.shape( getattr( self.edge, name ) ):
+                raise ValueError('{} should have the shape {}'.format( name, np.shape( getattr( self.edge, name ) ) ))
+            overrides[name] = value
+
+        self.starts.append( start-1 )
+        self.ends.append( end-1 )
+        self.lengths.append( length )
+        self.overrides.append( overrides )
+        self._cache.clear()
+        return self.num_segments-1
+
+    def _cached(self, key, compute):
+        if key not in self._cache:
+            self._cache[key] = compute()
+        return self._cache[key]
+
+    def _check_quantity(self, quantity):
+        if quantity not in ('charge','heat'):
+            raise ValueError("The argument quantity should be either 'charge' or 'heat' ")
+
+    def _segment_arrays(self, quantity):
+        """
+        d-propagation matrices, charges and lengths laid out for _segment_coefficients:
+        one batch entry with the segments on the terminal axis when they share the edge model,
+        and one batch entry per segment otherwise (identical segments share one eigendecomposition).
+        """
+        conduct_name, charge_name = _segment_inputs[quantity]
+        d_propagation_matrix, quant_charge_vector = self.edge._quantity_arrays(quantity)
+        lengths = np.array( self.lengths, dtype=float )
+
+        if not any( conduct_name in overrides or charge_name in overrides for overrides in self.overrides ):
+            return np.asarray( d_propagation_matrix )[None], np.asarray( quant_charge_vector )[None], lengths[None]
+
+        conduct_matrices = np.stack( [ overrides.get( conduct_name, np.asarray( getattr( self.edge, conduct_name ) ) )
+                                       for overrides in self.overrides ] )
+        charge_vectors = np.stack( [ overrides.get( charge_name, quant_charge_vector ) for overrides in self.overrides ] )
+        return ( _d_propagation_matrices( self.edge.chirality_vector, charge_vectors, conduct_matrices ),
+                 charge_vectors, lengths[:,None] )
+
+    def segment_coefficients(self, quantity='charge'):
+        """
+        d_plus and d_minus of every segment, shape (num_segments,): the segment s carries
+        d_plus[s]*V[start]+d_minus[s]*V[end] from its start to its end contact.
+        """
+        self._check_quantity(quantity)
+
+        def compute():
+            d_propagation_matrices, quant_charge_vectors, lengths = self._segment_arrays(quantity)
+            d_plus, d_minus = _segment_coefficients( d_propagation_matrices,
+                                                     np.asarray( self.edge.chirality_vector )[None],
+                                                     quant_charge_vectors, lengths,
+                                                     lambda matrices: eig_cache.eig_batch( matrices, self.edge.chirality_vector ) )
+            return d_plus.reshape(-1), d_minus.reshape(-1)
+        return self._cached( (quantity,'coefficients'), compute )
+
+    def conductance_matrix(self, quantity='charge'):
+        """
+        sigma of the network as a scipy.sparse CSR matrix of shape (num_contacts, num_contacts),
+        such that the currents entering the contacts are sigma.V. Segments joining the same
+        contacts are summed up.
+        """
+        def compute():
+            d_plus, d_minus = self.segment_coefficients(quantity)
+            starts, ends = np.array( self.starts, dtype=int ), np.array( self.ends, dtype=int )
+            # the segment takes its current from the start contact and delivers it to the end contact
+            rows = np.concatenate( [ ends, ends, starts, starts ] )
+            columns = np.concatenate( [ starts, ends, starts, ends ] )
+            values = np.concatenate( [ d_plus, d_minus, -d_plus, -d_minus ] )
+            return sparse.coo_matrix( (values, (rows, columns)),
+                                      shape=(self.num_contacts,self.num_contacts) ).tocsr()
+        return self._cached( (quantity,'sigma'), compute )
+
+    def _factorization(self, quantity, fixed):
+        """
+        splu of sigma restricted to the contacts that are not in fixed,
+        i.e. those whose potentials are solved for.
+        """
+        def compute():
+            free = np.setdiff1d( np.arange(self.num_contacts), fixed )
+            sigma = self.conductance_matrix(quantity)
+            try:
+                return free, splu( sigma[free][:,free].tocsc() )
+            except RuntimeError as error:
+                # the factor is exactly singular, e.g. a contact without segments
+                raise la.LinAlgError( str(error) )
+        return self._cached( (quantity,'lu')+tuple(fixed), compute )
+
+    def _solve(self, factorization, rhs):
+        free, lu = factorization
+        solution = lu.solve( np.ascontiguousarray( rhs, dtype=float ) )
+        if not np.all( np.isfinite(solution) ):
+            raise la.LinAlgError('Singular matrix')
+        return solution
+
+    def potentials(self, currents, quantity='charge', ground=1):
+        """
+        Potentials of all contacts, with the ground contact at zero, for the currents entering
+        the contacts, shape (num_contacts,) or (num_contacts, K). The ground contact takes
+        whatever current balances the others.
+        """
+        self._check_quantity(quantity)
+        currents = np.asarray( currents, dtype=float )
+        if currents.shape[0] != self.num_contacts:
+            raise ValueError('currents should have the shape (num_contacts,) or (num_contacts, K)')
+
+        factorization = self._factorization( quantity, (ground-1,) )
+        potentials = np.zeros( currents.shape )
+        potentials[ factorization[0] ] = self._solve( factorization, currents[ factorization[0] ] )
+        return potentials
+
+    def four_terminal_conductance(self, current_terminals, potential_terminals, quantity='charge'):
+        """
+        Same as QuantumHall.four_terminal_conductance: -I/(V_1-V_2) for the current I entering
+        at current_terminals[0] and leaving at current_terminals[1], all the other contacts floating.
+        All the measurements of a network share one factorization.
+        """
+        currents = np.zeros( self.num_contacts )
+        currents[ current_terminals[0]-1 ] += 1
+        currents[ current_terminals[1]-1 ] -= 1
+        try:
+            potentials = self.potentials( currents, quantity )
+            return _conductance_from_potentials( potentials, potential_terminals[0]-1, potential_terminals[1]-1 )
+        except la.LinAlgError:
+            raise _measurement_error( current_terminals, potential_terminals )
+
+    def two_terminal_conductance(self, voltage_terminals, quantity='charge'):
+        return self.four_terminal_conductance( voltage_terminals, voltage_terminals, quantity )
+
+    def floating_potentials(self, biased_contacts, biases, quantity='charge'):
+        """
+        Potentials and currents of all contacts when only the biased contacts are connected
+        to sources and all the other contacts float, i.e. take no net current.
+        - biased_contacts: sequence of contacts (at least one)
+        - biases: their voltages ('charge') or temperatures ('heat'), shape (len(biased_contacts),)
+          or (len(biased_contacts), K) for K bias points solved together
+        Returns the potentials and the currents entering the contacts, both of shape
+        (num_contacts,)+biases.shape[1:]. The floating block of sigma is factorized once per
+        set of biased contacts and reused for any biases.
+        """
+        self._check_quantity(quantity)
+        fixed = tuple( sorted( contact-1 for contact in biased_contacts ) )
+        if not fixed or len(set(fixed)) != len(fixed):
+            raise ValueError('biased_contacts should be a non-empty sequence of distinct contacts')
+        biases = np.asarray( biases, dtype=float )
+        if biases.shape[0] != len(fixed):
+            raise ValueError('biases should have one entry per biased contact')
+
+        potentials = np.zeros( (self.num_contacts,)+biases.shape[1:] )
+        potentials[ [ contact-1 for contact in biased_contacts ] ] = biases
+        sigma = self.conductance_matrix(quantity)
+        if len(fixed) < self.num_contacts:
+            factorization = self._factorization( quantity, fixed )
+            free = factorization[0]
+            potentials[free] = self._solve( factorization, -( sigma[free][:,list(fixed)] @ potentials[list(fixed)] ) )
+        return potentials, sigma @ potentials
@@ -0,0 +1,270 @@
+import hashlib
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from .quantumHall import ( QuantumHall, conductance_tensor_batch,
+                           two_terminal_conductance_batch, four_terminal_conductance_batch )
+
+# QuantumHall arguments that may be swept
+_sweepable = ( 'chirality_vector', 'charge_vector', 'charge_conduct_matrix', 'central_charge_vector',
+               'heat_conduct_matrix', 'inter_terminal_length_vector' )
+
+class ParameterGrid:
+    """
+    Cartesian grid of QuantumHall parameters around a base configuration.
+    - base: keyword arguments of QuantumHall for the parameters that are not swept
+    - axes: dictionary from a parameter to the sequence of its values. A parameter is
+      either the name of a QuantumHall argument, whose values replace the whole argument,
+      or a pair (name, index) setting the entries arr[index] of that argument, e.g.
+      ('charge_conduct_matrix', ((0,1),(1,0))) for a symmetric off-diagonal entry.
+    Grid points are numbered in C order over the axes, in the order they were given.
+    """
+    def __init__(self, base=None, axes=None):
+        self.base = QuantumHall( **(base or {}) )
+        self.num_modes = self.base.num_modes
+        self.num_terminals = self.base.num_terminals
+
+        self.axes = []
+        for parameter, values in (axes or {}).items():
+            if isinstance(parameter, str):
+                name, index = parameter, None
+            else:
+                name, index = parameter
+            if name not in _sweepable:
+                raise ValueError('Cannot sweep {}, the parameter should be one of {}'.format( name, _sweepable ))
+            self.axes.append( ( name, index, np.asarray(values) ) )
+
+        self.shape = tuple( len(values) for name, index, values in self.axes )
+        self.size = int( np.prod(self.shape) )
+
+    def parameters(self, start, stop):
+        """
+        Returns the arrays of the QuantumHall arguments for the grid points start to stop,
+        each with a leading axis of length stop-start.
+        """
+        num_points = stop-start
+        parameters = { name: np.array( np.broadcast_to( np.asarray( getattr( self.base, name ), dtype=float ),
+                                                        (num_points,)+np.shape( getattr( self.base, name ) ) ) )
+                       for name in _sweepable }
+
+        point_indices = np.unravel_index( np.arange(start,stop), self.shape ) if self.axes else ()
+        for (name, index, values), value_indices in zip( self.axes, point_indices ):
+            if index is None:
+                parameters[name] = np.array( np.broadcast_to( values[value_indices],
+                                                              parameters[name].shape ), dtype=float )
+            else:
+                target = (slice(None),)+( index if isinstance(index, tuple) else (index,) )
+                entries = parameters[name][target]
+                parameters[name][target] = values[value_indices].reshape( (num_points,)+(1,)*(entries.ndim-1) )
+        return parameters
+
+    def fingerprint(self):
+        """
+        Hash of the base configuration and the axes, identifies the grid of a resumed sweep.
+        """
+        digest = hashlib.blake2b( digest_size=16 )
+        for name in _sweepable:
+            digest.update( np.ascontiguousarray( getattr( self.base, name ), dtype=float ).tobytes() )
+        digest.update( repr( self.num_terminals ).encode() )
+        for name, index, values in self.axes:
+            digest.update( repr( (name, index, values.shape) ).encode() )
+            digest.update( np.ascontiguousarray( values, dtype=float ).tobytes() )
+        return digest.hexdigest()
+
+    def conductance_tensors(self, start, stop, quantity='charge'):
+        """
+        sigma for the grid points start to stop, shape (stop-start, terminals, terminals).
+        """
+        parameters = self.parameters( start, stop )
+        if quantity=='charge':
+            charge_vectors, conduct_matrices = parameters['charge_vector'], parameters['charge_conduct_matrix']
+        elif quantity=='heat':
+            charge_vectors, conduct_matrices = parameters['central_charge_vector'], parameters['heat_conduct_matrix']
+        else:
+            raise ValueError("The argument quantity should be either 'charge' or 'heat' ")
+
+        return conductance_tensor_batch( parameters['chirality_vector'], charge_vectors, conduct_matrices,
+                                         parameters['inter_terminal_length_vector'] )
+
+class _SharedMemoryTarget:
+    """
+    Result array in a shared-memory block, written to by the pool workers.
+    """
+    def __init__(self, name, shape):
+        self.name = name
+        self.shape = shape
+
+    def write(self, start, stop, sigma):
+        # the pool workers share the resource tracker of the process that created the block
+        shm = shared_memory.SharedMemory( name=self.name )
+        try:
+            result = np.ndarray( self.shape, dtype=float, buffer=shm.buf )
+            result[start:stop] = sigma
+            del result
+        finally:
+            shm.close()
+
+def _sweep_chunk(grid, quantity, target, start, stop):
+    """
+    Worker: evaluates the grid points start to stop and hands them to the target.
+    Only the chunk bounds are sent back.
+    """
+    target.write( start, stop, grid.conductance_tensors( start, stop, quantity ) )
+    return start, stop
+
+def _chunks(size, chunk_size):
+    return [ (start, min(start+chunk_size,size)) for start in range(0,size,chunk_size) ]
+
+def _run_chunks(grid, quantity, target, chunks, max_workers, progress, done=0, chunk_done=None):
+    with ProcessPoolExecutor( max_workers=max_workers ) as pool:
+        futures = [ pool.submit( _sweep_chunk, grid, quantity, target, start, stop ) for start, stop in chunks ]
+        for future in as_completed(futures):
+            start, stop = future.result()
+            done += stop-start
+            if chunk_done is not None:
+                chunk_done( start, stop )
+            if progress is not None:
+                progress( done, grid.size )
+
+def run_sweep(grid, quantity='charge', chunk_size=1024, max_workers=None, progress=None):
+    """
+    Evaluates sigma at every point of a ParameterGrid with a pool of processes.
+    - chunk_size: number of grid points evaluated by one batched call in a worker
+    - max_workers: number of worker processes, defaults to the number of cores
+    - progress: optional callable progress(done, total), called as chunks complete
+    The workers write straight into a shared-memory array, so the results are never
+    pickled; every point has a fixed slot, so the output does not depend on scheduling.
+    Returns sigma with shape grid.shape+(terminals, terminals).
+    """
+    shape = ( grid.size, grid.num_terminals, grid.num_terminals )
+    shm = shared_memory.SharedMemory( create=True, size=max( int( np.prod(shape) )*8, 1 ) )
+    try:
+        _run_chunks( grid, quantity, _SharedMemoryTarget( shm.name, shape ),
+                     _chunks( grid.size, chunk_size ), max_workers, progress )
+        sigma = np.ndarray( shape, dtype=float, buffer=shm.buf ).copy()
+    finally:
+        shm.close()
+        shm.unlink()
+    return sigma.reshape( grid.shape+shape[1:] )
+
+class SweepSink:
+    """
+    Directory receiving a sweep chunk by chunk in memory-mapped .npy files:
+    - sigma.npy: sigma of every grid point, shape (grid size, terminals, terminals)
+    - two_terminal.npy, four_terminal.npy: the derived conductances (NaN if undetermined)
+    - manifest.json: the sweep settings and the chunks that are complete
+    A chunk is recorded in the manifest only after its data is flushed to disk,
+    so an interrupted sweep resumes from the last recorded chunk.
+    """
+    manifest_name = 'manifest.json'
+
+    def __init__(self, directory, grid, quantity='charge', chunk_size=1024,
+                 two_terminals=(1,2), four_terminals=None):
+        self.directory = directory
+        self.shape = grid.shape
+        self.size = grid.size
+        self.num_terminals = grid.num_terminals
+        self.quantity = quantity
+        self.chunk_size = int(chunk_size)
+        self.two_terminals = None if two_terminals is None else list(two_terminals)
+        self.four_terminals = None if four_terminals is None else [ list(four_terminals[0]), list(four_terminals[1]) ]
+        self.settings = { 'fingerprint':grid.fingerprint(), 'shape':list(self.shape),
+                          'num_terminals':self.num_terminals, 'quantity':quantity, 'chunk_size':self.chunk_size,
+                          'two_terminals':self.two_terminals, 'four_terminals':self.four_terminals }
+
+        os.makedirs( directory, exist_ok=True )
+        manifest = self._read_manifest()
+        if manifest is not None and manifest['settings'] == self.settings:
+            self.completed = set( manifest['completed'] )
+        else:
+            if manifest is not None:
+                raise ValueError('{} holds a different sweep, use another directory'.format( directory ))
+            self._create_arrays()
+            self.completed = set()
+            self._write_manifest()
+
+    def _path(self, name):
+        return os.path.join( self.directory, name+'.npy' )
+
+    def _arrays(self):
+        arrays = { 'sigma': (self.size, self.num_terminals, self.num_terminals) }
+        if self.two_terminals is not None:
+            arrays['two_terminal'] = (self.size,)
+        if self.four_terminals is not None:
+            arrays['four_terminal'] = (self.size,)
+        return arrays
+
+    def _create_arrays(self):
+        for name, shape in self._arrays().items():
+            array = np.lib.format.open_memmap( self._path(name), mode='w+', dtype=float, shape=shape )
+            array[...] = np.nan
+            array.flush()
+            del array
+
+    def _read_manifest(self):
+        path = os.path.join( self.directory, self.manifest_name )
+        if not os.path.exists(path):
+            return None
+        with open(path) as manifest_file:
+            return json.load( manifest_file )
+
+    def _write_manifest(self):
+        # replace atomically, so that a crash never leaves a truncated manifest
+        path = os.path.join( self.directory, self.manifest_name )
+        with open( path+'.tmp', 'w' ) as manifest_file:
+            json.dump( { 'settings':self.settings, 'completed':sorted(self.completed) }, manifest_file )
+        os.replace( path+'.tmp', path )
+
+    def chunks(self):
+        """
+        Bounds of the chunks that are still missing.
+        """
+        return [ (start, stop) for index, (start, stop) in enumerate( _chunks( self.size, self.chunk_size ) )
+                 if index not in self.completed ]
+
+    def write(self, start, stop, sigma):
+        """
+        Called in the workers: stores one chunk and its derived conductances.
+        """
+        results = { 'sigma': sigma }
+        if self.two_terminals is not None:
+            results['two_terminal'] = two_terminal_conductance_batch( sigma, self.two_terminals )
+        if self.four_terminals is not None:
+            results['four_terminal'] = four_terminal_conductance_batch( sigma, *self.four_terminals )
+        for name, values in results.items():
+            array = np.load( self._path(name), mmap_mode='r+' )
+            array[start:stop] = values
+            array.flush()
+            del array
+
+    def mark_done(self, start, stop):
+        self.completed.add( start//self.chunk_size )
+        self._write_manifest()
+
+    def is_complete(self):
+        return len( self.chunks() ) == 0
+
+    def load(self, name='sigma'):
+        """
+        Read-only memory map of 'sigma', 'two_terminal' or 'four_terminal' with the grid shape.
+        """
+        array = np.load( self._path(name), mmap_mode='r' )
+        return array.reshape( self.shape+array.shape[1:] )
+
+def stream_sweep(grid, directory, quantity='charge', chunk_size=1024, two_terminals=(1,2),
+                 four_terminals=None, max_workers=None, progress=None):
+    """
+    Like run_sweep, but the workers stream the results into a SweepSink in directory,
+    so the memory use does not grow with the grid. Calling it again with the same grid
+    and settings resumes an interrupted sweep. Returns the SweepSink.
+    """
+    sink = SweepSink( directory, grid, quantity, chunk_size, two_terminals, four_terminals )
+    chunks = sink.chunks()
+    done = grid.size - sum( stop-start for start, stop in chunks )
+    if chunks:
+        _run_chunks( grid, quantity, sink, chunks, max_workers, progress, done, sink.mark_done )
+    return sink
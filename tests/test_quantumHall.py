@@ -0,0 +1,171 @@
+import numpy as np
+import pytest
+
+from src import QuantumHall
+
+
+def test_mode_profiles_segment_charges():
+    # the positions differ in number from the segments, so the charges must broadcast per segment
+    segment_charge_vectors = [ [1,0.5], [1,1/3], [2,0.5], [1,0.25] ]
+    qh = QuantumHall( chirality_vector=[1,-1], charge_conduct_matrix=[[0,1],[1,0]],
+                      segment_charge_vectors=segment_charge_vectors, num_terminals=4,
+                      voltages=[1,0.5,0,0.2] )
+    positions = [ 0, 0.25, 0.5, 0.75, 1 ]
+    currents, potentials = qh.mode_profiles(positions)
+    assert currents.shape == potentials.shape == (4,len(positions),2)
+
+    mode_charges = np.array( [1,-1] )*np.array(segment_charge_vectors)
+    np.testing.assert_allclose( potentials, currents/mode_charges[:,None,:] )
+
+
+def test_ac_conductance_tensor_dc_limit():
+    arguments = dict( chirality_vector=[1,-1,1], charge_vector=[1,0.5,0.3], num_terminals=4,
+                      inter_terminal_length_vector=[1,2,0.5,3] )
+    velocity_vector = [1,1,2]
+
+    # a symmetric conduct matrix conserves the current along the segments
+    qh = QuantumHall( charge_conduct_matrix=[[0,2,1],[2,0,1.5],[1,1.5,0]], **arguments )
+    np.testing.assert_allclose( qh.ac_conductance_tensor( [0.0], velocity_vector )[0],
+                                qh.conductance_tensor(), atol=1e-12 )
+
+    qh = QuantumHall( charge_conduct_matrix=[[0,2,1],[0.5,0,1.5],[1,3,0]], **arguments )
+    assert not np.allclose( qh.ac_conductance_tensor( [0.0], velocity_vector )[0], qh.conductance_tensor() )
+
+    # counter-propagating modes with equal charges have a defective d-propagation matrix at omega = 0
+    for chirality_vector, charge_conduct_matrix in ( ( [1,-1], [[0,1],[1,0]] ),
+                                                     ( [1,-1,1], [[0,1,0],[1,0,0],[0,0,0]] ) ):
+        for length in (1,300):
+            qh = QuantumHall( chirality_vector=chirality_vector, charge_vector=np.ones( len(chirality_vector) ),
+                              charge_conduct_matrix=charge_conduct_matrix, num_terminals=4,
+                              inter_terminal_length_vector=[length]*4 )
+            sigma = qh.ac_conductance_tensor( [0.0,1e-9], np.ones( len(chirality_vector) ) )
+            np.testing.assert_allclose( sigma, np.broadcast_to( qh.conductance_tensor(), sigma.shape ), atol=1e-6 )
+
+
+def test_inter_terminal_length_vector_size():
+    with pytest.raises(ValueError):
+        QuantumHall( num_terminals=4, inter_terminal_length_vector=[1,2,3] )
+
+    qh = QuantumHall( num_terminals=4, inter_terminal_length_vector=[1,2,3,4] )
+    with pytest.raises(ValueError):
+        qh.inter_terminal_length_vector = [1,2]
+    np.testing.assert_array_equal( qh.inter_terminal_length_vector, [1,2,3,4] )
+
+
+def test_terminal_inputs_size():
+    with pytest.raises(ValueError):
+        QuantumHall( voltages=[1,0,0,0], temperatures=[1,2] )
+
+    qh = QuantumHall( num_terminals=4 )
+    qh.conductance_tensor()
+    for name, value in ( ('voltages', [1,0,0,0,0]), ('temperatures', [1,2]) ):
+        with pytest.raises(ValueError):
+            setattr( qh, name, value )
+    assert qh.num_terminals == 4
+    qh.voltages = [1,0,0,0]
+    assert qh.current_all_terminals().shape == (4,)
+
+
+def dense_potentials(sigma, source, drain):
+    # potentials for a unit current entering at source and leaving at drain, the drain grounded
+    currents = np.zeros( len(sigma) )
+    currents[source] += 1
+    currents[drain] -= 1
+    free = np.arange( len(sigma) ) != drain
+    potentials = np.zeros( len(sigma) )
+    potentials[free] = np.linalg.solve( sigma[free][:,free], currents[free] )
+    return potentials
+
+
+@pytest.mark.parametrize( 'num_terminals', [3,4,7,300] )
+def test_banded_solves_match_dense(num_terminals):
+    rng = np.random.default_rng(num_terminals)
+    conduct_matrix = rng.uniform( 0, 2, (3,3) )
+    qh = QuantumHall( chirality_vector=[1,-1,1], charge_vector=rng.uniform( 0.3, 2, 3 ),
+                      charge_conduct_matrix=conduct_matrix+conduct_matrix.T, num_terminals=num_terminals,
+                      inter_terminal_length_vector=rng.uniform( 0.1, 3, num_terminals ) )
+    sigma = qh.conductance_tensor()
+
+    if num_terminals <= 7:
+        # with three terminals the corner entries of the cyclic band are adjacent
+        terminals = np.arange(num_terminals)
+        resistances = qh.resistance_matrix().dense()
+        for source in terminals:
+            for drain in terminals[ terminals != source ]:
+                potentials = dense_potentials( sigma, source, drain )
+                np.testing.assert_allclose( resistances[source,drain],
+                                            -( potentials[:,None]-potentials[None,:] ), atol=1e-10 )
+    quadruples = rng.choice( num_terminals, (40,4) )
+    for source, drain, probe_1, probe_2 in quadruples:
+        if source == drain or probe_1 == probe_2:
+            continue
+        potentials = dense_potentials( sigma, source, drain )
+        difference = potentials[probe_1]-potentials[probe_2]
+        if abs(difference) < 1e-6*np.max( np.abs(potentials) ):
+            # the potentials do not resolve the conductance, e.g. probes downstream of each other
+            continue
+        np.testing.assert_allclose( qh.four_terminal_conductance( (source+1,drain+1), (probe_1+1,probe_2+1) ),
+                                    -1/difference, rtol=1e-8 )
+
+
+def finite_difference(qh, name, evaluate, step=1e-6):
+    # central differences of evaluate() by every entry of the input name
+    value = np.array( getattr( qh, name ), dtype=float )
+    gradient = []
+    for index in np.ndindex(value.shape):
+        shifted = []
+        for sign in (1,-1):
+            entries = value.copy()
+            entries[index] += sign*step
+            setattr( qh, name, entries )
+            shifted.append( np.asarray( evaluate() ) )
+        gradient.append( ( shifted[0]-shifted[1] )/( 2*step ) )
+    setattr( qh, name, value )
+    return np.reshape( gradient, value.shape+shifted[0].shape )
+
+
+gradient_devices = {
+    # one mode and the closed forms of two modes
+    'one mode': dict( chirality_vector=[1], charge_vector=[0.7] ),
+    'two modes': dict( chirality_vector=[1,-1], charge_vector=[1,1/3], charge_conduct_matrix=[[0,1.5],[0.8,0]],
+                       central_charge_vector=[1,0.8], heat_conduct_matrix=[[0,0.6],[0.6,0]] ),
+    # the eigendecompositions of three modes
+    'three modes': dict( chirality_vector=[1,-1,1], charge_vector=[1,0.6,0.4],
+                         charge_conduct_matrix=[[0,1.5,0.3],[0.8,0,0.5],[0.2,0.9,0]] ),
+    'segment inputs': dict( chirality_vector=[1,-1,1],
+                            segment_charge_conduct_matrices=[ [[0,1.5,0.3],[0.8,0,0.5],[0.2,0.9,0]],
+                                                              [[0,1,0],[1,0,2],[0,2,0]],
+                                                              [[0,0.4,0.1],[0.3,0,0.7],[0.5,0.2,0]],
+                                                              [[0,2,1],[2,0,1],[1,1,0]] ],
+                            # the same net charge sum(chi q) on every segment, so that sigma.1 = 0
+                            segment_charge_vectors=[ [1,0.6,0.4], [1,0.5,0.3], [0.8,0.6,0.6], [1,0.7,0.5] ] ),
+}
+
+
+@pytest.mark.parametrize( 'device', list(gradient_devices) )
+@pytest.mark.parametrize( 'quantity', ['charge','heat'] )
+def test_gradients_match_finite_differences(device, quantity):
+    qh = QuantumHall( num_terminals=4, inter_terminal_length_vector=[1,2,0.5,1.5], **gradient_devices[device] )
+    measurements = [ ((1,2),(1,2)), ((1,3),(2,4)) ]
+
+    tensor_gradients = qh.conductance_tensor_gradient(quantity)
+    four_terminal, four_terminal_gradients = qh.four_terminal_conductance_gradient( *measurements[1], quantity=quantity )
+    conductances, gradients = qh.conductance_gradients( measurements, quantity )
+    np.testing.assert_allclose( four_terminal, qh.four_terminal_conductance( *measurements[1], quantity=quantity ) )
+    np.testing.assert_allclose( conductances, [ qh.four_terminal_conductance( *measurement, quantity=quantity )
+                                                for measurement in measurements ] )
+
+    for name in tensor_gradients:
+        np.testing.assert_allclose( tensor_gradients[name],
+                                    finite_difference( qh, name, lambda: qh.conductance_tensor(quantity) ),
+                                    rtol=1e-6, atol=1e-8 )
+        if name == 'segment_charge_vectors':
+            # changing the net charge of one segment only leaves the potentials defined up to
+            # a vector other than the constant one, so the measurements depend on the ground
+            continue
+        np.testing.assert_allclose( four_terminal_gradients[name],
+                                    finite_difference( qh, name, lambda: qh.four_terminal_conductance(
+                                        *measurements[1], quantity=quantity ) ), rtol=1e-6, atol=1e-8 )
+        expected = finite_difference( qh, name, lambda: [ qh.four_terminal_conductance( *measurement, quantity=quantity )
+                                                          for measurement in measurements ] )
+        np.testing.assert_allclose( gradients[name], np.moveaxis( expected, -1, 0 ), rtol=1e-6, atol=1e-8 )
@@ -0,0 +1,41 @@
+import numpy as np
+
+from src import QuantumHall, FloatingContactSolver
+
+
+def device(**arguments):
+    # nu = 2/3 bar with symmetric segments
+    return QuantumHall( chirality_vector=[1,-1], charge_vector=[1,1/3], charge_conduct_matrix=[[0,2],[2,0]],
+                        heat_conduct_matrix=[[0,1],[1,0]], voltages=[1,0.2,0,0.5], temperatures=[0.3,0.1,0.2,0.4],
+                        **arguments )
+
+
+def test_currents_without_floating_terminals():
+    qh = device( inter_terminal_length_vector=[1,2,0.5,3] )
+    solver = FloatingContactSolver( qh, [] )
+    for quantity, biases in ( ('charge', qh.voltages), ('heat', qh.temperatures) ):
+        result = solver.solve( biases, quantity )
+        np.testing.assert_allclose( result.currents, qh.current_all_terminals(quantity), atol=1e-15 )
+        np.testing.assert_allclose( result.currents_SI, qh.current_all_terminals( quantity, 'SI' ), atol=1e-27 )
+    np.testing.assert_allclose( result.currents, qh.conductance_tensor('heat') @ qh.temperatures**2/2 )
+
+
+def test_floating_temperatures_balance_T_squared():
+    qh = device()
+    heat_conduct_matrix = np.asarray( qh.heat_conduct_matrix )
+    for heat_conduct_function in ( None, lambda temperatures: np.broadcast_to( heat_conduct_matrix, temperatures.shape+(2,2) ) ):
+        solver = FloatingContactSolver( qh, [2,4], heat_conduct_function )
+        result = solver.solve( [0.3,0.1], 'heat' )
+        assert np.all(result.converged)
+
+        # the floating contacts sit at the mean of T^2, not of T
+        np.testing.assert_allclose( result.potentials[[1,3]], np.sqrt( (0.3**2+0.1**2)/2 ) )
+        np.testing.assert_allclose( result.currents[[1,3]], 0, atol=1e-12 )
+        np.testing.assert_allclose( result.currents, qh.conductance_tensor('heat') @ result.potentials**2/2, atol=1e-12 )
+
+        # the hot and the cold terminal carry opposite currents, signed as the charge currents
+        charges = solver.solve( [0.3,0.1], 'charge' ).currents_SI
+        assert charges[0] < 0 < charges[2]
+        assert result.currents_SI[0] < 0 < result.currents_SI[2]
+        np.testing.assert_allclose( result.currents_SI[0], -result.currents_SI[2] )
+        np.testing.assert_allclose( result.currents_SI, result.currents*9.464298e-13 )
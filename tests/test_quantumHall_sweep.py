@@ -0,0 +1,53 @@
+import json
+import os
+
+import numpy as np
+import pytest
+
+from src import ParameterGrid, SweepSink, run_sweep, stream_sweep
+
+
+def grid(conduct_values=(0,0.5,1,2,4)):
+    return ParameterGrid( dict( chirality_vector=[1,-1], charge_vector=[1,1/3], num_terminals=4 ),
+                          { ('charge_conduct_matrix', ((0,1),(1,0))): conduct_values,
+                            ('charge_vector', 1): [0.2,1/3,0.5,1] } )
+
+
+def test_stream_sweep_resumes_missing_chunks(tmp_path):
+    directory = str(tmp_path)
+    sweep = grid()
+    stream_sweep( sweep, directory, chunk_size=3, four_terminals=((1,3),(2,4)), max_workers=2 )
+
+    # interrupt the sweep: chunks 1 and 4 are lost
+    manifest_path = os.path.join( directory, SweepSink.manifest_name )
+    with open(manifest_path) as manifest_file:
+        manifest = json.load(manifest_file)
+    manifest['completed'] = [ chunk for chunk in manifest['completed'] if chunk not in (1,4) ]
+    with open(manifest_path, 'w') as manifest_file:
+        json.dump( manifest, manifest_file )
+    for name in ( 'sigma', 'two_terminal', 'four_terminal' ):
+        array = np.load( os.path.join( directory, name+'.npy' ), mmap_mode='r+' )
+        array[3:6] = np.nan
+        array[12:15] = np.nan
+        array.flush()
+        del array
+
+    progress = []
+    sink = stream_sweep( sweep, directory, chunk_size=3, four_terminals=((1,3),(2,4)), max_workers=2,
+                         progress=lambda done, total: progress.append(done) )
+    # only the two missing chunks are computed, on top of the 14 points already on disk
+    assert sorted(progress) == [17,20]
+    assert sink.is_complete()
+
+    sigma = run_sweep( sweep, chunk_size=3, max_workers=2 )
+    np.testing.assert_array_equal( sink.load('sigma'), sigma )
+    assert not np.any( np.isnan( sink.load('two_terminal') ) )
+
+
+def test_sweep_sink_rejects_another_sweep(tmp_path):
+    directory = str(tmp_path)
+    stream_sweep( grid(), directory, chunk_size=3, max_workers=1 )
+    with pytest.raises(ValueError):
+        stream_sweep( grid( (0,0.5,1,2,8) ), directory, chunk_size=3, max_workers=1 )
+    with pytest.raises(ValueError):
+        SweepSink( directory, grid(), chunk_size=4 )